@@ -0,0 +1,254 @@
+'''
+file: benchmark_builders.py
+
+Benchmarks the table builders on synthetic inputs.
+
+For every requested scale, generates a mode input file, a name mapping file and a link input file,
+then runs create_mambo_mode_table, create_mapping_table, create_mapped_mode_table and
+create_mambo_crossnet_table (line-by-line and streaming) on them. Every builder runs in its own
+process, so that peak memory can be measured per builder. One JSON object per builder and
+scale is written to the output, with the rows processed, seconds, rows per second, peak RSS,
+output bytes and the stage timings and row counters reported by the builder.
+
+Usage:
+python benchmark_builders.py
+
+Optional arguments:
+--rows                   Number of input rows; may be given several times. Defaults to 10000 and 100000.
+--num_attrs              Number of attribute columns in the mode and link inputs. Defaults to 2.
+--dup_ratio              Fraction of input rows that repeat an earlier node id. Defaults to 0.1.
+--benchmarks             Builders to run: mode, mapping, mapped_mode, crossnet, crossnet_streaming.
+                         Defaults to all of them.
+--work_dir               Directory for the generated inputs and outputs. Defaults to a temporary
+                         directory that is removed afterwards.
+--output                 File to append the JSON results to. Defaults to stdout.
+--seed                   Random seed of the generators. Defaults to 0.
+
+Example usage:
+python benchmark_builders.py --rows 10000 --rows 1000000 --num_attrs 4 --output results.jsonl
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import utils
+from metrics import BuildMetrics
+from create_mambo_crossnet_table import create_mambo_crossnet_table
+from create_mambo_mode_table import create_mambo_mode_table
+from create_mapped_mode_table import create_mapped_mode_table
+from create_mapping_table import create_mapping_table
+
+BENCHMARKS = ['mode', 'mapping', 'mapped_mode', 'crossnet', 'crossnet_streaming']
+WRITE_BATCH = 1 << 14
+
+
+def node_name(i):
+    return 'ENSG%011d' % i
+
+
+def write_lines(path, lines):
+    '''Writes an iterable of lines to path in batches.'''
+    with open(path, 'w') as outF:
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) == WRITE_BATCH:
+                outF.writelines(batch)
+                batch = []
+        outF.writelines(batch)
+
+
+def generate_node_ids(num_rows, dup_ratio, rng):
+    '''Yields num_rows node indices; a dup_ratio fraction of them repeat an earlier index.'''
+    num_unique = 0
+    for _ in range(num_rows):
+        if num_unique > 0 and rng.random() < dup_ratio:
+            yield rng.randrange(num_unique)
+        else:
+            yield num_unique
+            num_unique += 1
+
+
+def generate_attrs(num_attrs, rng):
+    return ''.join(['\t%.4f' % rng.random() for _ in range(num_attrs)])
+
+
+def generate_inputs(work_dir, num_rows, num_attrs, dup_ratio, seed):
+    '''Generates the synthetic inputs of one scale, without holding them in memory. Returns a
+    dictionary of their paths and the number of distinct node ids.'''
+    rng = random.Random(seed)
+    paths = {
+        'mode_input': os.path.join(work_dir, 'mode_input.tsv'),
+        'mapping_input': os.path.join(work_dir, 'mapping_input.tsv'),
+        'link_input': os.path.join(work_dir, 'link_input.tsv'),
+    }
+    num_nodes = 0
+    with open(paths['mode_input'], 'w') as modeF, open(paths['mapping_input'], 'w') as mapF:
+        modeF.write('# node_id\n')
+        mode_lines = []
+        map_lines = []
+        for i in generate_node_ids(num_rows, dup_ratio, rng):
+            num_nodes = max(num_nodes, i + 1)
+            mode_lines.append('%s%s\n' % (node_name(i), generate_attrs(num_attrs, rng)))
+            map_lines.append('%s\tALT%011d\n' % (node_name(i), i))
+            if len(mode_lines) == WRITE_BATCH:
+                modeF.writelines(mode_lines)
+                mapF.writelines(map_lines)
+                mode_lines = []
+                map_lines = []
+        modeF.writelines(mode_lines)
+        mapF.writelines(map_lines)
+    write_lines(paths['link_input'],
+                ('%s\t%s%s\n' % (node_name(rng.randrange(num_nodes)), node_name(rng.randrange(num_nodes)),
+                                  generate_attrs(num_attrs, rng)) for _ in range(num_rows)))
+    return paths, num_nodes
+
+
+def output_bytes(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+
+def run_mode(inputs, out_dir, metrics=None):
+    full_file = os.path.join(out_dir, 'miner-bench-full.tsv')
+    db_file = os.path.join(out_dir, utils.get_mode_file_name('bench', 0, 'SYN'))
+    create_mambo_mode_table(inputs['mode_input'], db_id=0, mode_name='bench', dataset_name='SYN',
+                           full_mode_file=full_file, output_dir=out_dir, db_node_file=db_file,
+                           mambo_id_counter_start=0, node_index=0, metrics=metrics)
+    return [full_file, db_file]
+
+
+def run_mapping(inputs, out_dir, metrics=None):
+    output_file = os.path.join(out_dir, 'mapping.tsv')
+    create_mapping_table(inputs['mapping_input'], mindex1=0, mindex2=1, output_file=output_file,
+                         output_index1=0, output_index2=1, output_title1='ENSG', output_title2='ALT',
+                         metrics=metrics)
+    return [output_file]
+
+
+def run_mapped_mode(inputs, out_dir, metrics=None):
+    full_file = os.path.join(out_dir, 'miner-bench-mapped-full.tsv')
+    db_file = os.path.join(out_dir, 'miner-bench-mapped-0-SYN.tsv')
+    create_mapped_mode_table('bench', inputs['mode_input'], dataset_name='SYN', db_id=0,
+                             mapping_file=inputs['mapping'], skip=False, map_index=1, node_index=0,
+                             output_dir=out_dir, full_mode_file=full_file, db_node_file=db_file,
+                             metrics=metrics)
+    return [full_file, db_file]
+
+
+def run_crossnet(inputs, out_dir, metrics=None, streaming=False):
+    full_file = os.path.join(out_dir, 'miner-bench-bench-full.tsv')
+    db_file = os.path.join(out_dir, 'miner-bench-bench-0-SYN.tsv')
+    create_mambo_crossnet_table(inputs['link_input'], src_file=inputs['mode'], dst_file=inputs['mode'],
+                                dataset_name='SYN', db_id=0, src_node_index=0, dst_node_index=1,
+                                mode_name1=None, mode_name2=None, output_dir=out_dir,
+                                full_crossnet_file=full_file, db_edge_file=db_file, src_mode_filter=None,
+                                dst_mode_filter=None, mambo_id_counter_start=0, skip_missing_ids=True,
+                                streaming=streaming, metrics=metrics)
+    return [full_file, db_file]
+
+
+def run_crossnet_streaming(inputs, out_dir, metrics=None):
+    return run_crossnet(inputs, out_dir, metrics, streaming=True)
+
+
+RUNNERS = {
+    'mode': run_mode,
+    'mapping': run_mapping,
+    'mapped_mode': run_mapped_mode,
+    'crossnet': run_crossnet,
+    'crossnet_streaming': run_crossnet_streaming,
+}
+
+
+def _run_in_child(name, inputs, out_dir, queue):
+    metrics = BuildMetrics(name)
+    start = time.time()
+    outputs = RUNNERS[name](inputs, out_dir, metrics)
+    seconds = time.time() - start
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    queue.put({'seconds': seconds,
+               'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+               'output_bytes': output_bytes(outputs),
+               'stages': metrics.stages,
+               'counters': metrics.counters})
+
+
+def run_benchmark(name, inputs, out_dir):
+    '''Runs one builder in a child process and returns its measurements.'''
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_in_child, args=(name, inputs, out_dir, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError('Benchmark %s failed with exit code %s' % (name, process.exitcode))
+    return queue.get()
+
+
+def run_benchmarks(rows, num_attrs=2, dup_ratio=0.1, benchmarks=BENCHMARKS, work_dir=None, seed=0):
+    '''Runs the benchmarks at every scale in rows and returns a list of result dictionaries.'''
+    remove_work_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix='mambo-bench-')
+    results = []
+    try:
+        for num_rows in rows:
+            scale_dir = os.path.join(work_dir, str(num_rows))
+            if not os.path.isdir(scale_dir):
+                os.makedirs(scale_dir)
+            inputs, num_nodes = generate_inputs(scale_dir, num_rows, num_attrs, dup_ratio, seed)
+            # Inputs of the builders that depend on the output of another builder.
+            setup_dir = os.path.join(scale_dir, 'setup')
+            if any(name.startswith('crossnet') for name in benchmarks):
+                inputs['mode'] = run_mode(inputs, _fresh_dir(setup_dir))[1]
+            if 'mapped_mode' in benchmarks:
+                mapping_dir = _fresh_dir(os.path.join(scale_dir, 'setup-mapping'))
+                inputs['mapping'] = run_mapping(inputs, mapping_dir)[0]
+            for name in benchmarks:
+                measured = run_benchmark(name, inputs, os.path.join(scale_dir, name))
+                result = {'benchmark': name, 'rows': num_rows, 'num_attrs': num_attrs,
+                          'dup_ratio': dup_ratio, 'distinct_nodes': num_nodes,
+                          'rows_per_sec': num_rows / measured['seconds'] if measured['seconds'] > 0 else None}
+                result.update(measured)
+                results.append(result)
+    finally:
+        if remove_work_dir:
+            shutil.rmtree(work_dir)
+    return results
+
+
+def _fresh_dir(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the mambo table builders on synthetic inputs')
+    parser.add_argument('--rows', type=int, action='append', help='number of input rows; may be repeated')
+    parser.add_argument('--num_attrs', type=int, help='attribute columns in the mode and link inputs', default=2)
+    parser.add_argument('--dup_ratio', type=float, help='fraction of rows repeating an earlier node id', default=0.1)
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--work_dir', help='directory for generated inputs and outputs', default=None)
+    parser.add_argument('--output', help='file to append JSON results to; defaults to stdout', default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.rows or [10000, 100000], args.num_attrs, args.dup_ratio,
+                             args.benchmarks, args.work_dir, args.seed)
+    outF = open(args.output, 'a') if args.output else sys.stdout
+    for result in results:
+        outF.write(json.dumps(result, sort_keys=True) + '\n')
+    if args.output:
+        outF.close()
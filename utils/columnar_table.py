@@ -0,0 +1,357 @@
+'''
+file: columnar_table.py
+
+Binary columnar version of the Mambo mode and crossnet tables.
+
+A columnar table is a directory, by default named like the tsv table it mirrors but with a
+.cols extension (e.g. miner-gene-20160520.cols for miner-gene-20160520.tsv or miner-gene-20160520.tsv.gz). It
+contains:
+
+schema.json:             Column names and types, and the number of rows.
+<column>.i64:            For int64 columns, the values as little-endian fixed-width integers.
+<column>.off             For string columns, the end offset of every value in the string heap,
+                         as little-endian int64.
+<column>.heap            For string columns, the utf-8 encoded values, one after the other.
+
+All files are only ever appended to, so full tables can grow one dataset at a time like their tsv
+counterparts. schema.json is rewritten after the rows are, so it only counts complete appends;
+before appending, the column files are truncated to the sizes implied by its number of rows,
+which drops the rows of an append that was interrupted. ColumnarTable memory-maps the files and exposes the columns as NumPy arrays, so
+loading a table costs page faults instead of text parsing.
+
+Usage:
+python columnar_table.py <tsv_file> <table_type>
+
+Positional Arguments:
+tsv_file:                Path to a table written by one of the create_* scripts.
+table_type:              One of full_mode, mapped_full_mode, mode, full_crossnet, crossnet.
+
+Optional arguments:
+--output_dir:            Path of the columnar table. Defaults to the tsv file path with a .cols extension.
+'''
+
+import argparse
+import compression
+import json
+import mmap
+import os
+import struct
+import utils
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INT64 = 'int64'
+STR = 'str'
+SCHEMA_FILE = 'schema.json'
+COMMENT = '#'
+DELIMITER = '\t'
+BATCH_SIZE = 1 << 16
+
+FULL_MODE_SCHEMA = [('mambo_nid', INT64), ('dataset_id', INT64)]
+MAPPED_FULL_MODE_SCHEMA = [('mambo_nid', INT64), ('dataset_ids', STR)]
+MODE_SCHEMA = [('mambo_nid', INT64), ('dataset_nid', STR), ('attrs', STR)]
+FULL_CROSSNET_SCHEMA = [('mambo_eid', INT64), ('dataset_id', INT64),
+                        ('src_mambo_nid', INT64), ('dst_mambo_nid', INT64)]
+CROSSNET_SCHEMA = [('mambo_eid', INT64), ('src_dataset_id', INT64),
+                   ('dst_dataset_id', INT64), ('attrs', STR)]
+SCHEMAS = {
+    'full_mode': FULL_MODE_SCHEMA,
+    'mapped_full_mode': MAPPED_FULL_MODE_SCHEMA,
+    'mode': MODE_SCHEMA,
+    'full_crossnet': FULL_CROSSNET_SCHEMA,
+    'crossnet': CROSSNET_SCHEMA,
+}
+
+
+def get_columnar_dir_name(tsv_file):
+    '''Returns the default path of the columnar table mirroring the given tsv table.
+
+    Input:
+        tsv_file: path to the tsv table.
+    Output:
+        path to the columnar table directory.
+    '''
+    return os.path.splitext(compression.strip_compression_suffix(tsv_file))[0] + '.cols'
+
+
+def truncate_columns(path, schema, num_rows):
+    '''Truncates the column files of a columnar table to the sizes implied by num_rows, dropping
+    anything written after the last complete append.
+
+    Input:
+        path: path of the columnar table.
+        schema: list of (column name, column type) pairs.
+        num_rows: number of rows recorded in schema.json.
+    Output:
+        a list with the heap size of every string column, and None for int64 columns.
+    '''
+    heap_sizes = []
+    for name, col_type in schema:
+        col_file = os.path.join(path, name + ('.i64' if col_type == INT64 else '.off'))
+        sizes = [(col_file, 8 * num_rows)]
+        heap_size = None
+        if col_type != INT64:
+            heap_size = 0
+            if num_rows > 0:
+                with open(col_file, 'rb') as inF:
+                    inF.seek(8 * (num_rows - 1))
+                    last = inF.read(8)
+                if len(last) == 8:
+                    heap_size = struct.unpack('<q', last)[0]
+            sizes.append((os.path.join(path, name + '.heap'), heap_size))
+        for file_name, size in sizes:
+            actual = os.path.getsize(file_name) if os.path.isfile(file_name) else 0
+            if actual < size:
+                raise ValueError('%s holds fewer than the %d rows in %s' % (file_name, num_rows, SCHEMA_FILE))
+            if actual > size:
+                with open(file_name, 'r+b') as outF:
+                    outF.truncate(size)
+        heap_sizes.append(heap_size)
+    return heap_sizes
+
+
+class ColumnarTableWriter(object):
+    '''Writes rows to a columnar table, creating it or appending to it.'''
+
+    def __init__(self, path, schema, append=False):
+        self.path = path
+        self.schema = schema
+        self.num_rows = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        schema_file = os.path.join(path, SCHEMA_FILE)
+        if append and os.path.isfile(schema_file):
+            with open(schema_file, 'r') as inF:
+                existing = json.load(inF)
+            if [tuple(col) for col in existing['columns']] != [tuple(col) for col in schema]:
+                raise ValueError('Schema of %s does not match %s' % (path, schema))
+            self.num_rows = existing['num_rows']
+            self.heap_sizes = truncate_columns(path, schema, self.num_rows)
+        else:
+            append = False
+            self.heap_sizes = [None if col_type == INT64 else 0 for _, col_type in schema]
+        mode = 'ab' if append else 'wb'
+        self.files = []
+        for name, col_type in schema:
+            if col_type == INT64:
+                self.files.append((open(os.path.join(path, name + '.i64'), mode), None))
+            else:
+                self.files.append((open(os.path.join(path, name + '.off'), mode),
+                                   open(os.path.join(path, name + '.heap'), mode)))
+
+    def write_rows(self, rows):
+        '''Appends a list of rows; each row is a sequence with one value per column.'''
+        if not rows:
+            return
+        for i, (name, col_type) in enumerate(self.schema):
+            values = [row[i] for row in rows]
+            if col_type == INT64:
+                self.files[i][0].write(struct.pack('<%dq' % len(values), *[int(v) for v in values]))
+            else:
+                encoded = [v.encode('utf-8') if not isinstance(v, bytes) else v for v in values]
+                offsets = []
+                heap_size = self.heap_sizes[i]
+                for value in encoded:
+                    heap_size += len(value)
+                    offsets.append(heap_size)
+                self.files[i][0].write(struct.pack('<%dq' % len(offsets), *offsets))
+                self.files[i][1].write(b''.join(encoded))
+                self.heap_sizes[i] = heap_size
+        self.num_rows += len(rows)
+
+    def close(self):
+        for col_file, heap_file in self.files:
+            col_file.close()
+            if heap_file is not None:
+                heap_file.close()
+        schema_file = os.path.join(self.path, SCHEMA_FILE)
+        tmp_file = '%s.tmp%d' % (schema_file, os.getpid())
+        with open(tmp_file, 'w') as outF:
+            json.dump({'columns': self.schema, 'num_rows': self.num_rows}, outF)
+        os.rename(tmp_file, schema_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_columnar_table(tsv_file, schema, path=None, offset=0, append=False, delimiter=DELIMITER):
+    '''Converts the rows of a tsv table into a columnar table. The last column of the schema
+    receives the rest of each line if it is a string column.
+
+    Input:
+        tsv_file: path to the tsv table.
+        schema: list of (column name, column type) pairs, e.g. FULL_CROSSNET_SCHEMA.
+        path: path of the columnar table. Defaults to get_columnar_dir_name(tsv_file).
+        offset: byte offset in tsv_file to start reading from, e.g. the size of a full
+                table before the last append.
+        append: if True, append the rows to an existing columnar table.
+    Output:
+        the path of the columnar table.
+    '''
+    if path is None:
+        path = get_columnar_dir_name(tsv_file)
+    max_split = len(schema) - 1 if schema[-1][1] == STR else -1
+    with compression.open_file(tsv_file, 'r', offset) as inF, ColumnarTableWriter(path, schema, append) as writer:
+        rows = []
+        for line in inF:
+            if line[0] == COMMENT:
+                continue
+            vals = line.rstrip('\n').split(delimiter, max_split)
+            if len(vals) < len(schema):
+                vals.extend([''] * (len(schema) - len(vals)))
+            rows.append(vals)
+            if len(rows) == BATCH_SIZE:
+                writer.write_rows(rows)
+                rows = []
+        writer.write_rows(rows)
+    return path
+
+
+def count_rows(tsv_file, offset=0):
+    '''Returns the number of rows of a tsv table after the byte offset, skipping comments.'''
+    num_rows = 0
+    with compression.open_file(tsv_file, 'rb', offset) as inF:
+        for line in inF:
+            if line[:1] != b'#':
+                num_rows += 1
+    return num_rows
+
+
+def update_columnar_table(tsv_file, schema, offset=0, delimiter=DELIMITER):
+    '''Brings the columnar table mirroring an appended-to tsv table up to date. Only the rows
+    after offset are converted if the columnar table already exists and holds exactly the rows
+    before offset; otherwise (e.g. a build without --binary_output appended to the tsv table
+    in between, or its column files are shorter than schema.json says) it is rebuilt from the
+    whole tsv table. The ledger of tsv_file is brought up to
+    date to count its rows.
+
+    Input:
+        tsv_file: path to the tsv table.
+        schema: list of (column name, column type) pairs.
+        offset: size of tsv_file in bytes before the last append.
+    Output:
+        the path of the columnar table.
+    '''
+    path = get_columnar_dir_name(tsv_file)
+    schema_file = os.path.join(path, SCHEMA_FILE)
+    if os.path.isfile(schema_file):
+        with open(schema_file, 'r') as inF:
+            existing = json.load(inF)
+        num_rows = existing['num_rows']
+        if num_rows == utils.update_ledger(tsv_file)['num_rows'] - count_rows(tsv_file, offset):
+            try:
+                truncate_columns(path, [tuple(col) for col in existing['columns']], num_rows)
+            except ValueError:
+                return write_columnar_table(tsv_file, schema, path, 0, False, delimiter)
+            return write_columnar_table(tsv_file, schema, path, offset, True, delimiter)
+    return write_columnar_table(tsv_file, schema, path, 0, False, delimiter)
+
+
+def _map_file(file_name):
+    '''Memory-maps a file read-only; returns None for empty files, which cannot be mapped.'''
+    if os.path.getsize(file_name) == 0:
+        return None
+    with open(file_name, 'rb') as inF:
+        return mmap.mmap(inF.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _int64_view(mapped, num_rows):
+    if mapped is None:
+        return np.zeros(0, dtype='<i8')
+    return np.frombuffer(mapped, dtype='<i8', count=num_rows)
+
+
+class StrColumn(object):
+    '''A memory-mapped string column. offsets is a NumPy view of the end offsets of the values
+    in heap, which is the memory-mapped string heap.'''
+
+    def __init__(self, offsets, heap):
+        self.offsets = offsets
+        self.heap = heap
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.offsets)
+        start = int(self.offsets[i - 1]) if i > 0 else 0
+        end = int(self.offsets[i])
+        if start == end:
+            return ''
+        return self.heap[start:end].decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self.offsets)):
+            yield self[i]
+
+
+class ColumnarTable(object):
+    '''Read-only, memory-mapped view of a columnar table. Columns are accessed by name: int64
+    columns are NumPy arrays, string columns are StrColumn objects.'''
+
+    def __init__(self, path):
+        if np is None:
+            raise ImportError('numpy is required to read columnar tables')
+        self.path = path
+        with open(os.path.join(path, SCHEMA_FILE), 'r') as inF:
+            schema = json.load(inF)
+        self.schema = [tuple(col) for col in schema['columns']]
+        self.num_rows = schema['num_rows']
+        self.maps = []
+        self.columns = {}
+        for name, col_type in self.schema:
+            if col_type == INT64:
+                mapped = _map_file(os.path.join(path, name + '.i64'))
+                self.maps.append(mapped)
+                self.columns[name] = _int64_view(mapped, self.num_rows)
+            else:
+                offsets = _map_file(os.path.join(path, name + '.off'))
+                heap = _map_file(os.path.join(path, name + '.heap'))
+                self.maps.extend([offsets, heap])
+                self.columns[name] = StrColumn(_int64_view(offsets, self.num_rows), heap)
+
+    def __len__(self):
+        return self.num_rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def column_names(self):
+        return [name for name, _ in self.schema]
+
+    def close(self):
+        self.columns = {}
+        for mapped in self.maps:
+            if mapped is not None:
+                mapped.close()
+        self.maps = []
+
+
+def load_columnar_table(path):
+    '''Memory-maps the columnar table at path, or the one mirroring path if it is a tsv table.
+
+    Input:
+        path: path to a columnar table directory, or to the tsv table it mirrors.
+    Output:
+        a ColumnarTable.
+    '''
+    if not os.path.isdir(path):
+        path = get_columnar_dir_name(path)
+    return ColumnarTable(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert a mambo tsv table to a binary columnar table')
+    parser.add_argument('tsv_file', help='table written by one of the create_* scripts')
+    parser.add_argument('table_type', choices=sorted(SCHEMAS.keys()), help='kind of table')
+    parser.add_argument('--output_dir', help='path of the columnar table; defaults to the tsv path with a .cols extension', default=None)
+    args = parser.parse_args()
+
+    write_columnar_table(args.tsv_file, SCHEMAS[args.table_type], args.output_dir)
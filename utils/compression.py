@@ -0,0 +1,231 @@
+'''
+file: compression.py
+
+Transparent reading and writing of compressed tables. The table builders and
+utils.read_mode_file open their input and output files with open_file, which picks the
+compression from the file name:
+
+.gz                      gzip. Read and written with pigz when it is installed (multi-threaded
+                         compression), else with the gzip command and else with the gzip module.
+                         The commands run in a separate process, so (de)compression overlaps with
+                         parsing; reading through the gzip command is about 4 times faster than
+                         through the gzip module.
+.zst, .zstd              Zstandard. Read and written with the zstandard module when it is installed
+                         (multi-threaded compression), and with the zstd command otherwise.
+
+Any other name is opened as a plain file. Appending to a compressed file adds a new gzip member
+or zstd frame, which readers decompress as if the file had been written at once. Since every
+append starts at the previous end of the file, a compressed table can be read from the byte
+offset of an earlier size (see the offset argument of open_file), which is how the ledgers of
+compressed full tables are brought up to date.
+
+Example usage:
+
+with open_file('protein.links.detailed.v10.txt.gz') as inF:
+    for line in inF:
+        ...
+'''
+
+import gzip
+import io
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+SUFFIXES = {'.gz': GZIP, '.zst': ZSTD, '.zstd': ZSTD}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+PY3 = sys.version_info[0] >= 3
+
+
+def get_compression(path):
+    '''Returns GZIP, ZSTD or None, depending on the suffix of path.'''
+    return SUFFIXES.get(os.path.splitext(path)[1].lower())
+
+
+def strip_compression_suffix(path):
+    '''Returns path without its compression suffix, e.g. miner-gene-20160520.tsv for
+    miner-gene-20160520.tsv.gz.'''
+    if get_compression(path) is not None:
+        return os.path.splitext(path)[0]
+    return path
+
+
+def _restore_sigpipe():
+    # Python ignores SIGPIPE and children inherit that, so a decompressor whose reader stops
+    # early would fail with a write error instead of exiting quietly.
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def find_executable(name):
+    '''Returns the path of an executable on the PATH, or None.'''
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+class _ProcessFile(object):
+    '''A file whose contents are piped through a (de)compression process. Behaves like the
+    stream it wraps; closing it waits for the process and fails if the process did.'''
+
+    def __init__(self, args, stream_name, raw, text):
+        self.args = args
+        self.raw = raw
+        if stream_name == 'stdout':
+            self.process = subprocess.Popen(args, stdin=raw, stdout=subprocess.PIPE,
+                                            preexec_fn=_restore_sigpipe)
+            stream = self.process.stdout
+        else:
+            self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=raw)
+            stream = self.process.stdin
+        if text and PY3:
+            stream = io.TextIOWrapper(stream)
+        self.stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.process is None:
+            return
+        process = self.process
+        self.process = None
+        try:
+            self.stream.close()
+        finally:
+            returncode = process.wait()
+            self.raw.close()
+        # A reader closed before the end of its input kills the process with SIGPIPE.
+        if returncode != 0 and returncode != -13:
+            raise IOError('%s failed with exit code %d' % (self.args[0], returncode))
+
+
+class _WrappedFile(object):
+    '''A (de)compressing stream together with the raw file it reads from or writes to; closing
+    it closes both.'''
+
+    def __init__(self, stream, raw, inner=None):
+        self.stream = stream
+        self.raw = raw
+        self.inner = inner
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        try:
+            self.stream.close()
+            if self.inner is not None:
+                self.inner.close()
+        finally:
+            self.raw.close()
+
+
+def _open_raw(path, mode, offset):
+    raw = open(path, mode + 'b')
+    if offset:
+        raw.seek(offset)
+    return raw
+
+
+def _open_gzip(path, mode, offset, text, threads):
+    raw = _open_raw(path, 'r' if mode == 'r' else mode, offset)
+    pigz = find_executable('pigz')
+    if pigz is not None:
+        if mode == 'r':
+            return _ProcessFile([pigz, '-dc'], 'stdout', raw, text)
+        return _ProcessFile([pigz, '-c', '-%d' % GZIP_LEVEL, '-p', str(threads)], 'stdin', raw, text)
+    gzip_command = find_executable('gzip')
+    if gzip_command is not None:
+        if mode == 'r':
+            return _ProcessFile([gzip_command, '-dc'], 'stdout', raw, text)
+        return _ProcessFile([gzip_command, '-c', '-%d' % GZIP_LEVEL], 'stdin', raw, text)
+    stream = gzip.GzipFile(fileobj=raw, mode='rb' if mode == 'r' else 'wb', compresslevel=GZIP_LEVEL)
+    if text and PY3:
+        return _WrappedFile(io.TextIOWrapper(stream), raw, stream)
+    return _WrappedFile(stream, raw)
+
+
+def _open_zstd(path, mode, offset, text, threads):
+    raw = _open_raw(path, 'r' if mode == 'r' else mode, offset)
+    if zstandard is not None:
+        if mode == 'r':
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        else:
+            stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=threads).stream_writer(raw)
+        # Line iteration needs a buffered stream.
+        stream = io.BufferedReader(stream) if mode == 'r' else io.BufferedWriter(stream)
+        if text and PY3:
+            stream = io.TextIOWrapper(stream)
+        return _WrappedFile(stream, raw)
+    zstd = find_executable('zstd')
+    if zstd is None:
+        raw.close()
+        raise IOError('Reading or writing %s requires the zstandard module or the zstd command' % path)
+    if mode == 'r':
+        return _ProcessFile([zstd, '-q', '-dc'], 'stdout', raw, text)
+    return _ProcessFile([zstd, '-q', '-c', '-%d' % ZSTD_LEVEL, '-T%d' % threads], 'stdin', raw, text)
+
+
+def open_file(path, mode='r', offset=0, compression=None, threads=None):
+    '''Opens a plain or compressed file.
+
+    Input:
+        path: path to the file.
+        mode: 'r', 'w' or 'a', optionally followed by 'b' for bytes.
+        offset: byte offset in the (compressed) file to start reading from. For a compressed
+                file it must be a size the file had after an earlier write or append.
+        compression: GZIP, ZSTD or None; defaults to get_compression(path).
+        threads: number of compression threads; defaults to the number of CPUs.
+    Output:
+        a file object, which can be used in a with statement.
+    '''
+    text = not mode.endswith('b')
+    base_mode = mode.rstrip('b')
+    if base_mode not in ('r', 'w', 'a'):
+        raise ValueError('Invalid mode: %s' % mode)
+    if compression is None:
+        compression = get_compression(path)
+    if compression is None:
+        inF = open(path, mode)
+        if offset:
+            inF.seek(offset)
+        return inF
+    if base_mode == 'r' and offset >= os.path.getsize(path):
+        # Nothing was appended since offset; the decompressors reject empty input.
+        return io.StringIO() if text and PY3 else io.BytesIO()
+    threads = threads or multiprocessing.cpu_count()
+    if compression == GZIP:
+        return _open_gzip(path, base_mode, offset, text, threads)
+    if compression == ZSTD:
+        return _open_zstd(path, base_mode, offset, text, threads)
+    raise ValueError('Unknown compression: %s' % compression)
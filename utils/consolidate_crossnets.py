@@ -0,0 +1,210 @@
+'''
+file: consolidate_crossnets.py
+
+Script that collapses the duplicate edges of full crossnet tables. A full crossnet table has one
+row per dataset and edge, so an edge reported by several datasets (e.g. several GeneMANIA studies,
+or several STRING channels when their tables are consolidated together) appears several times. The
+consolidated table has one row per src/dst pair, and a side table records which datasets
+contributed the edge and their mambo edge ids, so no provenance is lost.
+
+The datasets are numbered across the input tables: source i is the i-th (input table, dataset id)
+pair, in input table order and then dataset id order, and is bit i of the dataset bitsets. With a
+single input table whose dataset ids are 0, 1, 2, ..., source i is dataset i.
+
+Edges are directed by default: rows a -> b and b -> a are different edges. Crossnets within a single
+mode (e.g. gene-gene interactions) are loaded undirected, so for them the --undirected flag merges
+reversed pairs too: every pair is stored as (smaller node id, larger node id).
+
+Outputs:
+output_file              The consolidated table, in the layout of a full crossnet table: mambo_eid,
+                         dataset_id, src_mambo_nid and dst_mambo_nid, where mambo_eid is a new edge id
+                         (0, 1, 2, ... in the order the edges first appear in the input tables) and
+                         dataset_id is the dataset id of the lowest contributing source, i.e. a dataset
+                         of the input tables that reported the edge; the provenance table lists all of
+                         them. It can be loaded with network_utils.load_crossnet_to_graph.
+<output>.provenance.tsv  Per consolidated edge: mambo_eid, the bitset of the contributing sources as a
+                         hexadecimal number, and the contributing mambo edge ids of the input tables, as
+                         comma separated <source>:<mambo_eid> pairs. Compressed like output_file.
+<output>.sources.json    The input table and dataset id of every source.
+
+Usage:
+python consolidate_crossnets.py <output_file> <input_files>...
+
+Positional Arguments:
+output_file:             Path of the consolidated table.
+input_files:             Full crossnet tables, as outputted by create_mambo_crossnet_table.py, of crossnets
+                         between the same two modes.
+
+Optional arguments:
+--undirected             Flag; Merge reversed pairs too, for crossnets within a single mode.
+--binary_output          Flag; Also write a binary columnar version of the consolidated table (see
+                         columnar_table.py).
+--metrics_file           Append the row counters of the consolidation to this file as a JSON line.
+
+Example usage:
+python consolidate_crossnets.py gene-gene/miner-gene-gene-consolidated.tsv gene-gene/*_links/miner-gene-gene-*.tsv
+'''
+
+import argparse
+import columnar_table
+import compression
+import csr_adjacency
+import json
+import os
+import utils
+from metrics import BuildMetrics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DELIMITER = '\t'
+WRITE_BATCH_SIZE = 1 << 16
+
+
+def get_provenance_file_name(output_file):
+    '''Returns the path of the provenance table, compressed like the consolidated table.'''
+    stripped = compression.strip_compression_suffix(output_file)
+    return os.path.splitext(stripped)[0] + '.provenance.tsv' + output_file[len(stripped):]
+
+
+def get_sources_file_name(output_file):
+    return os.path.splitext(compression.strip_compression_suffix(output_file))[0] + '.sources.json'
+
+
+def read_input_tables(input_files):
+    '''Reads full crossnet tables and numbers their datasets as sources; see the file header.
+
+    Output:
+        a tuple (sources, eids, source_ids, srcs, dsts): the list of (input file, dataset id)
+        pairs, and int64 arrays with one entry per input row, in input order.
+    '''
+    sources = []
+    columns = []
+    for input_file in input_files:
+        eids, dataset_ids, srcs, dsts = csr_adjacency.read_full_crossnet_table(input_file)
+        table_dataset_ids = np.unique(dataset_ids)
+        source_ids = np.searchsorted(table_dataset_ids, dataset_ids) + len(sources)
+        sources.extend((input_file, int(dataset_id)) for dataset_id in table_dataset_ids)
+        columns.append((eids, source_ids, srcs, dsts))
+    if not columns:
+        return (sources,) + (np.zeros(0, dtype=np.int64),) * 4
+    eids, source_ids, srcs, dsts = [np.concatenate(column) for column in zip(*columns)]
+    return sources, eids, source_ids, srcs, dsts
+
+
+def consolidate_edges(eids, source_ids, srcs, dsts):
+    '''Groups the rows with the same src/dst pair.
+
+    Output:
+        a tuple (order, starts): order sorts the rows by consolidated edge, and then by source
+        and mambo edge id; the rows of consolidated edge i are order[starts[i]:starts[i + 1]].
+        Consolidated edges are numbered in the order their first row appears in the inputs.
+    '''
+    num_rows = len(eids)
+    if num_rows == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64)
+    # Input position of every row, which orders the rows as they appear in the input tables.
+    positions = np.arange(num_rows)
+    by_pair = np.lexsort((positions, dsts, srcs))
+    first = np.ones(num_rows, dtype=bool)
+    first[1:] = (srcs[by_pair][1:] != srcs[by_pair][:-1]) | (dsts[by_pair][1:] != dsts[by_pair][:-1])
+    group_starts = np.flatnonzero(first)
+    # The first row of a group in by_pair order is its earliest row in the inputs.
+    group_order = np.argsort(by_pair[group_starts], kind='mergesort')
+    group_ids = np.empty(len(group_starts), dtype=np.int64)
+    group_ids[group_order] = np.arange(len(group_starts))
+    row_groups = np.empty(num_rows, dtype=np.int64)
+    row_groups[by_pair] = group_ids[np.cumsum(first) - 1]
+    order = np.lexsort((eids, source_ids, row_groups))
+    starts = np.searchsorted(row_groups[order], np.arange(len(group_starts) + 1))
+    return order, starts
+
+
+def consolidate_crossnets(input_files, output_file, binary_output=False, delimiter=DELIMITER, metrics=None,
+                          undirected=False):
+    '''Consolidates full crossnet tables; see the file header.
+
+    Input:
+        input_files: list of paths of full crossnet tables.
+        output_file: path of the consolidated table.
+        undirected: if True, reversed pairs are the same edge, see the file header.
+    Output:
+        the list of sources, as (input file, dataset id) pairs.
+    '''
+    if np is None:
+        raise ImportError('numpy is required to consolidate crossnet tables')
+    if metrics is None:
+        metrics = BuildMetrics()
+    provenance_file = get_provenance_file_name(output_file)
+    sources_file = get_sources_file_name(output_file)
+    metrics.set('input_files', list(input_files))
+    # The consolidated table is rewritten, not appended to, so its ledger is rebuilt.
+    ledger_file = utils.get_ledger_file_name(output_file)
+    if os.path.isfile(ledger_file):
+        os.remove(ledger_file)
+    metrics.set('output_files', [output_file, provenance_file, sources_file])
+    with metrics.stage('read_tables'):
+        sources, eids, source_ids, srcs, dsts = read_input_tables(input_files)
+        if undirected:
+            srcs, dsts = np.minimum(srcs, dsts), np.maximum(srcs, dsts)
+    with metrics.stage('consolidate'):
+        order, starts = consolidate_edges(eids, source_ids, srcs, dsts)
+        eids, source_ids, srcs, dsts = eids[order], source_ids[order], srcs[order], dsts[order]
+    with metrics.stage('write_tables'), compression.open_file(output_file, 'w') as outF, \
+            compression.open_file(provenance_file, 'w') as provF:
+        outF.write('# Consolidated crossnet file of %d tables\n' % len(input_files))
+        outF.write('# File generated on: %s\n' % utils.get_current_date())
+        outF.write('# mambo_eid%sdataset_id%ssrc_mambo_nid%sdst_mambo_nid\n' % (delimiter, delimiter, delimiter))
+        provF.write('# Provenance of the consolidated crossnet file %s\n' % os.path.basename(output_file))
+        provF.write('# File generated on: %s\n' % utils.get_current_date())
+        provF.write('# mambo_eid%sdataset_bitset%sdataset_eids\n' % (delimiter, delimiter))
+        source_ids_list = source_ids.tolist()
+        source_dataset_ids = [dataset_id for _, dataset_id in sources]
+        eids_list = eids.tolist()
+        rows, provenance = [], []
+        for edge in range(len(starts) - 1):
+            start, end = int(starts[edge]), int(starts[edge + 1])
+            edge_sources = source_ids_list[start:end]
+            bitset = 0
+            for source in edge_sources:
+                bitset |= 1 << source
+            rows.append('%d%s%d%s%d%s%d\n' % (edge, delimiter, source_dataset_ids[edge_sources[0]], delimiter,
+                                                srcs[start], delimiter, dsts[start]))
+            provenance.append('%d%s%x%s%s\n' % (edge, delimiter, bitset, delimiter, ','.join(
+                '%d:%d' % pair for pair in zip(edge_sources, eids_list[start:end]))))
+            if len(rows) == WRITE_BATCH_SIZE:
+                outF.writelines(rows)
+                provF.writelines(provenance)
+                rows, provenance = [], []
+        outF.writelines(rows)
+        provF.writelines(provenance)
+    tmp_file = '%s.tmp%d' % (sources_file, os.getpid())
+    with open(tmp_file, 'w') as outF:
+        json.dump([{'table': table, 'dataset_id': dataset_id} for table, dataset_id in sources], outF, indent=1)
+    os.rename(tmp_file, sources_file)
+    with metrics.stage('update_ledger'):
+        utils.update_ledger(output_file)
+    if binary_output:
+        with metrics.stage('binary_output'):
+            columnar_table.write_columnar_table(output_file, columnar_table.FULL_CROSSNET_SCHEMA, delimiter=delimiter)
+    metrics.add('rows_read', len(eids))
+    metrics.add('rows_written', len(starts) - 1)
+    metrics.add('rows_merged', len(eids) - (len(starts) - 1))
+    metrics.finish()
+    return sources
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Collapse the duplicate edges of full crossnet tables')
+    parser.add_argument('output_file', help='path of the consolidated table')
+    parser.add_argument('input_files', nargs='+', help='full crossnet tables')
+    parser.add_argument('--undirected', action='store_true', help='merge reversed pairs too')
+    parser.add_argument('--binary_output', action='store_true', help='also write a binary columnar table')
+    parser.add_argument('--metrics_file', help='file to append the metrics to as a JSON line', default=None)
+    args = parser.parse_args()
+
+    metrics = BuildMetrics(os.path.basename(args.output_file), metrics_file=args.metrics_file)
+    consolidate_crossnets(args.input_files, args.output_file, args.binary_output, metrics=metrics,
+                          undirected=args.undirected)
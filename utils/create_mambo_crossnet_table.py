@@ -7,7 +7,8 @@ Usage:
 python create_mambo_crossnet_table.py <input_file_path> <src_file_path> <dst_file_path> <dataset_name> <dataset_id>
 
 Positional Arguments:
-input_file:              Path to the input file; Input file should be a tsv.
+input_file:              Path to the input file; Input file should be a tsv, optionally gzip or zstd compressed
+                         (.gz or .zst, see compression.py).
 src_file:                Path to a dataset specific file, as outputted by create_mambo_mode_table.py,
                          corresponding to the source mode. File name MUST MATCH FORMAT:
                          miner-<mode_name>-<dataset_id>-<dataset>-<date>.tsv
@@ -25,7 +26,8 @@ Optional arguments:
 --dst_node_index:        If there are multiple columns in the input tsv, the index of the column with the dst node id.
                          Defaults to 1.
 --output_dir:            Directory to create output files. Defaults to the current working directory.
---full_crossnet_file:    Name of output file tsv containing a list of <mambo_id>\t<dataset_id>.
+--full_crossnet_file:    Name of output file tsv containing a list of <mambo_id>\t<dataset_id>. Output files whose
+                         names end in .gz or .zst are written compressed.
                          Defaults to output_dir/miner-<src_mode_name>-<dst_mode_name>-<date>.tsv
 --db_edge_file:          Name of output file tsv for a specific dataset; contains a list of <mambo_id>\t<dataset_specific_entity_id>
                          Defaults to output_dir/miner-<src_mode_name>-<dst_mode_name>-<dataset_id>-<dataset>-<date>.tsv
@@ -34,10 +36,34 @@ Optional arguments:
                          full_crossnet_file.
 --skip_missing_ids       Flag; If any of the ids in the input tsv do not have mambo ids (which are fetched from
                          the src and dst files), skip the line and continue parsing the data.
---src_mode_filter        The name of a function in utils.py that should be applied to the source node id in 
-                         in the input file before using it to look up the mambo id in the src_file. Defaults to None.
---dst_mode_filter        The name of a function in utils.py that should be applied to the destination node id in 
+--src_mode_filter        The filter (see id_filters.py) that should be applied to the source node id in 
+                         in the input file before using it to look up the mambo id in the src_file, e.g.
+                         remove_species_id or remove_species_id:10090. Defaults to None.
+--dst_mode_filter        The filter (see id_filters.py) that should be applied to the destination node id in 
                          in the input file before using it to look up the mambo id in the dst_file. Defaults to None.
+--streaming              Flag; Read the input file in large blocks and convert each block column by column: the ids
+                         of a block are resolved together, and its rows are formatted and written in bulk. Produces
+                         the same output files as the default line-by-line mode. It spends roughly 40% less time on
+                         the rows than the default mode; reading the src and dst files takes as long in both (see
+                         benchmark_builders.py).
+--block_size             Approximate number of bytes read from the input file per block in streaming mode.
+                         Defaults to 16MB.
+--binary_output          Flag; Also write binary columnar versions of both output files (see columnar_table.py).
+--num_workers            If greater than 1, split the input file into shards and build them in a pool of this many
+                         processes. Each shard gets a reserved, contiguous range of mambo ids, so the output files
+                         are identical to a serial run. Compressed input files are not split. Defaults to 1.
+--metrics_file           Append the stage timings and row counters of the build to this file as a JSON line.
+                         Streaming mode times the stages split, filter, convert and write per block; the default
+                         mode estimates them from one line in 64 (see metrics.StageSampler).
+--progress               Flag; Periodically print the number of lines processed and lines per second to stderr.
+
+The script reads the src and dst files in a mode_cache session (see mode_cache.py). A program that calls
+create_mambo_crossnet_table for several input files should open one session around all the calls, so
+that every mode file is parsed once:
+
+with mode_cache.session():
+    for input_file, dataset_name, dataset_id in datasets:
+        create_mambo_crossnet_table(input_file, 'miner-gene-0-GO-20160520.tsv', ...)
 
 Example usage:
 Creating files for genes-function relationships using Gene Ontology:
@@ -54,18 +80,321 @@ python create_mambo_crossnet_table.py go.tsv miner-gene-0-GO-20160520.tsv miner-
 '''
 
 import argparse
+import columnar_table
+import compression
+import gc
+import mode_cache
+import multiprocessing
+import shutil
+import string
+import sys
+import tempfile
 import utils
 import os
+from itertools import compress, repeat
+from metrics import BuildMetrics, StageSampler
+from operator import itemgetter
 
 COMMENT = ["#", "!", "\n"]
 DELIMITER = "\t"
+BLOCK_SIZE = 1 << 24
+# Progress is checked every PROGRESS_MASK + 1 input lines in line-by-line mode.
+PROGRESS_MASK = (1 << 16) - 1
+# Number of rows passed to the sink at a time in line-by-line mode.
+SINK_BATCH_SIZE = 1 << 16
+
+
+def read_blocks(inF, block_size=BLOCK_SIZE):
+    '''Yields the lines of an open file in lists of roughly block_size bytes.'''
+    while True:
+        lines = inF.readlines(block_size)
+        if not lines:
+            break
+        yield lines
+
+
+def get_attrs_schema(vals, srcIdx, dstIdx, delimiter=DELIMITER):
+    '''Returns the schema line of the dataset specific crossnet table, given the
+    values of the first data line of the input file.'''
+    attrs_schema = '# mambo_eid%ssrc_dataset_id%sdst_dataset_id' % (delimiter, delimiter)
+    for i in range(len(vals)):
+        if i != srcIdx and i != dstIdx:
+            attrs_schema += '%sC%d' % (delimiter, i)
+    return attrs_schema
+
+
+def strip_fields(lines, delimiter=DELIMITER):
+    '''Returns the data lines of a block without comment lines and line ends, and with the
+    whitespace around their fields removed, as utils.split_then_strip would.'''
+    lines = [line for line in lines if line[0] not in COMMENT]
+    text = ''.join(lines)
+    # The fields are only stripped one by one if the block holds whitespace other than the
+    # delimiter and the line breaks; usually just the line breaks have to go.
+    if any(c in text for c in string.whitespace if c != '\n' and c not in delimiter):
+        return [delimiter.join([val.strip() for val in line.split(delimiter)]) for line in lines]
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+def resolve_ids(ids, mapping):
+    '''Returns the mambo ids of a block of dataset specific ids, with None for ids that are empty
+    or not in mapping. The block's ids are uniqued first; if they repeat, mapping is looked up
+    once per distinct id and the block is resolved against a small dictionary of those.'''
+    distinct = set(ids)
+    distinct.discard('')
+    if 2 * len(distinct) < len(ids):
+        mapping = dict(zip(distinct, map(mapping.get, distinct)))
+    elif '' in mapping:
+        ids = [id_ if id_ != '' else None for id_ in ids]
+    return list(map(mapping.get, ids))
+
+
+def convert_lines(lines, src_mapping, dst_mapping, srcIdx, dstIdx, src_filter, dst_filter,
+                  skip_missing_ids, db_id, src_db_id, dst_db_id, counter, delimiter=DELIMITER,
+                  metrics=None, sink_rows=None):
+    '''Converts a block of input lines into rows of the full and dataset specific crossnet tables.
+    The lines are split, filtered and converted in turn, each for the whole block, and the time
+    spent in each is added to the stages split, filter and convert of metrics.
+
+    Input:
+        lines: list of raw input lines; comment lines are skipped.
+        src_mapping, dst_mapping: dictionaries from dataset specific ids to mambo node ids.
+        counter: the mambo id assigned to the first row kept from this block.
+        metrics: if given, a BuildMetrics object that receives the stage timings and row counters
+                 of the block.
+        sink_rows: if given, a list to which a (mambo_eid, db_id, src_mambo_nid, dst_mambo_nid)
+                   tuple is appended for every row of the full table.
+    Output:
+        a tuple (full_rows, db_rows, counter), where counter is the next unassigned mambo id.
+    '''
+    if metrics is None:
+        metrics = BuildMetrics()
+    # A block allocates a list per line and a tuple per row, none of them cyclic. The cyclic
+    # garbage collector is paused meanwhile; its passes over them would take about as long as
+    # the conversion itself.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _convert_lines(lines, src_mapping, dst_mapping, srcIdx, dstIdx, src_filter, dst_filter,
+                              skip_missing_ids, db_id, src_db_id, dst_db_id, counter, delimiter, metrics,
+                              sink_rows)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _convert_lines(lines, src_mapping, dst_mapping, srcIdx, dstIdx, src_filter, dst_filter,
+                   skip_missing_ids, db_id, src_db_id, dst_db_id, counter, delimiter, metrics, sink_rows):
+    # Only the columns up to the last id column are split apart; the attribute columns after
+    # them are copied as one string.
+    num_split = max(srcIdx, dstIdx) + 1
+    with metrics.stage('split'):
+        lines = strip_fields(lines, delimiter)
+        rows = [line.split(delimiter, num_split) for line in lines]
+        ids1 = list(map(itemgetter(srcIdx), rows))
+        ids2 = list(map(itemgetter(dstIdx), rows))
+    with metrics.stage('filter'):
+        # Filters are applied once per distinct id in the block.
+        if src_filter:
+            src_filtered = dict((id1, src_filter(id1)) for id1 in set(ids1))
+            ids1 = list(map(src_filtered.__getitem__, ids1))
+        if dst_filter:
+            dst_filtered = dict((id2, dst_filter(id2)) for id2 in set(ids2))
+            ids2 = list(map(dst_filtered.__getitem__, ids2))
+    num_skipped = 0
+    num_missing = 0
+    with metrics.stage('convert'):
+        src_nids = resolve_ids(ids1, src_mapping)
+        dst_nids = resolve_ids(ids2, dst_mapping)
+        if None in src_nids or None in dst_nids:
+            keep = [src_nid is not None and dst_nid is not None for src_nid, dst_nid in zip(src_nids, dst_nids)]
+            for kept, id1, id2 in zip(keep, ids1, ids2):
+                if kept:
+                    continue
+                if id1 == '' or id2 == '':
+                    num_skipped += 1
+                elif skip_missing_ids:
+                    num_missing += 1
+                else:
+                    raise KeyError(id1 if id1 not in src_mapping else id2)
+            rows = list(compress(rows, keep))
+            src_nids = list(compress(src_nids, keep))
+            dst_nids = list(compress(dst_nids, keep))
+        # The rows are formatted by mapping format strings over the columns of the block.
+        eids = list(map(str, range(counter, counter + len(rows))))
+        fmt_delimiter = delimiter.replace('%', '%%')
+        full_format = '%%s%s%d%s%%s%s%%s\n' % (fmt_delimiter, db_id, fmt_delimiter, fmt_delimiter)
+        full_rows = list(map(full_format.__mod__, zip(eids, map(str, src_nids), map(str, dst_nids))))
+        db_format = '%%s%s%d%s%d' % (fmt_delimiter, src_db_id, fmt_delimiter, dst_db_id)
+        attr_indices = [i for i in range(num_split) if i != srcIdx and i != dstIdx]
+        if rows and not attr_indices and min(map(len, rows)) > num_split:
+            # The usual case: the attributes are all the columns after the ids.
+            attrs = map(itemgetter(num_split), rows)
+            db_format += fmt_delimiter
+        else:
+            attr_indices.append(num_split)
+            attrs = [''.join([delimiter + vals[i] for i in attr_indices if i < len(vals)]) for vals in rows]
+        db_rows = list(map((db_format + '%s\n').__mod__, zip(eids, attrs)))
+        if sink_rows is not None:
+            sink_rows.extend(zip(range(counter, counter + len(rows)), repeat(db_id), src_nids, dst_nids))
+    add_counters(metrics, len(lines), num_skipped, num_missing, len(full_rows))
+    return full_rows, db_rows, counter + len(full_rows)
+
+
+def add_counters(metrics, num_read, num_skipped, num_missing, num_written):
+    metrics.add('rows_read', num_read)
+    metrics.add('rows_skipped', num_skipped)
+    metrics.add('rows_missing_ids', num_missing)
+    metrics.add('rows_written', num_written)
+
+
+def count_lines(lines, src_mapping, dst_mapping, srcIdx, dstIdx, src_filter, dst_filter,
+                skip_missing_ids, delimiter=DELIMITER):
+    '''Returns the number of rows convert_lines would output for the given block of lines.'''
+    num_rows = 0
+    src_filtered = {}
+    dst_filtered = {}
+    for line in lines:
+        if line[0] in COMMENT:
+            continue
+        vals = line.split(delimiter)
+        id1 = vals[srcIdx].strip()
+        id2 = vals[dstIdx].strip()
+        if src_filter:
+            if id1 not in src_filtered:
+                src_filtered[id1] = src_filter(id1)
+            id1 = src_filtered[id1]
+        if dst_filter:
+            if id2 not in dst_filtered:
+                dst_filtered[id2] = dst_filter(id2)
+            id2 = dst_filtered[id2]
+        if id1 == '' or id2 == '':
+            continue
+        if id1 not in src_mapping or id2 not in dst_mapping:
+            if skip_missing_ids:
+                continue
+            raise KeyError(id1 if id1 not in src_mapping else id2)
+        num_rows += 1
+    return num_rows
+
+
+def split_input_files(input_files, num_shards, min_shard_size=BLOCK_SIZE):
+    '''Splits the input files into byte ranges that start and end on line boundaries.
+
+    Input:
+        input_files: list of paths to the input files.
+        num_shards: approximate total number of shards to create.
+        min_shard_size: files are not split into shards smaller than this many bytes.
+    Output:
+        a list of (path, start, end) tuples, in input order. Compressed files cannot be
+        split and are a single shard each.
+    '''
+    total_size = sum(os.path.getsize(path) for path in input_files)
+    shard_size = max(min_shard_size, total_size // max(num_shards, 1) + 1)
+    shards = []
+    for path in input_files:
+        file_size = os.path.getsize(path)
+        if compression.get_compression(path) is not None:
+            shards.append((path, 0, file_size))
+            continue
+        start = 0
+        with open(path, 'rb') as inF:
+            while start < file_size:
+                end = start + shard_size
+                if end < file_size:
+                    inF.seek(end - 1)
+                    inF.readline()
+                    end = inF.tell()
+                end = min(end, file_size)
+                shards.append((path, start, end))
+                start = end
+    return shards
+
+
+def read_shard_blocks(path, start, end, block_size=BLOCK_SIZE):
+    '''Yields the lines in bytes [start, end) of the file in lists of roughly block_size bytes.
+    A compressed file is always read whole.'''
+    if compression.get_compression(path) is not None:
+        with compression.open_file(path) as inF:
+            for lines in read_blocks(inF, block_size):
+                yield lines
+        return
+    with open(path, 'rb') as inF:
+        inF.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = inF.read(min(block_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            if remaining > 0 and not data.endswith(b'\n'):
+                rest = inF.readline()
+                remaining -= len(rest)
+                data += rest
+            if not isinstance(data, str):
+                data = data.decode('utf-8')
+            lines = data.split('\n')
+            last = lines.pop()
+            lines = [line + '\n' for line in lines]
+            if last:
+                lines.append(last)
+            yield lines
+
+
+# State shared with the worker processes of create_mambo_crossnet_table_parallel. It is
+# set before the pool is created, so forked workers inherit the mode mappings instead of
+# re-reading them.
+_shared = {}
+
+
+def _count_shard(shard):
+    path, start, end = shard
+    num_rows = 0
+    for lines in read_shard_blocks(path, start, end, _shared['block_size']):
+        num_rows += count_lines(lines, _shared['src_mapping'], _shared['dst_mapping'],
+                                _shared['srcIdx'], _shared['dstIdx'], _shared['src_filter'],
+                                _shared['dst_filter'], _shared['skip_missing_ids'], _shared['delimiter'])
+    return num_rows
+
+
+def _write_shard(task):
+    (path, start, end), counter, full_path, db_path = task
+    metrics = BuildMetrics()
+    with open(full_path, 'w') as fullF, open(db_path, 'w') as dbF:
+        for lines in read_shard_blocks(path, start, end, _shared['block_size']):
+            full_rows, db_rows, counter = convert_lines(
+                lines, _shared['src_mapping'], _shared['dst_mapping'], _shared['srcIdx'],
+                _shared['dstIdx'], _shared['src_filter'], _shared['dst_filter'],
+                _shared['skip_missing_ids'], _shared['db_id'], _shared['src_db_id'],
+                _shared['dst_db_id'], counter, _shared['delimiter'], metrics)
+            fullF.writelines(full_rows)
+            dbF.writelines(db_rows)
+    return metrics.counters
 
 
 def create_mambo_crossnet_table(input_file, src_file, dst_file, dataset_name,
                                db_id, src_node_index, dst_node_index, mode_name1,
                                mode_name2, output_dir, full_crossnet_file, db_edge_file,
                                src_mode_filter, dst_mode_filter, mambo_id_counter_start,
-                               skip_missing_ids, verbose=False, delimiter=DELIMITER):
+                               skip_missing_ids, verbose=False, delimiter=DELIMITER,
+                               streaming=False, block_size=BLOCK_SIZE, binary_output=False,
+                               metrics=None, src_mapping=None, dst_mapping=None, sink=None,
+                               write_full_table=True):
+    '''Creates the full and dataset specific crossnet tables for one input file. src_mapping
+    and dst_mapping may be given to reuse mode files already read with utils.read_mode_file,
+    e.g. when many input files link the same modes.
+
+    sink, if given, is called with lists of (mambo_eid, db_id, src_mambo_nid, dst_mambo_nid)
+    tuples, one per row added to the full crossnet table (see network_utils.GraphSink). If
+    write_full_table is False, the full crossnet table is not written; mambo_id_counter_start
+    must then be given, as it cannot be read from the table.
+    '''
+    if not write_full_table and mambo_id_counter_start == -1:
+        raise ValueError('mambo_id_counter_start must be given when the full crossnet table is not written')
+    if metrics is None:
+        metrics = BuildMetrics(progress_stream=sys.stderr if verbose else None)
     inFNm = input_file
     srcFile = src_file
     dstFile = dst_file
@@ -87,13 +416,19 @@ def create_mambo_crossnet_table(input_file, src_file, dst_file, dataset_name,
     outFNm2 = db_edge_file
     if outFNm2 is None:
         outFNm2 = os.path.join(output_dir, utils.get_cross_file_name(mode_name1, mode_name2, db_id, dataset))
+    if metrics.name is None:
+        metrics.name = os.path.basename(outFNm2)
+    metrics.set('input_files', [inFNm])
+    metrics.set('output_files', [outFNm, outFNm2])
 
-
-    src_mapping = utils.read_mode_file(srcFile)
-    if os.path.samefile(srcFile, dstFile):
-        dst_mapping = src_mapping
-    else:
-        dst_mapping = utils.read_mode_file(dstFile)
+    with metrics.stage('read_mode_files'):
+        if src_mapping is None:
+            src_mapping = utils.read_mode_file(srcFile)
+        if dst_mapping is None:
+            if os.path.samefile(srcFile, dstFile):
+                dst_mapping = src_mapping
+            else:
+                dst_mapping = utils.read_mode_file(dstFile)
 
     src_filter = utils.get_filter(src_mode_filter)
     dst_filter = utils.get_filter(dst_mode_filter)
@@ -101,10 +436,16 @@ def create_mambo_crossnet_table(input_file, src_file, dst_file, dataset_name,
     add_schema = True
     counter = mambo_id_counter_start
     if counter == -1:
-        counter = utils.get_max_id(outFNm)
+        with metrics.stage('get_max_id'):
+            counter = utils.get_max_id(outFNm)
+    full_size = os.path.getsize(outFNm) if os.path.isfile(outFNm) else 0
+    ledger = utils.read_ledger_before_append(outFNm) if write_full_table else None
+    first_counter = counter
+    num_header_lines = 3 if counter == 0 else 0
     if verbose:
         print 'Starting at mambo id: %d' % counter
-    with open(inFNm, 'r') as inF, open(outFNm, 'a') as fullF, open(outFNm2, 'w') as dbF:
+    with compression.open_file(inFNm) as inF, utils.open_full_table(outFNm, write_full_table) as fullF, \
+            compression.open_file(outFNm2, 'w') as dbF:
                 # Add schema/metadata
         if counter == 0:
             fullF.write('# Full crossnet file for %s to %s\n' % (mode_name1, mode_name2))
@@ -114,36 +455,236 @@ def create_mambo_crossnet_table(input_file, src_file, dst_file, dataset_name,
         dbF.write('# Crossnet table for dataset: %s\n' % dataset)
         dbF.write('# File generated on: %s\n' % utils.get_current_date())
         # Process file
-        for line in inF:
-            if line[0] in COMMENT:
-                continue
-            vals =  utils.split_then_strip(line, delimiter)
-            if add_schema:
-                attrs_schema = '# mambo_eid%ssrc_dataset_id%sdst_dataset_id' % (delimiter, delimiter)
-                for i in range(len(vals)):
-                    if i != srcIdx and i != dstIdx:
-                        attrs_schema += '%sC%d' % (delimiter, i)
+        if streaming:
+            blocks = read_blocks(inF, block_size)
+            while True:
+                with metrics.stage('read'):
+                    lines = next(blocks, None)
+                if lines is None:
+                    break
+                if add_schema:
+                    first = next((line for line in lines if line[0] not in COMMENT), None)
+                    if first is not None:
+                        dbF.write('%s\n' % get_attrs_schema(utils.split_then_strip(first, delimiter),
+                                                            srcIdx, dstIdx, delimiter))
+                        add_schema = False
+                sink_rows = [] if sink is not None else None
+                full_rows, db_rows, counter = convert_lines(
+                    lines, src_mapping, dst_mapping, srcIdx, dstIdx, src_filter, dst_filter,
+                    skip_missing_ids, db_id, src_db_id, dst_db_id, counter, delimiter, metrics,
+                    sink_rows)
+                with metrics.stage('write'):
+                    fullF.writelines(full_rows)
+                    dbF.writelines(db_rows)
+                if sink_rows:
+                    sink(sink_rows)
+                metrics.progress(metrics.counters['rows_read'])
+        else:
+            num_lines = 0
+            num_comments = 0
+            num_skipped = 0
+            num_missing = 0
+            sink_rows = []
+            # The stages of the lines are estimated from a sample; process is the total.
+            sampler = StageSampler(metrics)
+            with metrics.stage('process'):
+                for num_lines, line in enumerate(inF, 1):
+                    if not num_lines & PROGRESS_MASK:
+                        metrics.progress(num_lines)
+                    if line[0] in COMMENT:
+                        num_comments += 1
+                        continue
+                    sampled = sampler.start(num_lines)
+                    vals =  utils.split_then_strip(line, delimiter)
+                    if add_schema:
+                        dbF.write('%s\n' % get_attrs_schema(vals, srcIdx, dstIdx, delimiter))
+                        add_schema = False
+                    id1 = vals[srcIdx]
+                    id2 = vals[dstIdx]
+                    if sampled:
+                        sampler.lap('split')
+                    if src_filter:
+                        id1 = src_filter(id1)
+                    if dst_filter:
+                        id2 = dst_filter(id2)
+                    if sampled:
+                        sampler.lap('filter')
+                    if id1 == '' or id2 == '':
+                        num_skipped += 1
+                        continue
+                    if skip_missing_ids and (id1 not in src_mapping or id2 not in dst_mapping):
+                        #print id1, id2
+                        num_missing += 1
+                        continue
+                    attr_strs = ''
+                    for i in range(len(vals)):
+                        if i != srcIdx and i != dstIdx:
+                            attr_strs += delimiter + vals[i]
+                    full_row = '%d%s%d%s%d%s%d\n' % (
+                        counter, delimiter, db_id, delimiter, src_mapping[id1], delimiter, dst_mapping[id2])
+                    db_row = '%d%s%d%s%d%s\n' % (counter, delimiter, src_db_id, delimiter, dst_db_id, attr_strs)
+                    if sampled:
+                        sampler.lap('convert')
+                    fullF.write(full_row)
+                    dbF.write(db_row)
+                    if sampled:
+                        sampler.lap('write')
+                    if sink is not None:
+                        sink_rows.append((counter, db_id, src_mapping[id1], dst_mapping[id2]))
+                        if len(sink_rows) == SINK_BATCH_SIZE:
+                            sink(sink_rows)
+                            sink_rows = []
+                    counter += 1
+                if sink_rows:
+                    sink(sink_rows)
+            add_counters(metrics, num_lines - num_comments, num_skipped, num_missing, counter - first_counter)
+    if write_full_table:
+        with metrics.stage('update_ledger'):
+            utils.extend_ledger(outFNm, ledger, num_header_lines + counter - first_counter, first_counter, counter,
+                                db_id)
+    if binary_output:
+        with metrics.stage('binary_output'):
+            if write_full_table:
+                columnar_table.update_columnar_table(outFNm, columnar_table.FULL_CROSSNET_SCHEMA, full_size, delimiter)
+            columnar_table.write_columnar_table(outFNm2, columnar_table.CROSSNET_SCHEMA, delimiter=delimiter)
+    metrics.set('next_mambo_id', counter)
+    metrics.finish()
+    if verbose:
+        print 'Ending at mambo id: %d' % counter
+
+
+def create_mambo_crossnet_table_parallel(input_files, src_file, dst_file, dataset_name,
+                                        db_id, src_node_index, dst_node_index, mode_name1,
+                                        mode_name2, output_dir, full_crossnet_file, db_edge_file,
+                                        src_mode_filter, dst_mode_filter, mambo_id_counter_start,
+                                        skip_missing_ids, num_workers=None, verbose=False,
+                                        delimiter=DELIMITER, block_size=BLOCK_SIZE,
+                                        binary_output=False, metrics=None, sink=None,
+                                        write_full_table=True):
+    '''Multi-process version of create_mambo_crossnet_table.
+
+    input_files may be a single path or a list of paths; a list is treated as the concatenation
+    of its files. The input is split into line aligned shards. The workers first count the rows
+    each shard produces, which reserves a contiguous range of mambo ids per shard, and then write
+    their shards into temporary files that are appended to the output files in input order. The
+    output files are identical to those of a serial run over the same input. sink and
+    write_full_table are as in create_mambo_crossnet_table; the sink is called in this process
+    while the shards are merged.
+    '''
+    if not write_full_table and mambo_id_counter_start == -1:
+        raise ValueError('mambo_id_counter_start must be given when the full crossnet table is not written')
+    if metrics is None:
+        metrics = BuildMetrics(progress_stream=sys.stderr if verbose else None)
+    if not isinstance(input_files, (list, tuple)):
+        input_files = [input_files]
+    srcFile = src_file
+    dstFile = dst_file
+    dataset = dataset_name
+
+    src_db_id = utils.parse_dataset_id_from_name(os.path.basename(srcFile))
+    dst_db_id = utils.parse_dataset_id_from_name(os.path.basename(dstFile))
+
+    mode_name1 = utils.parse_mode_name_from_name(os.path.basename(srcFile)) if mode_name1 is None else mode_name1
+    mode_name2 = utils.parse_mode_name_from_name(os.path.basename(dstFile)) if mode_name2 is None else mode_name2
+
+    outFNm = full_crossnet_file
+    if outFNm is None:
+        outFNm = os.path.join(output_dir, utils.get_full_cross_file_name(mode_name1, mode_name2))
+    outFNm2 = db_edge_file
+    if outFNm2 is None:
+        outFNm2 = os.path.join(output_dir, utils.get_cross_file_name(mode_name1, mode_name2, db_id, dataset))
+    if metrics.name is None:
+        metrics.name = os.path.basename(outFNm2)
+    metrics.set('input_files', list(input_files))
+    metrics.set('output_files', [outFNm, outFNm2])
+
+    with metrics.stage('read_mode_files'):
+        src_mapping = utils.read_mode_file(srcFile)
+        if os.path.samefile(srcFile, dstFile):
+            dst_mapping = src_mapping
+        else:
+            dst_mapping = utils.read_mode_file(dstFile)
+
+    counter = mambo_id_counter_start
+    if counter == -1:
+        with metrics.stage('get_max_id'):
+            counter = utils.get_max_id(outFNm)
+    full_size = os.path.getsize(outFNm) if os.path.isfile(outFNm) else 0
+    ledger = utils.read_ledger_before_append(outFNm) if write_full_table else None
+    if verbose:
+        print 'Starting at mambo id: %d' % counter
+
+    attrs_schema = None
+    for path in input_files:
+        with compression.open_file(path) as inF:
+            first = next((line for line in inF if line[0] not in COMMENT), None)
+        if first is not None:
+            attrs_schema = get_attrs_schema(utils.split_then_strip(first, delimiter),
+                                            src_node_index, dst_node_index, delimiter)
+            break
+
+    num_workers = num_workers or multiprocessing.cpu_count()
+    shards = split_input_files(input_files, num_workers * 4, min(block_size, BLOCK_SIZE))
+    _shared.update(src_mapping=src_mapping, dst_mapping=dst_mapping,
+                   srcIdx=src_node_index, dstIdx=dst_node_index,
+                   src_filter=utils.get_filter(src_mode_filter),
+                   dst_filter=utils.get_filter(dst_mode_filter),
+                   skip_missing_ids=skip_missing_ids, db_id=db_id, src_db_id=src_db_id,
+                   dst_db_id=dst_db_id, delimiter=delimiter, block_size=block_size)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(outFNm2)))
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        with metrics.stage('count'):
+            shard_rows = pool.map(_count_shard, shards)
+        tasks = []
+        start = counter
+        for i, shard in enumerate(shards):
+            tasks.append((shard, start, os.path.join(tmp_dir, 'full-%d.tsv' % i),
+                          os.path.join(tmp_dir, 'db-%d.tsv' % i)))
+            start += shard_rows[i]
+        with metrics.stage('convert'):
+            for shard_counters in pool.imap(_write_shard, tasks):
+                for name, value in shard_counters.items():
+                    metrics.add(name, value)
+                metrics.progress(metrics.counters.get('rows_read', 0))
+
+        with metrics.stage('merge'), utils.open_full_table(outFNm, write_full_table) as fullF, \
+                compression.open_file(outFNm2, 'w') as dbF:
+            if counter == 0:
+                fullF.write('# Full crossnet file for %s to %s\n' % (mode_name1, mode_name2))
+                fullF.write('# File generated on: %s\n' % utils.get_current_date())
+                fullF.write('# mambo_eid%sdataset_id%ssrc_mambo_nid%sdst_mambo_nid\n' % (
+                    delimiter, delimiter, delimiter))
+            dbF.write('# Crossnet table for dataset: %s\n' % dataset)
+            dbF.write('# File generated on: %s\n' % utils.get_current_date())
+            if attrs_schema is not None:
                 dbF.write('%s\n' % attrs_schema)
-                add_schema = False
-            id1 = vals[srcIdx]
-            id2 = vals[dstIdx]
-            if src_filter:
-                id1 = src_filter(id1)
-            if dst_filter:
-                id2 = dst_filter(id2)
-            if id1 == '' or id2 == '':
-                continue
-            if skip_missing_ids and (id1 not in src_mapping or id2 not in dst_mapping):
-                #print id1, id2
-                continue
-            attr_strs = ''
-            for i in range(len(vals)):
-                if i != srcIdx and i != dstIdx:
-                    attr_strs += delimiter + vals[i]
-            fullF.write('%d%s%d%s%d%s%d\n' % (
-                counter, delimiter, db_id, delimiter, src_mapping[id1], delimiter, dst_mapping[id2]))
-            dbF.write('%d%s%d%s%d%s\n' % (counter, delimiter, src_db_id, delimiter, dst_db_id, attr_strs))
-            counter += 1
+            for _, _, full_path, db_path in tasks:
+                with open(full_path, 'r') as shardF:
+                    shutil.copyfileobj(shardF, fullF)
+                if sink is not None:
+                    with open(full_path, 'r') as shardF:
+                        for lines in read_blocks(shardF, block_size):
+                            sink([tuple(int(val) for val in line.split(delimiter)) for line in lines])
+                with open(db_path, 'r') as shardF:
+                    shutil.copyfileobj(shardF, dbF)
+        if write_full_table:
+            with metrics.stage('update_ledger'):
+                utils.extend_ledger(outFNm, ledger, (3 if counter == 0 else 0) + start - counter, counter, start, db_id)
+        if binary_output:
+            with metrics.stage('binary_output'):
+                if write_full_table:
+                    columnar_table.update_columnar_table(outFNm, columnar_table.FULL_CROSSNET_SCHEMA, full_size, delimiter)
+                columnar_table.write_columnar_table(outFNm2, columnar_table.CROSSNET_SCHEMA, delimiter=delimiter)
+        counter = start
+    finally:
+        pool.close()
+        pool.join()
+        _shared.clear()
+        shutil.rmtree(tmp_dir)
+    metrics.set('num_workers', num_workers)
+    metrics.set('next_mambo_id', counter)
+    metrics.finish()
     if verbose:
         print 'Ending at mambo id: %d' % counter
 
@@ -167,8 +708,14 @@ if __name__ == "__main__":
     parser.add_argument('--db_edge_file', help='output file name; output contains mapping of mambo ids to dataset ids; OVERRIDES output dir argument', default=None)
     parser.add_argument('--skip_missing_ids', action='store_true', help='don\'t throw an error if ids in input_file not found in src or dst file.')
     parser.add_argument('--mambo_id_counter_start', type=int, help='where to start assigning mambo ids', default=-1)
-    parser.add_argument('--src_mode_filter', type=str, default=None)
-    parser.add_argument('--dst_mode_filter', type=str, default=None)
+    parser.add_argument('--src_mode_filter', type=str, help='id filter spec, e.g. remove_species_id:10090', default=None)
+    parser.add_argument('--dst_mode_filter', type=str, help='id filter spec, e.g. remove_species_id:10090', default=None)
+    parser.add_argument('--streaming', action='store_true', help='read the input in large blocks and convert them column by column')
+    parser.add_argument('--block_size', type=int, help='approximate number of bytes per block in streaming mode', default=BLOCK_SIZE)
+    parser.add_argument('--binary_output', action='store_true', help='also write binary columnar tables')
+    parser.add_argument('--num_workers', type=int, help='number of processes used to build the tables', default=1)
+    parser.add_argument('--metrics_file', help='file to append the build metrics to as a JSON line', default=None)
+    parser.add_argument('--progress', action='store_true', help='print progress to stderr')
     args = parser.parse_args()
     
     inFNm = args.input_file
@@ -192,9 +739,27 @@ if __name__ == "__main__":
     
     counter = args.mambo_id_counter_start
     skip_missing_ids = args.skip_missing_ids
+    streaming = args.streaming
+    block_size = args.block_size
+    num_workers = args.num_workers
+    binary_output = args.binary_output
+    metrics = BuildMetrics(metrics_file=args.metrics_file,
+                           progress_stream=sys.stderr if args.progress else None)
     
-    create_mambo_crossnet_table(inFNm, srcFile, dstFile, dataset,
-                               db_id, srcIdx, dstIdx, mode_name1,
-                               mode_name2, output_dir, outFNm, outFNm2,
-                               src_mode_filter, dst_mode_filter, counter,
-                               skip_missing_ids)
+    with mode_cache.session():
+        if num_workers > 1:
+            create_mambo_crossnet_table_parallel(inFNm, srcFile, dstFile, dataset,
+                                                db_id, srcIdx, dstIdx, mode_name1,
+                                                mode_name2, output_dir, outFNm, outFNm2,
+                                                src_mode_filter, dst_mode_filter, counter,
+                                                skip_missing_ids, num_workers=num_workers,
+                                                block_size=block_size, binary_output=binary_output,
+                                                metrics=metrics)
+        else:
+            create_mambo_crossnet_table(inFNm, srcFile, dstFile, dataset,
+                                       db_id, srcIdx, dstIdx, mode_name1,
+                                       mode_name2, output_dir, outFNm, outFNm2,
+                                       src_mode_filter, dst_mode_filter, counter,
+                                       skip_missing_ids, streaming=streaming,
+                                       block_size=block_size, binary_output=binary_output,
+                                       metrics=metrics)
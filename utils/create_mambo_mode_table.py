@@ -1,7 +1,8 @@
 '''
 file: create_mambo_mode_table.py
 
-Script that creates mambo tables for a given mode.
+Script that creates mambo tables for a given mode. The input and output files may be gzip or zstd
+compressed, which is detected from their names (see compression.py).
 
 Usage:
 python create_mambo_mode_table.py <input_file_path> <mode_name> <dataset_name> <dataset_id>
@@ -25,6 +26,11 @@ Optional arguments:
 --mambo_id_counter_start  Start assigning mambo ids from this integer value; this number MUST be greater
                          than any id found in the full mode file. If not specified, finds the max id in the
                          full_mode_file.
+--binary_output          Flag; Also write binary columnar versions of both output files (see columnar_table.py).
+--metrics_file           Append the stage timings and row counters of the build to this file as a JSON line.
+                         The stages split, dedup and write of the lines are estimated from one line in 64 (see
+                         metrics.StageSampler).
+--progress               Flag; Periodically print the number of lines processed and lines per second to stderr.
 
 Example usage:
 Creating files for genes using two datasets, GeneOntology and HUGO:
@@ -42,16 +48,36 @@ python create_mambo_mode_table.py hugo.tsv gene HUGO 1 --output_dir outputs/gene
 '''
 
 import argparse
+import columnar_table
+import compression
+import sys
 import utils
 import os
+from metrics import BuildMetrics, StageSampler
 
 COMMENT = ["#", "!", "\n"]
 DELIMITER = "\t"
+# Progress is checked every PROGRESS_MASK + 1 input lines.
+PROGRESS_MASK = (1 << 16) - 1
+# Number of rows passed to the sink at a time.
+SINK_BATCH_SIZE = 1 << 16
 
 
 def create_mambo_mode_table(input_file, db_id, mode_name, dataset_name, 
                            full_mode_file, output_dir, db_node_file,
-                           mambo_id_counter_start, node_index, verbose=False, delimiter=DELIMITER):
+                           mambo_id_counter_start, node_index, verbose=False, delimiter=DELIMITER,
+                           binary_output=False, metrics=None, sink=None, write_full_table=True):
+    '''Creates the full and dataset specific mode tables for one input file.
+
+    sink, if given, is called with lists of (mambo_nid, db_id) tuples, one per row added to the
+    full mode table, e.g. to add the nodes to a TMMNet while the tables are built (see
+    network_utils.GraphSink). If write_full_table is False, the full mode table is not written;
+    mambo_id_counter_start must then be given, as it cannot be read from the table.
+    '''
+    if not write_full_table and mambo_id_counter_start == -1:
+        raise ValueError('mambo_id_counter_start must be given when the full mode table is not written')
+    if metrics is None:
+        metrics = BuildMetrics(progress_stream=sys.stderr if verbose else None)
     # Process command line arguments, get default path names
     inFNm = input_file
     db_id = db_id
@@ -63,16 +89,33 @@ def create_mambo_mode_table(input_file, db_id, mode_name, dataset_name,
     dbFNm = db_node_file
     if dbFNm is None:
         dbFNm = os.path.join(output_dir, utils.get_mode_file_name(mode_name, db_id, dataset))
+    if metrics.name is None:
+        metrics.name = os.path.basename(dbFNm)
+    metrics.set('input_files', [inFNm])
+    metrics.set('output_files', [outFNm, dbFNm])
 
     counter = mambo_id_counter_start
     if counter == -1:
-        counter = utils.get_max_id(outFNm)
+        with metrics.stage('get_max_id'):
+            counter = utils.get_max_id(outFNm)
+
+    full_size = os.path.getsize(outFNm) if os.path.isfile(outFNm) else 0
+    ledger = utils.read_ledger_before_append(outFNm) if write_full_table else None
+    first_counter = counter
 
     # Read input file, create output files.
     seen = set()
+    num_lines = 0
+    num_comments = 0
+    num_skipped = 0
+    num_duplicates = 0
     if verbose:
         print 'Starting at mambo id: %d' % counter
-    with open(inFNm, 'r') as inF, open(outFNm, 'a') as outF, open(dbFNm, 'w') as dbF:
+    sink_rows = []
+    # The stages of the lines are estimated from a sample; process is the total.
+    sampler = StageSampler(metrics)
+    with metrics.stage('process'), compression.open_file(inFNm) as inF, \
+            utils.open_full_table(outFNm, write_full_table) as outF, compression.open_file(dbFNm, 'w') as dbF:
         if counter == 0:
             outF.write('# Full mode table for %s\n' % mode_name)
             outF.write('# File generated on: %s\n' % utils.get_current_date())
@@ -80,9 +123,13 @@ def create_mambo_mode_table(input_file, db_id, mode_name, dataset_name,
         dbF.write('# Mode table for dataset: %s\n' % dataset)
         dbF.write('# File generated on: %s\n' % utils.get_current_date())
         add_schema = True
-        for line in inF:
+        for num_lines, line in enumerate(inF, 1):
+            if not num_lines & PROGRESS_MASK:
+                metrics.progress(num_lines)
             if line[0] in COMMENT: # skip comments
+                num_comments += 1
                 continue
+            sampled = sampler.start(num_lines)
             vals = utils.split_then_strip(line, delimiter)
             if add_schema:
                 attrs_schema = '# mambo_nid%sdataset_nid' % delimiter
@@ -92,16 +139,48 @@ def create_mambo_mode_table(input_file, db_id, mode_name, dataset_name,
                 dbF.write('%s\n' % attrs_schema)
                 add_schema = False
             node_id = vals[node_index]
-            if node_id in seen or len(node_id) == 0:
+            if sampled:
+                sampler.lap('split')
+            if len(node_id) == 0:
+                num_skipped += 1
+                continue
+            if node_id in seen:
+                num_duplicates += 1
                 continue
+            seen.add(node_id)
+            if sampled:
+                sampler.lap('dedup')
             attrs_str = ''
             for i in range(len(vals)):
                 if i != node_index:
                     attrs_str += delimiter + vals[i]
             outF.write('%d%s%d\n' % (counter, delimiter, db_id))
             dbF.write('%d%s%s%s\n' % (counter, delimiter, node_id, attrs_str))
-            seen.add(node_id)
+            if sampled:
+                sampler.lap('write')
+            if sink is not None:
+                sink_rows.append((counter, db_id))
+                if len(sink_rows) == SINK_BATCH_SIZE:
+                    sink(sink_rows)
+                    sink_rows = []
             counter += 1
+    if sink is not None and sink_rows:
+        sink(sink_rows)
+    metrics.add('rows_read', num_lines - num_comments)
+    metrics.add('rows_skipped', num_skipped)
+    metrics.add('rows_duplicate', num_duplicates)
+    metrics.add('rows_written', len(seen))
+    if write_full_table:
+        with metrics.stage('update_ledger'):
+            utils.extend_ledger(outFNm, ledger, (3 if first_counter == 0 else 0) + counter - first_counter,
+                                first_counter, counter, db_id)
+    if binary_output:
+        with metrics.stage('binary_output'):
+            if write_full_table:
+                columnar_table.update_columnar_table(outFNm, columnar_table.FULL_MODE_SCHEMA, full_size, delimiter)
+            columnar_table.write_columnar_table(dbFNm, columnar_table.MODE_SCHEMA, delimiter=delimiter)
+    metrics.set('next_mambo_id', counter)
+    metrics.finish()
     if verbose:
         print 'Ending at mambo id: %d' % counter
 
@@ -120,6 +199,9 @@ if __name__ == "__main__":
         + 'note that this file is appended to; OVERRIDES output_dir argument', default=None)
     parser.add_argument('--db_node_file', help='output file name; output contains mapping of mambo ids to db protein ids; OVERRIDES output dir argument', default=None)
     parser.add_argument('--mambo_id_counter_start', type=int, help='where to start assigning mambo ids', default=-1)
+    parser.add_argument('--binary_output', action='store_true', help='also write binary columnar tables')
+    parser.add_argument('--metrics_file', help='file to append the build metrics to as a JSON line', default=None)
+    parser.add_argument('--progress', action='store_true', help='print progress to stderr')
     
     # Parse command line arguments
     args = parser.parse_args()
@@ -132,6 +214,10 @@ if __name__ == "__main__":
     dbFNm = args.db_node_file
     counter = args.mambo_id_counter_start
     node_index = args.node_index
+    binary_output = args.binary_output
+    metrics = BuildMetrics(metrics_file=args.metrics_file,
+                           progress_stream=sys.stderr if args.progress else None)
     
     # Construct the mode tables
-    create_mambo_mode_table(inFNm, db_id, mode_name, dataset, outFNm, output_dir, dbFNm, counter, node_index)
+    create_mambo_mode_table(inFNm, db_id, mode_name, dataset, outFNm, output_dir, dbFNm, counter, node_index,
+                           binary_output=binary_output, metrics=metrics)
@@ -1,7 +1,8 @@
 '''
 file: create_mapped_mode_table.py
 
-Script that creates mambo tables for a given mode which requires a mapping file.
+Script that creates mambo tables for a given mode which requires a mapping file. Input, mapping and
+output files ending in .gz or .zst are read and written compressed (see compression.py).
 
 Usage:
 python create_mapped_mode_table.py <mode_name> <input_file_path> <dataset_name> <dataset_id> <mapping_file> <map_index>
@@ -25,6 +26,16 @@ Optional arguments:
                          Defaults to output_dir/miner-<mode_name>-<dataset_id>-<dataset>-<date>.tsv
 --skip_missing_ids:      For ids in the database but not the dictionary, skip if false. Otherwise add to the mapping file. 
                          Defaults to False.
+--binary_output          Flag; Also write binary columnar versions of both output files (see columnar_table.py).
+--memory_budget          Bound memory use to roughly this many bytes (e.g. 512M) by sorting the input, mapping and
+                         full mode tables in runs spilled to disk and merge joining them. The full mode table is then
+                         written in mambo id order. Defaults to keeping everything in memory.
+--tmp_dir                Directory for the runs spilled in bounded-memory mode. Defaults to the system temp directory.
+--delta_log              Flag; Leave the full mode table as is and append the <mambo_id>\t<dataset_id> rows of this
+                         dataset to its delta log instead, so adding a dataset does not read or rewrite the full mode
+                         table. Run mode_delta_log.py to fold the log into the full mode table.
+--metrics_file           Append the stage timings and row counters of the build to this file as a JSON line.
+--progress               Flag; Periodically print the number of lines processed and lines per second to stderr.
 
 Example usage:
 Creating files for genes using two datasets, STRING and GO:
@@ -44,35 +55,92 @@ python create_mapped_mode_table.py protein go_parsed.tsv GO_UNIPROT 1 uniprot_en
 '''
 
 import argparse
+import columnar_table
+import compression
+import external_sort
+import mode_delta_log
 import os
+import sys
 import utils
+from metrics import BuildMetrics
 
 COMMENT = ["#", "!", "\n"]
 DELIMITER = "\t"
 NONE = "None"
+# Progress is checked every PROGRESS_MASK + 1 input lines.
+PROGRESS_MASK = (1 << 16) - 1
+# Number of rows passed to the sink at a time.
+SINK_BATCH_SIZE = 1 << 16
+
+
+def get_mapping_row(counter, node_id, num_cols, map_index, delimiter=DELIMITER):
+    result = "%d%s" % (counter, delimiter)
+    for i in range(num_cols - 1):
+        label = NONE if i + 1 != map_index else node_id
+        result = result + label + delimiter
+    return result.strip(delimiter) + '\n'
+
+
+def start_metrics(metrics, input_file, mapping_file, full_mode_file, db_node_file, delta_log=False):
+    if metrics is None:
+        metrics = BuildMetrics()
+    if metrics.name is None:
+        metrics.name = os.path.basename(db_node_file)
+    metrics.set('input_files', [input_file, mapping_file])
+    if delta_log:
+        full_mode_file = mode_delta_log.get_delta_log_file_name(full_mode_file)
+    metrics.set('output_files', [full_mode_file, db_node_file, mapping_file])
+    return metrics
+
+
+def finish_metrics(metrics, full_mode_file, db_node_file, binary_output, delimiter=DELIMITER, delta_log=False):
+    with metrics.stage('update_ledger'):
+        utils.update_ledger(full_mode_file)
+    if binary_output:
+        with metrics.stage('binary_output'):
+            # With a delta log the full mode table is unchanged; compaction rewrites its columnar version.
+            if not delta_log:
+                columnar_table.write_columnar_table(full_mode_file, columnar_table.MAPPED_FULL_MODE_SCHEMA,
+                                                    delimiter=delimiter)
+            columnar_table.write_columnar_table(db_node_file, columnar_table.MODE_SCHEMA, delimiter=delimiter)
+    metrics.finish()
 
 
 def create_mapped_mode_table(mode_name, input_file, dataset_name, db_id,
                              mapping_file, skip, map_index, node_index,
-                             output_dir, full_mode_file, db_node_file, delimiter=DELIMITER):
+                             output_dir, full_mode_file, db_node_file, delimiter=DELIMITER,
+                             binary_output=False, memory_budget=None, tmp_dir=None, metrics=None,
+                             sink=None, delta_log=False):
+    '''Creates the full and dataset specific mode tables for one input file, taking mambo ids
+    from the mapping file. sink, if given, is called with lists of (mambo_nid, db_id) tuples,
+    one per row of the dataset specific table (see network_utils.GraphSink). If delta_log is
+    True, the rows of the dataset are appended to the delta log of the full mode table instead
+    of rewriting it (see mode_delta_log.py).'''
+    if memory_budget is not None:
+        return create_mapped_mode_table_external(mode_name, input_file, dataset_name, db_id,
+                                                 mapping_file, skip, map_index, node_index,
+                                                 output_dir, full_mode_file, db_node_file, delimiter,
+                                                 binary_output, memory_budget, tmp_dir, metrics, sink,
+                                                 delta_log)
     if full_mode_file is None:
         full_mode_file = os.path.join(output_dir, utils.get_full_mode_file_name(mode_name))
+    if db_node_file is None:
+        db_node_file = os.path.join(output_dir, utils.get_mode_file_name(mode_name, db_id, dataset_name))
+    metrics = start_metrics(metrics, input_file, mapping_file, full_mode_file, db_node_file, delta_log)
+
     full_mode_map = {}
-    if os.path.isfile(full_mode_file):
-        with open(full_mode_file, 'r') as fm_file:
+    if os.path.isfile(full_mode_file) and not delta_log:
+        with metrics.stage('read_full_mode'), compression.open_file(full_mode_file) as fm_file:
             for line in fm_file:
                 if line[0] in COMMENT:  # skip comments
                     continue
                 split_line = line.strip().split(delimiter)
                 full_mode_map[int(split_line[0])] = split_line[1]
 
-    if db_node_file is None:
-        db_node_file = os.path.join(output_dir, utils.get_mode_file_name(mode_name, db_id, dataset_name))
-
     max_id = 0
     mapping = {}
     num_cols = 0
-    with open(mapping_file, 'r') as mf:
+    with metrics.stage('read_mapping'), compression.open_file(mapping_file) as mf:
         for line in mf:
             if line[0] in COMMENT:
                 continue
@@ -84,21 +152,31 @@ def create_mapped_mode_table(mode_name, input_file, dataset_name, db_id,
     has_header = True
     seen = set()
     seen_counter = set()
-    with open(full_mode_file, 'w') as fm_file, \
-            open(input_file, "r") as in_file, \
-            open(db_node_file, 'w') as db_file, open(
-            mapping_file, 'a') as mf:
-        fm_file.write('# Full mode table for %s\n' % mode_name)
-        fm_file.write('# File generated on: %s\n' % utils.get_current_date())
-        fm_file.write('# mambo_nid%sdataset_ids\n' % delimiter)
+    num_lines = 0
+    num_comments = 0
+    num_skipped = 0
+    num_duplicates = 0
+    num_unmapped = 0
+    sink_rows = []
+    with metrics.stage('process'), \
+            (mode_delta_log.open_delta_log(full_mode_file, mode_name, delimiter) if delta_log
+             else compression.open_file(full_mode_file, 'w')) as fm_file, \
+            compression.open_file(input_file) as in_file, \
+            compression.open_file(db_node_file, 'w') as db_file, \
+            compression.open_file(mapping_file, 'a') as mf:
+        if not delta_log:
+            mode_delta_log.write_full_mode_header(fm_file, mode_name, delimiter)
 
         db_file.write('# Mode table for dataset: %s\n' % dataset_name)
         db_file.write('# File generated on: %s\n' % utils.get_current_date())
 
         add_schema = True
-        for line in in_file:
+        for num_lines, line in enumerate(in_file, 1):
+            if not num_lines & PROGRESS_MASK:
+                metrics.progress(num_lines)
             if line[0] in COMMENT or has_header:  # skip comments
                 has_header = False
+                num_comments += 1
                 continue
 
             vals = utils.split_then_strip(line, delimiter)
@@ -112,7 +190,11 @@ def create_mapped_mode_table(mode_name, input_file, dataset_name, db_id,
 
             node_id = vals[node_index].split('.')
             node_id = node_id[0] if len(node_id) == 1 else node_id[1]
-            if node_id in seen or len(node_id) == 0:
+            if len(node_id) == 0:
+                num_skipped += 1
+                continue
+            if node_id in seen:
+                num_duplicates += 1
                 continue
             attrs_str = ''
             for i in range(len(vals)):
@@ -121,23 +203,189 @@ def create_mapped_mode_table(mode_name, input_file, dataset_name, db_id,
             counter = 0
             if node_id in mapping:
                 counter = int(mapping[node_id])
-            elif not skip:
-                max_id = max_id + 1
-                counter = max_id
-                result = "%d%s" % (counter, delimiter)
-                for i in range(num_cols - 1):
-                    label = NONE if i + 1 != map_index else node_id
-                    result = result + label + delimiter
-                result = result.strip(delimiter) + '\n'
-                mf.write(result)
+            else:
+                num_unmapped += 1
+                if not skip:
+                    max_id = max_id + 1
+                    counter = max_id
+                    mf.write(get_mapping_row(counter, node_id, num_cols, map_index, delimiter))
+            # Without a delta log full_mode_map holds the whole full mode table, which is rewritten.
             db_ids = full_mode_map[counter] + "," + str(db_id) if counter in full_mode_map else str(db_id)
             fm_file.write('%d%s%s\n' % (counter, delimiter, db_ids))
             db_file.write('%d%s%s%s\n' % (counter, delimiter, vals[node_index], attrs_str))
             seen.add(node_id)
             seen_counter.add(counter)
+            if sink is not None:
+                sink_rows.append((counter, db_id))
+                if len(sink_rows) == SINK_BATCH_SIZE:
+                    sink(sink_rows)
+                    sink_rows = []
+        if sink_rows:
+            sink(sink_rows)
         for counter in full_mode_map:
             if counter not in seen_counter:
                 fm_file.write('%d%s%s\n' % (counter, delimiter, full_mode_map[counter]))
+    metrics.add('rows_read', num_lines - num_comments)
+    metrics.add('rows_skipped', num_skipped)
+    metrics.add('rows_duplicate', num_duplicates)
+    metrics.add('rows_missing_ids', num_unmapped)
+    metrics.add('rows_written', len(seen))
+    finish_metrics(metrics, full_mode_file, db_node_file, binary_output, delimiter, delta_log)
+
+
+def create_mapped_mode_table_external(mode_name, input_file, dataset_name, db_id,
+                                      mapping_file, skip, map_index, node_index,
+                                      output_dir, full_mode_file, db_node_file, delimiter=DELIMITER,
+                                      binary_output=False,
+                                      memory_budget=external_sort.DEFAULT_MEMORY_BUDGET, tmp_dir=None,
+                                      metrics=None, sink=None, delta_log=False):
+    '''Bounded-memory version of create_mapped_mode_table. The input ids, the mapping file and
+    the full mode table are sorted in runs spilled to tmp_dir and merge joined, so peak memory
+    stays around memory_budget bytes. The dataset specific table and the rows appended to the
+    mapping file are the same as in memory; the full mode table is written in mambo id order.
+    With delta_log, the full mode table is neither read nor rewritten.
+    '''
+    if full_mode_file is None:
+        full_mode_file = os.path.join(output_dir, utils.get_full_mode_file_name(mode_name))
+    if db_node_file is None:
+        db_node_file = os.path.join(output_dir, utils.get_mode_file_name(mode_name, db_id, dataset_name))
+    metrics = start_metrics(metrics, input_file, mapping_file, full_mode_file, db_node_file, delta_log)
+    metrics.set('memory_budget', memory_budget)
+    by_first = lambda record: record[0]
+
+    with external_sort.ExternalSorter(by_first, memory_budget, tmp_dir) as nodes, \
+            external_sort.ExternalSorter(by_first, memory_budget, tmp_dir) as mapping, \
+            external_sort.ExternalSorter(by_first, memory_budget, tmp_dir) as joined, \
+            external_sort.ExternalSorter(by_first, memory_budget, tmp_dir) as counters, \
+            external_sort.ExternalSorter(by_first, memory_budget, tmp_dir) as full_mode:
+        if os.path.isfile(full_mode_file) and not delta_log:
+            with metrics.stage('read_full_mode'), compression.open_file(full_mode_file) as fm_file:
+                for line in fm_file:
+                    if line[0] in COMMENT:  # skip comments
+                        continue
+                    split_line = line.strip().split(delimiter)
+                    full_mode.add((int(split_line[0]), split_line[1]))
+
+        max_id = 0
+        num_cols = 0
+        with metrics.stage('read_mapping'), compression.open_file(mapping_file) as mf:
+            for seq, line in enumerate(mf):
+                if line[0] in COMMENT:
+                    continue
+                split_line = line.strip().split(delimiter)
+                num_cols = len(split_line)
+                mapping.add((split_line[map_index], seq, split_line[0]))
+                max_id = int(split_line[0])
+
+        attrs_schema = None
+        has_header = True
+        num_read = 0
+        num_skipped = 0
+        with metrics.stage('read_input'), compression.open_file(input_file) as in_file:
+            for seq, line in enumerate(in_file):
+                if not (seq + 1) & PROGRESS_MASK:
+                    metrics.progress(seq + 1)
+                if line[0] in COMMENT or has_header:  # skip comments
+                    has_header = False
+                    continue
+                num_read += 1
+                vals = utils.split_then_strip(line, delimiter)
+                if attrs_schema is None:
+                    attrs_schema = '# mambo_nid%sdataset_nid' % delimiter
+                    for i in range(len(vals)):
+                        if i != node_index:
+                            attrs_schema += '%sC%d' % (delimiter, i)
+                node_id = vals[node_index].split('.')
+                node_id = node_id[0] if len(node_id) == 1 else node_id[1]
+                if len(node_id) == 0:
+                    num_skipped += 1
+                    continue
+                attrs_str = ''
+                for i in range(len(vals)):
+                    if i != node_index:
+                        attrs_str += delimiter + vals[i]
+                nodes.add((node_id, seq, vals[node_index], attrs_str))
+
+        # Merge join the first occurrence of every node id with the mapping; the last
+        # mapping row for a name wins.
+        with metrics.stage('join'):
+            names = external_sort.group_by_key(iter(mapping), by_first)
+            name, group = next(names, (None, None))
+            for node_id, occurrences in external_sort.group_by_key(iter(nodes), by_first):
+                while group is not None and name < node_id:
+                    name, group = next(names, (None, None))
+                mapped = None
+                if group is not None and name == node_id:
+                    mapped = int(group[-1][2])
+                _, seq, raw_id, attrs_str = occurrences[0]
+                joined.add((seq, node_id, raw_id, attrs_str, mapped))
+
+        num_unmapped = 0
+        num_written = 0
+        sink_rows = []
+        delta_file = mode_delta_log.open_delta_log(full_mode_file, mode_name, delimiter) if delta_log else None
+        with metrics.stage('write_db'), compression.open_file(db_node_file, 'w') as db_file, \
+                compression.open_file(mapping_file, 'a') as mf:
+            db_file.write('# Mode table for dataset: %s\n' % dataset_name)
+            db_file.write('# File generated on: %s\n' % utils.get_current_date())
+            if attrs_schema is not None:
+                db_file.write('%s\n' % attrs_schema)
+            for seq, node_id, raw_id, attrs_str, counter in joined:
+                if counter is None:
+                    num_unmapped += 1
+                    counter = 0
+                    if not skip:
+                        max_id = max_id + 1
+                        counter = max_id
+                        mf.write(get_mapping_row(counter, node_id, num_cols, map_index, delimiter))
+                db_file.write('%d%s%s%s\n' % (counter, delimiter, raw_id, attrs_str))
+                if delta_file is not None:
+                    delta_file.write('%d%s%d\n' % (counter, delimiter, db_id))
+                else:
+                    counters.add((counter, seq))
+                num_written += 1
+                if sink is not None:
+                    sink_rows.append((counter, db_id))
+                    if len(sink_rows) == SINK_BATCH_SIZE:
+                        sink(sink_rows)
+                        sink_rows = []
+            if sink_rows:
+                sink(sink_rows)
+        if delta_file is not None:
+            delta_file.close()
+
+        if not delta_log:
+            # Merge join the mambo ids of this dataset with the existing full mode table.
+            tmp_file = '%s.tmp%d' % (full_mode_file, os.getpid())
+            with metrics.stage('write_full_mode'), compression.open_file(
+                    tmp_file, 'w', compression=compression.get_compression(full_mode_file)) as fm_file:
+                mode_delta_log.write_full_mode_header(fm_file, mode_name, delimiter)
+                new_ids = external_sort.group_by_key(iter(counters), by_first)
+                new_id, new_group = next(new_ids, (None, None))
+                for counter, rows in external_sort.group_by_key(iter(full_mode), by_first):
+                    while new_group is not None and new_id < counter:
+                        for _ in new_group:
+                            fm_file.write('%d%s%d\n' % (new_id, delimiter, db_id))
+                        new_id, new_group = next(new_ids, (None, None))
+                    db_ids = rows[-1][1]
+                    if new_group is not None and new_id == counter:
+                        for _ in new_group:
+                            fm_file.write('%d%s%s,%d\n' % (counter, delimiter, db_ids, db_id))
+                        new_id, new_group = next(new_ids, (None, None))
+                    else:
+                        fm_file.write('%d%s%s\n' % (counter, delimiter, db_ids))
+                while new_group is not None:
+                    for _ in new_group:
+                        fm_file.write('%d%s%d\n' % (new_id, delimiter, db_id))
+                    new_id, new_group = next(new_ids, (None, None))
+            os.rename(tmp_file, full_mode_file)
+
+    metrics.add('rows_read', num_read)
+    metrics.add('rows_skipped', num_skipped)
+    metrics.add('rows_duplicate', num_read - num_skipped - num_written)
+    metrics.add('rows_missing_ids', num_unmapped)
+    metrics.add('rows_written', num_written)
+    finish_metrics(metrics, full_mode_file, db_node_file, binary_output, delimiter, delta_log)
 
 
 if __name__ == "__main__":
@@ -161,6 +409,14 @@ if __name__ == "__main__":
                         help='output file name; output contains mapping of mambo ids to db protein ids; OVERRIDES output dir argument',
                         default=None)
     parser.add_argument('--skip_missing_ids', action='store_true')
+    parser.add_argument('--binary_output', action='store_true', help='also write binary columnar tables')
+    parser.add_argument('--memory_budget', type=str, default=None,
+                        help='bound memory use to roughly this many bytes (e.g. 512M) by spilling sorted runs to disk')
+    parser.add_argument('--tmp_dir', type=str, default=None, help='directory for the spilled runs')
+    parser.add_argument('--delta_log', action='store_true',
+                        help='append to the delta log of the full mode table instead of rewriting it')
+    parser.add_argument('--metrics_file', help='file to append the build metrics to as a JSON line', default=None)
+    parser.add_argument('--progress', action='store_true', help='print progress to stderr')
     args = parser.parse_args()
 
     mode_name = args.mode_name
@@ -174,7 +430,13 @@ if __name__ == "__main__":
     output_dir = args.output_dir
     full_mode_file = args.full_mode_file
     db_node_file = args.db_node_file
+    binary_output = args.binary_output
+    memory_budget = external_sort.parse_memory_budget(args.memory_budget) if args.memory_budget else None
+    metrics = BuildMetrics(metrics_file=args.metrics_file,
+                           progress_stream=sys.stderr if args.progress else None)
 
     create_mapped_mode_table(mode_name, input_file, dataset_name, db_id,
                              mapping_file, skip, map_index, node_index,
-                             output_dir, full_mode_file, db_node_file)
+                             output_dir, full_mode_file, db_node_file,
+                             binary_output=binary_output, memory_budget=memory_budget,
+                             tmp_dir=args.tmp_dir, metrics=metrics, delta_log=args.delta_log)
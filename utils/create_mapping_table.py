@@ -1,105 +1,448 @@
+from __future__ import print_function
+
 import os
+import sys
 import argparse
+import compression
+import external_sort
+from metrics import BuildMetrics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 NULL = "NULL"
 NONE = "None"
 DELIMITER = "\t"
 COMMENT = "#"
+# Progress is checked every PROGRESS_MASK + 1 mapping file lines.
+PROGRESS_MASK = (1 << 16) - 1
+
+
+def get_title_line(title_line, titles, output_index1, output_index2, delimiter=DELIMITER):
+    title_fields = title_line.split(delimiter)[1:] if title_line else []
+    first_index = 0 if output_index1 < output_index2 else 1
+    second_index = 1 if output_index1 < output_index2 else 0
+    if first_index >= len(title_fields):
+        title_fields.insert(first_index, titles[first_index])
+        title_fields.insert(second_index, titles[second_index])
+    else:
+        title_fields[first_index] = titles[first_index]
+        if second_index >= len(title_fields):
+            title_fields.insert(second_index, titles[second_index])
+        else:
+            title_fields[second_index] = titles[second_index]
+    title_field_string = delimiter.join(title_fields).strip()
+    return "%sMambo_id%s" % (COMMENT, delimiter)  + title_field_string + "\n"
+
+
+def get_mapped_row(rest, name, mname, index1, index2, num_fields, delimiter=DELIMITER):
+    '''Returns the fields after the uid of the output row of a mapped name: a new row of
+    num_fields None placeholders with the name and its mapping if rest is None, and otherwise
+    the fields rest of the existing row, with the mapping added.'''
+    if rest is None:
+        terms = [NONE] * num_fields
+        terms[index1-1] = name
+        terms[index2-1] = mname
+        return delimiter.join(terms)
+    terms = rest.split(delimiter, index2)
+    if len(terms) < index2:
+        return rest + delimiter + mname
+    if terms[index2-1] == NONE:
+        print(rest.split(delimiter), name, mname)
+        terms[index2-1] = name
+        return delimiter.join(terms)
+    return rest
+
+
+def get_unmapped_row(rest, index2, delimiter=DELIMITER):
+    '''Returns the fields after the uid of an existing row whose name is not in the mapping,
+    with a None placeholder for the new column if it has none.'''
+    if rest is None:
+        return NONE
+    if rest.count(delimiter) + 1 < index2:
+        return rest + delimiter + NONE
+    return rest
 
 
 def create_mapping_table(mapping_file, mindex1, mindex2, output_file, 
                          output_index1, output_index2, output_title1, 
-                         output_title2, delimiter=DELIMITER):
+                         output_title2, delimiter=DELIMITER, memory_budget=None, tmp_dir=None,
+                         metrics=None):
+    '''Adds the mapping of mapping_file to the mapping table output_file. With memory_budget,
+    create_mapping_table_external is used; otherwise create_mapping_table_arrays if NumPy is
+    installed, and create_mapping_table_dicts if it is not.'''
+    if memory_budget is not None:
+        return create_mapping_table_external(mapping_file, mindex1, mindex2, output_file,
+                                             output_index1, output_index2, output_title1,
+                                             output_title2, delimiter, memory_budget, tmp_dir,
+                                             metrics)
+    if np is not None:
+        return create_mapping_table_arrays(mapping_file, mindex1, mindex2, output_file,
+                                           output_index1, output_index2, output_title1,
+                                           output_title2, delimiter, metrics)
+    return create_mapping_table_dicts(mapping_file, mindex1, mindex2, output_file,
+                                      output_index1, output_index2, output_title1,
+                                      output_title2, delimiter, metrics)
+
+
+def create_mapping_table_dicts(mapping_file, mindex1, mindex2, output_file,
+                               output_index1, output_index2, output_title1,
+                               output_title2, delimiter=DELIMITER, metrics=None):
+    '''Version of create_mapping_table that joins the mapping and the existing output table
+    through dictionaries. Rows for the names in the mapping file come first, in dictionary
+    order, followed by the remaining rows of the existing table.'''
+    metrics = start_metrics(metrics, mapping_file, output_file)
     index1 = output_index1 + 1
     index2 = output_index2 + 1
     title1 = output_title1 if output_title1 else "Index%d" % index1
     title2 = output_title2 if output_title2 else "Index%d" % index2
     titles = [title1, title2]
 
+    # Only the columns that are looked up are split out of each line.
     mapping = {}
-    with open(mapping_file, "r") as mf:
-        for line in mf:
+    max_split = max(mindex1, mindex2) + 1
+    num_lines = 0
+    num_comments = 0
+    num_skipped = 0
+    with metrics.stage('read_mapping'), compression.open_file(mapping_file) as mf:
+        for num_lines, line in enumerate(mf, 1):
+            if not num_lines & PROGRESS_MASK:
+                metrics.progress(num_lines)
             if line[0] == COMMENT:
+                num_comments += 1
                 continue
-            split_line = line.strip().split(delimiter)
+            split_line = line.strip().split(delimiter, max_split)
             name = split_line[mindex1]
             mname = split_line[mindex2]
             if name == NULL or mname == NULL:
+                num_skipped += 1
                 continue
             mapping[name] = mname
 
+    # Rows of the existing table are kept as unsplit strings (None for rows with no
+    # fields besides the uid) and only split again if they have to be modified.
     num_fields = 0
     name_uid_map = {}
-    uid_other_map = {}
+    uid_rest_map = {}
     title_line = None
     if os.path.isfile(output_file):
-        with open(output_file, "r") as of:
+        with metrics.stage('read_existing'), compression.open_file(output_file) as of:
             for line in of:
                 if line[0] == COMMENT:
                     title_line = line.strip()
                     continue
-                split_line = line.strip().split(delimiter)
-                num_fields = len(split_line) - 1
-                uid_other_map[int(split_line[0])] = split_line[1:]
+                line = line.strip()
+                split_line = line.split(delimiter, index1 + 1)
+                num_fields = line.count(delimiter)
+                uid = int(split_line[0])
+                uid_rest_map[uid] = line[len(split_line[0]) + len(delimiter):] if len(split_line) > 1 else None
                 if split_line[index1] != NONE:
-                    name_uid_map[split_line[index1]] = int(split_line[0])
-    max_count = max(uid_other_map.keys()) if len(uid_other_map.keys()) > 0 else -1
+                    name_uid_map[split_line[index1]] = uid
+    max_count = max(uid_rest_map.keys()) if len(uid_rest_map.keys()) > 0 else -1
     seen_ids = set()
-    with open(output_file, "w") as of:
-        title_fields = title_line.split(delimiter)[1:] if title_line else []
-        first_index = 0 if output_index1 < output_index2 else 1
-        second_index = 1 if output_index1 < output_index2 else 0
-        if first_index >= len(title_fields):
-            title_fields.insert(first_index, titles[first_index])
-            title_fields.insert(second_index, titles[second_index])
-        else:
-            title_fields[first_index] = titles[first_index]
-            if second_index >= len(title_fields):
-                title_fields.insert(second_index, titles[second_index])
-            else:
-                title_fields[second_index] = titles[second_index]
-        title_field_string = delimiter.join(title_fields).strip()
-        lines_to_write = ["%sMambo_id%s" % (COMMENT, delimiter)  + title_field_string + "\n"]
+    with metrics.stage('write'), compression.open_file(output_file, "w") as of:
+        lines_to_write = [get_title_line(title_line, titles, output_index1, output_index2, delimiter)]
 
+        new_num_fields = num_fields if index2 <= num_fields else num_fields + 1
+        new_num_fields = 2 if len(uid_rest_map.keys()) == 0 else new_num_fields
         for name in mapping:
-            terms = []
+            rest = None
             if name in name_uid_map:
                 counter = name_uid_map[name]
-                terms = uid_other_map[counter]
+                rest = uid_rest_map[counter]
             else:
                 max_count = max_count + 1
                 counter = max_count
-            if len(terms) == 0:
-                new_num_fields = num_fields if index2 <= num_fields else num_fields + 1
-                new_num_fields = 2 if len(uid_other_map.keys()) == 0 else new_num_fields
-                terms = [NONE] * new_num_fields
-                terms[index1-1] = name
-                terms[index2-1] = mapping[name]
-            elif len(terms) < index2:
-                terms.append(mapping[name])
-            elif terms[index2-1] == NONE:
-                print terms, name, mapping[name]
-                terms[index2-1] = name
-
-            string = delimiter.join(terms)
-            lines_to_write.append("%d%s%s\n" % (counter, delimiter, string))
+            new_rest = get_mapped_row(rest, name, mapping[name], index1, index2, new_num_fields, delimiter)
+            if rest is not None and counter in uid_rest_map:
+                uid_rest_map[counter] = new_rest
+            rest = new_rest
+
+            lines_to_write.append("%d%s%s\n" % (counter, delimiter, rest))
             seen_ids.add(counter)
 
-        for sid in uid_other_map:
+        for sid in uid_rest_map:
             if sid not in seen_ids:
-                terms = uid_other_map[sid]
-                if len(terms) < index2:
-                    terms.append(NONE)
+                lines_to_write.append("%d%s%s\n" % (int(sid), delimiter,
+                                                     get_unmapped_row(uid_rest_map[sid], index2, delimiter)))
+        of.writelines(lines_to_write)
+    metrics.add('rows_read', num_lines - num_comments)
+    metrics.add('rows_skipped', num_skipped)
+    metrics.add('rows_existing', len(uid_rest_map))
+    metrics.add('rows_written', len(lines_to_write) - 1)
+    metrics.finish()
+
+
+def get_first_and_last(keys):
+    '''Returns the distinct values of the array keys in sorted order, with the indices of their
+    first and last occurrence in keys.'''
+    if len(keys) == 0:
+        return keys, np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    # A stable sort keeps the occurrences of each value in order.
+    order = np.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    ends = np.append(starts[1:], len(keys)) - 1
+    return sorted_keys[starts], order[starts], order[ends]
+
+
+def create_mapping_table_arrays(mapping_file, mindex1, mindex2, output_file,
+                                output_index1, output_index2, output_title1,
+                                output_title2, delimiter=DELIMITER, metrics=None):
+    '''Array-backed version of create_mapping_table, used when NumPy is installed. The names of
+    the mapping file and of the existing output table are kept in NumPy arrays and merge joined
+    on their sorted order (np.unique and np.searchsorted) instead of through dictionaries. Rows
+    for the names in the mapping file come first, in order of first appearance and with their
+    last mapping, followed by the remaining rows of the existing table in file order; the output
+    is the same as that of create_mapping_table_dicts under Python 3. Uids of existing names are
+    kept; new names get new uids in order of first appearance.
+    '''
+    metrics = start_metrics(metrics, mapping_file, output_file)
+    index1 = output_index1 + 1
+    index2 = output_index2 + 1
+    title1 = output_title1 if output_title1 else "Index%d" % index1
+    title2 = output_title2 if output_title2 else "Index%d" % index2
+    titles = [title1, title2]
 
-                string = delimiter.join(terms)
-                lines_to_write.append("%d%s%s\n" % (int(sid), delimiter, string))
+    names = []
+    mnames = []
+    max_split = max(mindex1, mindex2) + 1
+    num_lines = 0
+    num_comments = 0
+    num_skipped = 0
+    with metrics.stage('read_mapping'), compression.open_file(mapping_file) as mf:
+        for num_lines, line in enumerate(mf, 1):
+            if not num_lines & PROGRESS_MASK:
+                metrics.progress(num_lines)
+            if line[0] == COMMENT:
+                num_comments += 1
+                continue
+            split_line = line.strip().split(delimiter, max_split)
+            name = split_line[mindex1]
+            mname = split_line[mindex2]
+            if name == NULL or mname == NULL:
+                num_skipped += 1
+                continue
+            names.append(name)
+            mnames.append(mname)
+
+    # As in create_mapping_table_dicts, rows of the existing table are kept as unsplit strings.
+    num_fields = 0
+    uids = []
+    rests = []
+    row_names = []
+    title_line = None
+    if os.path.isfile(output_file):
+        with metrics.stage('read_existing'), compression.open_file(output_file) as of:
+            for line in of:
+                if line[0] == COMMENT:
+                    title_line = line.strip()
+                    continue
+                line = line.strip()
+                split_line = line.split(delimiter, index1 + 1)
+                num_fields = line.count(delimiter)
+                uids.append(int(split_line[0]))
+                rests.append(line[len(split_line[0]) + len(delimiter):] if len(split_line) > 1 else None)
+                row_names.append(split_line[index1])
+
+    with metrics.stage('join'):
+        # The mapped names, in order of first appearance, with their last mapping.
+        names = np.array(names, dtype=str)
+        distinct_names, first, last = get_first_and_last(names)
+        order = np.argsort(first, kind='mergesort')
+        out_names = distinct_names[order]
+        out_mnames = [mnames[i] for i in last[order]]
+
+        # Existing rows by uid: a repeated uid keeps its first position and its last fields.
+        uids = np.array(uids, dtype=np.int64)
+        distinct_uids, uid_first, uid_last = get_first_and_last(uids)
+        # Existing names with the uid of their last row.
+        row_names = np.array(row_names, dtype=str)
+        named = np.flatnonzero(row_names != NONE)
+        existing_names, _, name_last = get_first_and_last(row_names[named])
+        existing_uids = uids[named[name_last]]
+
+        # Merge join of the sorted mapped names against the sorted existing names.
+        pos = np.searchsorted(existing_names, distinct_names)
+        pos[pos == len(existing_names)] = 0
+        if len(existing_names):
+            found = (existing_names[pos] == distinct_names)[order]
+            out_uids = np.where(found, existing_uids[pos][order], 0)
+        else:
+            found = np.zeros(len(out_names), dtype=bool)
+            out_uids = np.zeros(len(out_names), dtype=np.int64)
+        max_count = int(distinct_uids[-1]) if len(distinct_uids) else -1
+        num_new = len(out_uids) - int(found.sum())
+        out_uids[~found] = np.arange(max_count + 1, max_count + 1 + num_new)
+        out_rests = np.full(len(out_uids), -1, dtype=np.int64)
+        out_rests[found] = uid_last[np.searchsorted(distinct_uids, out_uids[found])]
+
+        # Existing rows whose uid is not mapped, in file order.
+        unmapped = np.flatnonzero(np.isin(distinct_uids, out_uids[found], invert=True))
+        unmapped = unmapped[np.argsort(uid_first[unmapped], kind='mergesort')]
+
+    with metrics.stage('write'), compression.open_file(output_file, "w") as of:
+        lines_to_write = [get_title_line(title_line, titles, output_index1, output_index2, delimiter)]
+
+        new_num_fields = num_fields if index2 <= num_fields else num_fields + 1
+        new_num_fields = 2 if len(distinct_uids) == 0 else new_num_fields
+        for name, mname, counter, rest_index in zip(out_names.tolist(), out_mnames, out_uids.tolist(),
+                                                    out_rests.tolist()):
+            rest = rests[rest_index] if rest_index >= 0 else None
+            lines_to_write.append("%d%s%s\n" % (counter, delimiter,
+                                                 get_mapped_row(rest, name, mname, index1, index2, new_num_fields,
+                                                                delimiter)))
+        for sid, rest_index in zip(distinct_uids[unmapped].tolist(), uid_last[unmapped].tolist()):
+            lines_to_write.append("%d%s%s\n" % (sid, delimiter, get_unmapped_row(rests[rest_index], index2, delimiter)))
         of.writelines(lines_to_write)
+    metrics.add('rows_read', num_lines - num_comments)
+    metrics.add('rows_skipped', num_skipped)
+    metrics.add('rows_existing', len(distinct_uids))
+    metrics.add('rows_written', len(lines_to_write) - 1)
+    metrics.finish()
+
+
+def start_metrics(metrics, mapping_file, output_file):
+    if metrics is None:
+        metrics = BuildMetrics()
+    if metrics.name is None:
+        metrics.name = os.path.basename(output_file)
+    metrics.set('input_files', [mapping_file])
+    metrics.set('output_files', [output_file])
+    return metrics
+
+
+def create_mapping_table_external(mapping_file, mindex1, mindex2, output_file,
+                                  output_index1, output_index2, output_title1,
+                                  output_title2, delimiter=DELIMITER,
+                                  memory_budget=external_sort.DEFAULT_MEMORY_BUDGET, tmp_dir=None,
+                                  metrics=None):
+    '''Bounded-memory version of create_mapping_table. The mapping and the existing output
+    table are sorted by name in runs spilled to tmp_dir and merge joined, so peak memory stays
+    around memory_budget bytes. Rows for the names in the mapping file come first, in order of
+    first appearance, followed by the remaining rows of the existing table in uid order. Uids of
+    existing names are kept; new names get new uids in order of first appearance.
+    '''
+    metrics = start_metrics(metrics, mapping_file, output_file)
+    metrics.set('memory_budget', memory_budget)
+    index1 = output_index1 + 1
+    index2 = output_index2 + 1
+    title1 = output_title1 if output_title1 else "Index%d" % index1
+    title2 = output_title2 if output_title2 else "Index%d" % index2
+    titles = [title1, title2]
+    by_first = lambda record: record[0]
+
+    with external_sort.ExternalSorter(by_first, memory_budget, tmp_dir) as mapping, \
+            external_sort.ExternalSorter(by_first, memory_budget, tmp_dir) as existing, \
+            external_sort.ExternalSorter(by_first, memory_budget, tmp_dir) as joined, \
+            external_sort.ExternalSorter(by_first, memory_budget, tmp_dir) as leftover:
+        max_split = max(mindex1, mindex2) + 1
+        num_read = 0
+        num_skipped = 0
+        with metrics.stage('read_mapping'), compression.open_file(mapping_file) as mf:
+            for seq, line in enumerate(mf):
+                if not (seq + 1) & PROGRESS_MASK:
+                    metrics.progress(seq + 1)
+                if line[0] == COMMENT:
+                    continue
+                num_read += 1
+                split_line = line.strip().split(delimiter, max_split)
+                name = split_line[mindex1]
+                mname = split_line[mindex2]
+                if name == NULL or mname == NULL:
+                    num_skipped += 1
+                    continue
+                mapping.add((name, seq, mname))
+
+        num_fields = 0
+        max_count = -1
+        title_line = None
+        num_existing = 0
+        if os.path.isfile(output_file):
+            with metrics.stage('read_existing'), compression.open_file(output_file) as of:
+                for line in of:
+                    if line[0] == COMMENT:
+                        title_line = line.strip()
+                        continue
+                    line = line.strip()
+                    split_line = line.split(delimiter, index1 + 1)
+                    num_fields = line.count(delimiter)
+                    uid = int(split_line[0])
+                    num_existing += 1
+                    max_count = max(max_count, uid)
+                    rest = line[len(split_line[0]) + len(delimiter):] if len(split_line) > 1 else None
+                    if split_line[index1] != NONE:
+                        existing.add((split_line[index1], uid, rest))
+                    else:
+                        leftover.add((uid, rest))
+        new_num_fields = num_fields if index2 <= num_fields else num_fields + 1
+        new_num_fields = 2 if max_count == -1 else new_num_fields
+
+        # Merge join on name. The last mapping and the last table row for a name win.
+        with metrics.stage('join'):
+            rows = external_sort.group_by_key(iter(existing), by_first)
+            row_name, row_group = next(rows, (None, None))
+            for name, group in external_sort.group_by_key(iter(mapping), by_first):
+                while row_group is not None and row_name < name:
+                    for _, uid, rest in row_group:
+                        leftover.add((uid, rest))
+                    row_name, row_group = next(rows, (None, None))
+                uid, rest = -1, None
+                if row_group is not None and row_name == name:
+                    for _, old_uid, old_rest in row_group[:-1]:
+                        leftover.add((old_uid, old_rest))
+                    _, uid, rest = row_group[-1]
+                    row_name, row_group = next(rows, (None, None))
+                joined.add((group[0][1], name, group[-1][2], uid, rest))
+            while row_group is not None:
+                for _, uid, rest in row_group:
+                    leftover.add((uid, rest))
+                row_name, row_group = next(rows, (None, None))
+
+        tmp_file = '%s.tmp%d' % (output_file, os.getpid())
+        num_written = 0
+        with metrics.stage('write'), compression.open_file(
+                tmp_file, "w", compression=compression.get_compression(output_file)) as of:
+            of.write(get_title_line(title_line, titles, output_index1, output_index2, delimiter))
+            for _, name, mname, counter, rest in joined:
+                if counter == -1:
+                    max_count = max_count + 1
+                    counter = max_count
+                if rest is None:
+                    terms = [NONE] * new_num_fields
+                    terms[index1-1] = name
+                    terms[index2-1] = mname
+                    rest = delimiter.join(terms)
+                else:
+                    terms = rest.split(delimiter, index2)
+                    if len(terms) < index2:
+                        rest = rest + delimiter + mname
+                    elif terms[index2-1] == NONE:
+                        terms[index2-1] = name
+                        rest = delimiter.join(terms)
+                of.write("%d%s%s\n" % (counter, delimiter, rest))
+                num_written += 1
+            for sid, rest in leftover:
+                if rest is None:
+                    rest = NONE
+                elif rest.count(delimiter) + 1 < index2:
+                    rest = rest + delimiter + NONE
+                of.write("%d%s%s\n" % (sid, delimiter, rest))
+                num_written += 1
+        os.rename(tmp_file, output_file)
+    metrics.add('rows_read', num_read)
+    metrics.add('rows_skipped', num_skipped)
+    metrics.add('rows_existing', num_existing)
+    metrics.add('rows_written', num_written)
+    metrics.finish()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Create dictionary mapping between naming terms.')
-    parser.add_argument('mapping_file', type=str, help='mapping file name. should be a tsv.')
-    parser.add_argument('output_file', type=str, help='output file name. should be a tsv.')
+    parser.add_argument('mapping_file', type=str, help='mapping file name. should be a tsv, optionally .gz or .zst compressed.')
+    parser.add_argument('output_file', type=str, help='output file name. should be a tsv; written compressed if it ends in .gz or .zst.')
 
     parser.add_argument('--map_index1', type=int, default = 0)
     parser.add_argument('--map_index2', type=int, default=1)
@@ -108,6 +451,12 @@ if __name__ == "__main__":
     parser.add_argument('--output_index2', type=int, default = 1)
     parser.add_argument('--output_title1', type=int, default = None)
     parser.add_argument('--output_title2', type=int, default = None)
+    parser.add_argument('--memory_budget', type=str, default=None,
+                        help='bound memory use to roughly this many bytes (e.g. 512M) by spilling sorted runs to disk')
+    parser.add_argument('--tmp_dir', type=str, default=None, help='directory for the spilled runs')
+    parser.add_argument('--metrics_file', type=str, default=None,
+                        help='file to append the build metrics to as a JSON line')
+    parser.add_argument('--progress', action='store_true', help='print progress to stderr')
 
     args = parser.parse_args()
 
@@ -120,7 +469,10 @@ if __name__ == "__main__":
     output_index2 = args.output_index2
     output_title1 = args.output_title1
     output_title2 = args.output_title2
+    memory_budget = external_sort.parse_memory_budget(args.memory_budget) if args.memory_budget else None
 
     create_mapping_table(mapping_file, mindex1, mindex2, output_file,
                        output_index1, output_index2, output_title1,
-                       output_title2)
+                       output_title2, memory_budget=memory_budget, tmp_dir=args.tmp_dir,
+                       metrics=BuildMetrics(metrics_file=args.metrics_file,
+                                            progress_stream=sys.stderr if args.progress else None))
@@ -0,0 +1,343 @@
+'''
+file: csr_adjacency.py
+
+Script that exports Mambo crossnets as compressed sparse row (CSR) adjacency arrays, built
+straight from the full crossnet tables written by create_mambo_crossnet_table.py, so that degree,
+neighborhood and traversal analytics do not need a TMMNet converted with ToNetwork.
+
+A CSR export is a directory containing:
+
+schema.json:             The number of nodes and edges, the array types, the exported crossnets with their
+                         number of edges in the catalog and their stamps (see get_crossnet_stamp) and, for
+                         a combined export, the offset of every mode in the combined node id space.
+out_offsets.npy          For every source node, the start of its edges in the out_* arrays; one extra
+                         entry holds the number of edges. The edges of node i are
+                         out_offsets[i]:out_offsets[i + 1].
+out_neighbors.npy        The destination node of every edge, grouped by source node.
+out_eids.npy             The mambo edge id of every edge, in the same order.
+in_offsets.npy,          The same for the opposite direction: the edges grouped by destination node,
+in_neighbors.npy,        with their source nodes as neighbors.
+in_eids.npy
+out_crossnets.npy,       For a combined export only: the index (in schema.json) of the crossnet of
+in_crossnets.npy         every edge.
+
+Offsets are int32 when there are fewer than 2^31 edges and int64 otherwise; node ids are int32
+when there are fewer than 2^31 nodes and int64 otherwise. The arrays are .npy files, which
+load_csr memory-maps, so loading an export costs page faults instead of parsing.
+
+A crossnet export uses the mambo node ids of its source and destination modes. A combined export
+of several crossnets gives every mode a contiguous range of node ids: node n of a mode is node
+mode_offsets[mode] + n.
+
+Edges are read from the binary columnar version of the full crossnet table (see
+columnar_table.py) when it is up to date, and from the tsv table otherwise.
+
+Usage:
+python csr_adjacency.py <catalog_file> <output_dir>
+
+Positional Arguments:
+catalog_file:            Path to a network catalog, as written by network_catalog.py or
+                         network_utils.build_network_incremental.
+output_dir:              Directory to which the exports are written.
+
+Optional arguments:
+--crossnet               Only export this crossnet. May be given several times. Defaults to all crossnets
+                         in the catalog.
+--per_crossnet           Flag; Write an export per crossnet, to output_dir/<crossnet>.csr, instead of one
+                         combined export to output_dir/network.csr.
+
+Example usage:
+python csr_adjacency.py miner.graph.catalog csr --crossnet miner-protein-gene --crossnet miner-function-protein
+'''
+
+import argparse
+import columnar_table
+import compression
+import json
+import os
+import utils
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SCHEMA_FILE = 'schema.json'
+COMBINED_NAME = 'network'
+DIRECTIONS = ['out', 'in']
+INT32_LIMIT = 1 << 31
+DELIMITER = '\t'
+
+
+def get_csr_dir_name(output_dir, name):
+    return os.path.join(output_dir, name + '.csr')
+
+
+def get_int_dtype(max_value):
+    '''Returns the smallest of int32 and int64 that holds values up to max_value.'''
+    return np.int32 if max_value < INT32_LIMIT else np.int64
+
+
+def read_full_crossnet_table(table_file, delimiter=DELIMITER):
+    '''Reads the columns of a full crossnet table.
+
+    Input:
+        table_file: path to the full crossnet table.
+    Output:
+        a tuple of int64 arrays (mambo_eids, dataset_ids, src_mambo_nids, dst_mambo_nids).
+    '''
+    if np is None:
+        raise ImportError('numpy is required to read crossnet tables into arrays')
+    cols_dir = columnar_table.get_columnar_dir_name(table_file)
+    if os.path.isfile(os.path.join(cols_dir, columnar_table.SCHEMA_FILE)):
+        table = columnar_table.load_columnar_table(cols_dir)
+        try:
+            if len(table) == utils.get_ledger(table_file)['num_rows']:
+                return tuple(np.array(table[name]) for name, _ in columnar_table.FULL_CROSSNET_SCHEMA)
+        finally:
+            table.close()
+    columns = tuple(array('l') for _ in columnar_table.FULL_CROSSNET_SCHEMA)
+    with compression.open_file(table_file) as inF:
+        for line in inF:
+            if line[0] == '#':
+                continue
+            vals = line.split(delimiter)
+            for column, value in zip(columns, vals):
+                column.append(int(value))
+    return tuple(np.array(column, dtype=np.int64) for column in columns)
+
+
+def read_crossnet_edges(table_file, delimiter=DELIMITER):
+    '''Reads the edges of a full crossnet table.
+
+    Input:
+        table_file: path to the full crossnet table.
+    Output:
+        a tuple of int64 arrays (mambo_eids, src_mambo_nids, dst_mambo_nids).
+    '''
+    eids, _, srcs, dsts = read_full_crossnet_table(table_file, delimiter)
+    return eids, srcs, dsts
+
+
+def build_csr(keys, num_nodes):
+    '''Groups edges by a node id.
+
+    Input:
+        keys: array with the node id of every edge, e.g. the source node ids.
+        num_nodes: number of nodes; every key must be smaller.
+    Output:
+        a tuple (offsets, order): offsets as in the file header, and the permutation that
+        sorts the edges by key. The sort is stable, so the edges of a node stay in table order.
+    '''
+    if len(keys) and keys.max() >= num_nodes:
+        raise ValueError('Node id %d is out of range for %d nodes' % (keys.max(), num_nodes))
+    order = np.argsort(keys, kind='mergesort')
+    offsets = np.zeros(num_nodes + 1, dtype=get_int_dtype(len(keys)))
+    np.cumsum(np.bincount(keys, minlength=num_nodes), out=offsets[1:])
+    return offsets, order
+
+
+def write_csr(path, src, dst, eids, num_src_nodes, num_dst_nodes, crossnets=None, metadata=None):
+    '''Writes a CSR export of the given edges to path; see the file header.
+
+    Input:
+        src, dst, eids: arrays with the source and destination node ids and the mambo edge id
+            of every edge.
+        num_src_nodes, num_dst_nodes: number of source and destination nodes.
+        crossnets: array with the crossnet index of every edge, or None.
+        metadata: dictionary of extra entries for schema.json.
+    Output:
+        the schema, as written to schema.json.
+    '''
+    schema_file = os.path.join(path, SCHEMA_FILE)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    elif os.path.isfile(schema_file):
+        os.remove(schema_file)
+    node_dtype = get_int_dtype(max(num_src_nodes, num_dst_nodes))
+    for direction, keys, neighbors, num_nodes in (('out', src, dst, num_src_nodes),
+                                                  ('in', dst, src, num_dst_nodes)):
+        offsets, order = build_csr(keys, num_nodes)
+        np.save(os.path.join(path, direction + '_offsets.npy'), offsets)
+        np.save(os.path.join(path, direction + '_neighbors.npy'), neighbors[order].astype(node_dtype))
+        np.save(os.path.join(path, direction + '_eids.npy'), eids[order])
+        if crossnets is not None:
+            np.save(os.path.join(path, direction + '_crossnets.npy'), crossnets[order])
+    schema = {'num_src_nodes': num_src_nodes, 'num_dst_nodes': num_dst_nodes, 'num_edges': len(eids),
+              'offset_dtype': np.dtype(get_int_dtype(len(eids))).name, 'node_dtype': np.dtype(node_dtype).name}
+    schema.update(metadata or {})
+    # schema.json is written last, so an interrupted export is not mistaken for a complete one.
+    tmp_file = '%s.tmp%d' % (schema_file, os.getpid())
+    with open(tmp_file, 'w') as outF:
+        json.dump(schema, outF, indent=1, sort_keys=True)
+    os.rename(tmp_file, schema_file)
+    return schema
+
+
+def get_num_nodes(catalog, mode):
+    '''Returns the size of the mambo node id space of a mode in a network catalog. Raises a
+    ValueError if the mode table has a pending delta log, whose nodes the catalog misses (see
+    utils.check_no_delta_log).'''
+    if 'path' in catalog['modes'][mode]:
+        utils.check_no_delta_log(catalog['modes'][mode]['path'])
+    max_id = catalog['modes'][mode]['max_id']
+    return 0 if max_id is None else max_id + 1
+
+
+def get_crossnet_stamp(catalog, name):
+    '''Returns the stamp of a crossnet of a network catalog, which tells whether an export of it is
+    current: the size and last bytes of its table, as recorded in the ledger of the table (see
+    utils.get_ledger), and the number of nodes of its modes in the catalog.'''
+    entry = catalog['crossnets'][name]
+    ledger = utils.get_ledger(entry['path'])
+    return {'size': ledger['size'], 'tail': ledger['tail'],
+            'num_nodes': dict((mode, get_num_nodes(catalog, mode)) for mode in (entry['src'], entry['dst']))}
+
+
+def get_crossnet_stamps(catalog, crossnets):
+    return dict((name, get_crossnet_stamp(catalog, name)) for name in crossnets)
+
+
+def check_node_ids(catalog, node_ids, mode, table_file):
+    '''Raises a ValueError if a crossnet table references node ids of a mode beyond the mambo
+    node id space recorded in the catalog, e.g. nodes added after the catalog was written.'''
+    num_nodes = get_num_nodes(catalog, mode)
+    if len(node_ids) and node_ids.max() >= num_nodes:
+        raise ValueError('%s references %s node %d, but the catalog records %d %s node ids; the catalog '
+                         'is stale and must be rebuilt (after compacting the delta logs of mapped full mode '
+                         'tables, see mode_delta_log.py)' % (table_file, mode, node_ids.max(), num_nodes, mode))
+
+
+def export_crossnet_csr(catalog, name, output_dir):
+    '''Writes the CSR export of one crossnet of a network catalog (see network_utils.build_catalog)
+    to output_dir/<name>.csr, with the mambo node ids of its modes.
+
+    Output:
+        the path of the export.
+    '''
+    entry = catalog['crossnets'][name]
+    # The stamp is taken before the edges are read, so rows appended meanwhile make the export stale.
+    stamps = get_crossnet_stamps(catalog, [name])
+    eids, src, dst = read_crossnet_edges(entry['path'])
+    check_node_ids(catalog, src, entry['src'], entry['path'])
+    check_node_ids(catalog, dst, entry['dst'], entry['path'])
+    path = get_csr_dir_name(output_dir, name)
+    write_csr(path, src, dst, eids, get_num_nodes(catalog, entry['src']), get_num_nodes(catalog, entry['dst']),
+              metadata={'crossnets': [name], 'src': entry['src'], 'dst': entry['dst'],
+                        'num_edges_per_crossnet': {name: entry['num_edges']}, 'crossnet_stamps': stamps})
+    return path
+
+
+def export_network_csr(catalog, output_dir, crossnets=None):
+    '''Writes the combined CSR export of crossnets of a network catalog to
+    output_dir/network.csr. The source and destination node ids are in the same, combined node
+    id space, so that out_* and in_* together give the neighbors of a node over all the
+    crossnets.
+
+    Input:
+        crossnets: names of the crossnets to include. Defaults to all.
+    Output:
+        the path of the export.
+    '''
+    if crossnets is None:
+        crossnets = sorted(catalog['crossnets'])
+    modes = sorted(set(catalog['crossnets'][name][end] for name in crossnets for end in ('src', 'dst')))
+    mode_offsets = {}
+    num_nodes = 0
+    for mode in modes:
+        mode_offsets[mode] = num_nodes
+        num_nodes += get_num_nodes(catalog, mode)
+    stamps = get_crossnet_stamps(catalog, crossnets)
+    all_eids, all_src, all_dst, all_crossnets = [], [], [], []
+    for index, name in enumerate(crossnets):
+        entry = catalog['crossnets'][name]
+        eids, src, dst = read_crossnet_edges(entry['path'])
+        check_node_ids(catalog, src, entry['src'], entry['path'])
+        check_node_ids(catalog, dst, entry['dst'], entry['path'])
+        all_eids.append(eids)
+        all_src.append(src + mode_offsets[entry['src']])
+        all_dst.append(dst + mode_offsets[entry['dst']])
+        all_crossnets.append(np.full(len(eids), index, dtype=np.int16 if len(crossnets) < (1 << 15) else np.int32))
+    path = get_csr_dir_name(output_dir, COMBINED_NAME)
+    empty = np.zeros(0, dtype=np.int64)
+    write_csr(path, np.concatenate(all_src or [empty]), np.concatenate(all_dst or [empty]),
+              np.concatenate(all_eids or [empty]), num_nodes, num_nodes,
+              np.concatenate(all_crossnets or [empty.astype(np.int16)]),
+              {'crossnets': crossnets, 'mode_offsets': mode_offsets,
+               'num_edges_per_crossnet': dict((name, catalog['crossnets'][name]['num_edges']) for name in crossnets),
+               'crossnet_stamps': stamps})
+    return path
+
+
+class CSRAdjacency(object):
+    '''Read-only, memory-mapped view of a CSR export. The arrays are attributes named as their
+    files, e.g. out_offsets and in_neighbors.'''
+
+    def __init__(self, path):
+        if np is None:
+            raise ImportError('numpy is required to read CSR adjacency arrays')
+        self.path = path
+        with open(os.path.join(path, SCHEMA_FILE), 'r') as inF:
+            self.schema = json.load(inF)
+        for direction in DIRECTIONS:
+            for array_name in ('offsets', 'neighbors', 'eids', 'crossnets', 'counts'):
+                file_name = os.path.join(path, '%s_%s.npy' % (direction, array_name))
+                if os.path.isfile(file_name):
+                    setattr(self, '%s_%s' % (direction, array_name), _load_array(file_name))
+
+    def get_node_id(self, mode, mambo_nid):
+        '''Returns the node id of a mambo node id in a combined export.'''
+        return self.schema['mode_offsets'][mode] + mambo_nid
+
+    def degree(self, node, direction='out'):
+        offsets = getattr(self, direction + '_offsets')
+        return int(offsets[node + 1] - offsets[node])
+
+    def degrees(self, direction='out'):
+        '''Returns an array with the degree of every node.'''
+        return np.diff(getattr(self, direction + '_offsets'))
+
+    def neighbors(self, node, direction='out'):
+        '''Returns a view of the neighbors of a node.'''
+        offsets = getattr(self, direction + '_offsets')
+        return getattr(self, direction + '_neighbors')[offsets[node]:offsets[node + 1]]
+
+    def edge_ids(self, node, direction='out'):
+        '''Returns a view of the mambo edge ids of the edges of a node, in the order of neighbors.'''
+        offsets = getattr(self, direction + '_offsets')
+        return getattr(self, direction + '_eids')[offsets[node]:offsets[node + 1]]
+
+
+def _load_array(file_name):
+    try:
+        return np.load(file_name, mmap_mode='r')
+    except ValueError:
+        # Older NumPy versions cannot memory-map empty arrays.
+        return np.load(file_name)
+
+
+def load_csr(path):
+    '''Memory-maps the CSR export at path.
+
+    Output:
+        a CSRAdjacency.
+    '''
+    return CSRAdjacency(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export Mambo crossnets as CSR adjacency arrays')
+    parser.add_argument('catalog_file', help='network catalog, as written by network_catalog.py or build_network_incremental')
+    parser.add_argument('output_dir', help='directory to which the exports are written')
+    parser.add_argument('--crossnet', action='append', help='crossnet to export; may be repeated', default=None)
+    parser.add_argument('--per_crossnet', action='store_true', help='write one export per crossnet')
+    args = parser.parse_args()
+
+    with open(args.catalog_file, 'r') as inF:
+        catalog = json.load(inF)
+    if args.per_crossnet:
+        for name in args.crossnet or sorted(catalog['crossnets']):
+            export_crossnet_csr(catalog, name, args.output_dir)
+    else:
+        export_network_csr(catalog, args.output_dir, args.crossnet)
@@ -0,0 +1,114 @@
+'''
+file: external_sort.py
+
+Bounded-memory sorting for the table builders. Records (tuples of strings and integers) are
+buffered in memory until their estimated size reaches the memory budget, then sorted and
+spilled to a temporary run file. Iterating over the sorter k-way merges the runs.
+
+Used by the bounded-memory modes of create_mapping_table.py and create_mapped_mode_table.py,
+which replace their in-memory dictionaries with merge joins over sorted streams.
+'''
+
+import heapq
+import marshal
+import os
+import shutil
+import tempfile
+
+DEFAULT_MEMORY_BUDGET = 1 << 28
+# Approximate per-field overhead of a buffered record, on top of the string contents.
+FIELD_OVERHEAD = 64
+
+
+class ExternalSorter(object):
+    '''Sorts records by key with bounded memory. The sort is stable: records with equal keys
+    come out in the order they were added.'''
+
+    def __init__(self, key, memory_budget=DEFAULT_MEMORY_BUDGET, tmp_dir=None):
+        self.key = key
+        self.memory_budget = memory_budget
+        self.tmp_dir = tempfile.mkdtemp(prefix='mambo-sort-', dir=tmp_dir)
+        self.buffer = []
+        self.buffer_size = 0
+        self.runs = []
+        self.num_records = 0
+
+    def add(self, record):
+        self.buffer.append(record)
+        self.buffer_size += sum(len(v) if isinstance(v, str) else 8 for v in record) \
+            + FIELD_OVERHEAD * len(record)
+        self.num_records += 1
+        if self.buffer_size >= self.memory_budget:
+            self._spill()
+
+    def _spill(self):
+        self.buffer.sort(key=self.key)
+        run_file = os.path.join(self.tmp_dir, 'run-%d' % len(self.runs))
+        with open(run_file, 'wb') as outF:
+            dump = marshal.dump
+            for record in self.buffer:
+                dump(record, outF)
+        self.runs.append(run_file)
+        self.buffer = []
+        self.buffer_size = 0
+
+    def __iter__(self):
+        '''Yields all added records in sorted order.'''
+        if not self.runs:
+            self.buffer.sort(key=self.key)
+            return iter(self.buffer)
+        if self.buffer:
+            self._spill()
+        # Ties are broken by run index and position, which keeps the merge stable.
+        streams = [self._decorate(i, run_file) for i, run_file in enumerate(self.runs)]
+        return (record for _, _, _, record in heapq.merge(*streams))
+
+    def _decorate(self, run_index, run_file):
+        key = self.key
+        for n, record in enumerate(read_run(run_file)):
+            yield key(record), run_index, n, record
+
+    def close(self):
+        self.buffer = []
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_run(run_file):
+    '''Yields the records of a run file written by ExternalSorter.'''
+    with open(run_file, 'rb') as inF:
+        load = marshal.load
+        while True:
+            try:
+                yield load(inF)
+            except EOFError:
+                break
+
+
+def group_by_key(records, key):
+    '''Groups consecutive records with equal keys; yields (key, list of records) pairs.'''
+    current = None
+    group = []
+    for record in records:
+        k = key(record)
+        if group and k != current:
+            yield current, group
+            group = []
+        current = k
+        group.append(record)
+    if group:
+        yield current, group
+
+
+def parse_memory_budget(value):
+    '''Parses a memory budget such as 512M or 4G into a number of bytes.'''
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    value = str(value).strip().upper()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
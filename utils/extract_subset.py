@@ -0,0 +1,250 @@
+'''
+file: extract_subset.py
+
+Script that extracts the subset of raw interaction files (e.g. GeneMANIA, STRING or any other
+delimited edge list) whose two endpoints are both in a given set of node ids, e.g. the nodes of a
+study's mode table.
+
+Every input file is streamed in blocks and the kept lines are written unchanged to a file of the
+same name in the output directory, compressed like the input (see compression.py), so the outputs
+can be given directly to create_mambo_crossnet_table.py or ingest_crossnets.py. Comment lines
+(starting with '#') are kept, and the first header_lines lines of each file are kept as comments.
+Files are processed in parallel; the node id sets are read once, before the worker processes are
+started.
+
+Usage:
+python extract_subset.py <input_dir> <output_dir> <src_ids_file>
+
+Positional Arguments:
+input_dir:               Directory containing the raw interaction files.
+output_dir:              Directory to which the filtered files are written.
+src_ids_file:            File containing the allowed source node ids, one per line (e.g. icgc_parsed.tsv),
+                         or a dataset specific mode table as outputted by create_mambo_mode_table.py
+                         (with --src_ids_column 1).
+
+Optional arguments:
+--dst_ids_file           File containing the allowed destination node ids. Defaults to src_ids_file.
+--src_ids_column         Column of the node ids in src_ids_file. Defaults to 0.
+--dst_ids_column         Column of the node ids in dst_ids_file. Defaults to src_ids_column.
+--pattern                Only process the input files matching this pattern, e.g. Pathway.*.txt. May be
+                         given several times. Defaults to all files.
+--src_node_index         The index of the column with the src node id. Defaults to 0.
+--dst_node_index         The index of the column with the dst node id. Defaults to 1.
+--src_mode_filter        The filter (see id_filters.py) applied to the source node ids before they are
+                         looked up, e.g. remove_species_id for STRING. The lines are written unchanged.
+--dst_mode_filter        The filter (see id_filters.py) applied to the destination node ids.
+--header_lines           Number of header lines at the start of each input file. Defaults to 0.
+--delimiter              Column delimiter of the input files. Defaults to tab.
+--num_workers            Number of worker processes. Defaults to the number of CPUs.
+--metrics_file           Append the metrics of every processed file to this file as JSON lines.
+
+Example usage:
+Keeping the GeneMANIA links between ICGC genes:
+
+python extract_subset.py Homo_sapiens/ datasets/cancer_example/gene-gene/genemania_data datasets/cancer_example/gene/icgc_parsed.tsv --pattern 'Co-expression.*' --pattern 'Pathway.*' --header_lines 1
+'''
+
+import argparse
+import compression
+import fnmatch
+import multiprocessing
+import os
+import utils
+from metrics import BuildMetrics
+
+BLOCK_SIZE = 1 << 22
+DELIMITER = '\t'
+
+
+def read_node_ids(ids_file, column=0, delimiter=DELIMITER):
+    '''Reads a set of node ids from one column of a file, skipping comment lines.
+
+    Input:
+        ids_file: path to the file.
+        column: index of the column with the node ids.
+    Output:
+        set of node ids.
+    '''
+    node_ids = set()
+    with compression.open_file(ids_file) as inF:
+        for line in inF:
+            if line[0] == '#' or not line.strip():
+                continue
+            vals = line.split(delimiter, column + 1)
+            if len(vals) > column:
+                node_ids.add(vals[column].strip())
+    return node_ids
+
+
+def find_input_files(input_dir, patterns=None):
+    '''Returns the sorted names of the files in input_dir matching any of the patterns.'''
+    file_names = []
+    for file_name in sorted(os.listdir(input_dir)):
+        if not os.path.isfile(os.path.join(input_dir, file_name)):
+            continue
+        if patterns and not any(fnmatch.fnmatch(file_name, pattern) for pattern in patterns):
+            continue
+        file_names.append(file_name)
+    return file_names
+
+
+def filter_lines(lines, src_ids, dst_ids, src_node_index, dst_node_index, delimiter,
+                 src_filter=None, dst_filter=None):
+    '''Returns the lines whose source and destination node ids are in src_ids and dst_ids,
+    and the number of lines with too few columns. Comment lines must be removed beforehand.'''
+    maxsplit = max(src_node_index, dst_node_index) + 1
+    kept = []
+    num_short = 0
+    for line in lines:
+        vals = line.split(delimiter, maxsplit)
+        if len(vals) < maxsplit:
+            if line.strip():
+                num_short += 1
+            continue
+        src_id = vals[src_node_index].strip()
+        dst_id = vals[dst_node_index].strip()
+        if src_filter is not None:
+            src_id = src_filter(src_id)
+        if dst_filter is not None:
+            dst_id = dst_filter(dst_id)
+        if src_id in src_ids and dst_id in dst_ids:
+            kept.append(line)
+    return kept, num_short
+
+
+def extract_file(input_file, output_file, src_ids, dst_ids, src_node_index=0, dst_node_index=1,
+                 src_mode_filter=None, dst_mode_filter=None, header_lines=0, delimiter=DELIMITER,
+                 block_size=BLOCK_SIZE, metrics=None):
+    '''Writes the lines of input_file whose endpoints are both allowed to output_file.
+
+    Input:
+        src_ids, dst_ids: sets of allowed source and destination node ids.
+        src_mode_filter, dst_mode_filter: id filter specs, see id_filters.py.
+        header_lines: number of lines at the start of input_file kept as comments.
+        block_size: approximate number of bytes read and written at a time.
+    Output:
+        the counters of the metrics.
+    '''
+    if metrics is None:
+        metrics = BuildMetrics()
+    metrics.set('input_file', input_file)
+    metrics.set('output_file', output_file)
+    src_filter = utils.get_filter(src_mode_filter)
+    dst_filter = utils.get_filter(dst_mode_filter)
+    num_read = num_comments = num_short = num_written = 0
+    with metrics.stage('filter'), compression.open_file(input_file) as inF, \
+            compression.open_file(output_file, 'w') as outF:
+        for _ in range(header_lines):
+            line = inF.readline()
+            if not line:
+                break
+            outF.write(line if line[0] == '#' else '# ' + line)
+        while True:
+            lines = inF.readlines(block_size)
+            if not lines:
+                break
+            num_read += len(lines)
+            data_lines = [line for line in lines if line[0] != '#']
+            kept, short = filter_lines(data_lines, src_ids, dst_ids, src_node_index, dst_node_index,
+                                       delimiter, src_filter, dst_filter)
+            num_short += short
+            num_written += len(kept)
+            if len(data_lines) < len(lines):
+                # Comments are written in place. Equal lines are either all kept or all not.
+                num_comments += len(lines) - len(data_lines)
+                kept_lines = set(kept)
+                kept = [line for line in lines if line[0] == '#' or line in kept_lines]
+            outF.writelines(kept)
+            metrics.progress(num_read)
+    metrics.add('rows_read', num_read)
+    metrics.add('rows_skipped', num_comments + num_short)
+    metrics.add('rows_filtered', num_read - num_comments - num_short - num_written)
+    metrics.add('rows_written', num_written)
+    metrics.finish()
+    return metrics.counters
+
+
+# State shared with the worker processes. It is set before the pool is created, so forked
+# workers inherit the node id sets instead of re-reading them.
+_shared = {}
+
+
+def _extract_file(file_name):
+    options = _shared['options']
+    metrics = BuildMetrics(file_name, metrics_file=options['metrics_file'])
+    return file_name, extract_file(
+        os.path.join(_shared['input_dir'], file_name), os.path.join(_shared['output_dir'], file_name),
+        _shared['src_ids'], _shared['dst_ids'], options['src_node_index'], options['dst_node_index'],
+        options['src_mode_filter'], options['dst_mode_filter'], options['header_lines'],
+        options['delimiter'], options['block_size'], metrics)
+
+
+def extract_subset(input_dir, output_dir, src_ids_file, dst_ids_file=None, src_ids_column=0,
+                   dst_ids_column=None, patterns=None, src_node_index=0, dst_node_index=1,
+                   src_mode_filter=None, dst_mode_filter=None, header_lines=0, delimiter=DELIMITER,
+                   num_workers=None, metrics_file=None, block_size=BLOCK_SIZE):
+    '''Extracts the subset of every matching file in input_dir; see the file header.
+
+    Input:
+        patterns: list of file name patterns, or None for all files.
+        num_workers: number of worker processes; files are processed in this process if it is 1.
+    Output:
+        a dictionary from file name to the counters of that file.
+    '''
+    if dst_ids_column is None:
+        dst_ids_column = src_ids_column
+    src_ids = read_node_ids(src_ids_file, src_ids_column)
+    if dst_ids_file is None or (os.path.samefile(src_ids_file, dst_ids_file) and src_ids_column == dst_ids_column):
+        dst_ids = src_ids
+    else:
+        dst_ids = read_node_ids(dst_ids_file, dst_ids_column)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    if os.path.samefile(input_dir, output_dir):
+        raise ValueError('output_dir must differ from input_dir')
+
+    file_names = find_input_files(input_dir, patterns)
+    # Largest files first, so that a big file does not start last and hold up the pool.
+    file_names.sort(key=lambda file_name: -os.path.getsize(os.path.join(input_dir, file_name)))
+    _shared.update(input_dir=input_dir, output_dir=output_dir, src_ids=src_ids, dst_ids=dst_ids,
+                   options=dict(src_node_index=src_node_index, dst_node_index=dst_node_index,
+                                src_mode_filter=src_mode_filter, dst_mode_filter=dst_mode_filter,
+                                header_lines=header_lines, delimiter=delimiter, block_size=block_size,
+                                metrics_file=metrics_file))
+    num_workers = min(num_workers or multiprocessing.cpu_count(), max(len(file_names), 1))
+    try:
+        if num_workers == 1:
+            return dict(_extract_file(file_name) for file_name in file_names)
+        pool = multiprocessing.Pool(num_workers)
+        try:
+            return dict(pool.imap_unordered(_extract_file, file_names))
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _shared.clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract the links between a set of nodes from raw interaction files')
+    parser.add_argument('input_dir', help='directory containing the raw interaction files')
+    parser.add_argument('output_dir', help='directory to which the filtered files are written')
+    parser.add_argument('src_ids_file', help='file containing the allowed source node ids')
+    parser.add_argument('--dst_ids_file', help='file containing the allowed destination node ids', default=None)
+    parser.add_argument('--src_ids_column', type=int, default=0)
+    parser.add_argument('--dst_ids_column', type=int, default=None)
+    parser.add_argument('--pattern', action='append', help='file name pattern; may be repeated', default=None)
+    parser.add_argument('--src_node_index', type=int, default=0)
+    parser.add_argument('--dst_node_index', type=int, default=1)
+    parser.add_argument('--src_mode_filter', type=str, help='id filter spec, e.g. remove_species_id:10090', default=None)
+    parser.add_argument('--dst_mode_filter', type=str, help='id filter spec, e.g. remove_species_id:10090', default=None)
+    parser.add_argument('--header_lines', type=int, default=0)
+    parser.add_argument('--delimiter', default=DELIMITER)
+    parser.add_argument('--num_workers', type=int, default=None)
+    parser.add_argument('--metrics_file', help='file to append the metrics to as JSON lines', default=None)
+    args = parser.parse_args()
+
+    extract_subset(args.input_dir, args.output_dir, args.src_ids_file, args.dst_ids_file, args.src_ids_column,
+                   args.dst_ids_column, args.pattern, args.src_node_index, args.dst_node_index,
+                   args.src_mode_filter, args.dst_mode_filter, args.header_lines, args.delimiter,
+                   args.num_workers, args.metrics_file)
@@ -0,0 +1,145 @@
+'''
+file: id_filters.py
+
+Compiled filters applied to node ids before they are looked up in a mode table, e.g. by the
+--src_mode_filter and --dst_mode_filter options of create_mambo_crossnet_table.py.
+
+A filter is named by a spec of the form <filter_name>[:<argument>]:
+
+remove_species_id             Removes the human species prefix, e.g. 9606.ENSP00000000233 -> ENSP00000000233.
+remove_species_id:<ids>       Removes any of the given comma separated species prefixes,
+                              e.g. remove_species_id:10090,10116.
+remove_species_id:all         Removes the prefix of any species in SPECIES_IDS.
+add_species_id                Adds the human species prefix.
+add_species_id:<id>           Adds the given species prefix, e.g. add_species_id:7227.
+
+compile_filter parses a spec once and returns the filter as a function of one id. Ids repeat
+heavily in edge lists (every STRING protein appears in hundreds of links), so the function
+memoizes its results in a bounded cache that keeps recently used ids.
+'''
+
+HUMAN_SPECIES_ID = '9606'
+# NCBI taxonomy ids of the organisms in datasets/protein_example/mappings.
+SPECIES_IDS = {
+    '9606': 'Homo sapiens',
+    '10090': 'Mus musculus',
+    '10116': 'Rattus norvegicus',
+    '3702': 'Arabidopsis thaliana',
+    '4932': 'Saccharomyces cerevisiae',
+    '511145': 'Escherichia coli K-12 MG1655',
+    '6239': 'Caenorhabditis elegans',
+    '7227': 'Drosophila melanogaster',
+    '7955': 'Danio rerio',
+}
+ALL_SPECIES = 'all'
+DEFAULT_CACHE_SIZE = 1 << 20
+
+
+def make_remove_species_id(species_ids):
+    '''Returns a function that removes any of the given species prefixes from an id. Ids that
+    do not consist of exactly a known prefix, '.' and a name are returned unchanged.'''
+    species_ids = frozenset(species_ids)
+
+    def remove_species_id(name):
+        prefix, sep, rest = name.partition('.')
+        if not sep or '.' in rest or prefix.strip() not in species_ids:
+            return name
+        return rest.strip()
+    return remove_species_id
+
+
+def make_add_species_id(species_id):
+    '''Returns a function that prefixes an id with the given species id.'''
+    prefix = species_id + '.'
+
+    def add_species_id(name):
+        return prefix + name
+    return add_species_id
+
+
+def parse_species_ids(argument):
+    if argument is None:
+        return [HUMAN_SPECIES_ID]
+    if argument == ALL_SPECIES:
+        return list(SPECIES_IDS)
+    species_ids = [species_id.strip() for species_id in argument.split(',') if species_id.strip()]
+    for species_id in species_ids:
+        if not species_id.isdigit():
+            raise ValueError('Invalid species id: %s' % species_id)
+    return species_ids
+
+
+def _compile_remove_species_id(argument):
+    return make_remove_species_id(parse_species_ids(argument))
+
+
+def _compile_add_species_id(argument):
+    species_ids = parse_species_ids(argument)
+    if len(species_ids) != 1:
+        raise ValueError('add_species_id takes exactly one species id')
+    return make_add_species_id(species_ids[0])
+
+
+# Filter name -> function that takes the spec argument (or None) and returns the transform.
+FILTERS = {
+    'remove_species_id': _compile_remove_species_id,
+    'add_species_id': _compile_add_species_id,
+}
+
+
+def memoize(transform, cache_size=DEFAULT_CACHE_SIZE):
+    '''Wraps a filter transform in a bounded memo and returns the memoized function.
+
+    The memo has two generations of at most cache_size ids each. New results go into the
+    current generation; when it is full, it becomes the old generation and the previous old
+    generation is dropped. Ids found in the old generation are moved back to the current one,
+    so recently used ids survive and memory stays bounded by 2 * cache_size entries. The
+    function is a closure rather than an object with __call__, which keeps a cache hit down
+    to one dictionary lookup and one call.
+    '''
+    generations = [{}, {}]
+
+    def miss(name):
+        current, old = generations
+        result = old.get(name)
+        if result is None:
+            result = transform(name)
+        if len(current) >= cache_size:
+            generations[1] = current
+            current = generations[0] = {}
+        current[name] = result
+        return result
+
+    def id_filter(name):
+        result = generations[0].get(name)
+        return result if result is not None else miss(name)
+
+    id_filter.transform = transform
+    return id_filter
+
+
+_compiled = {}
+
+
+def compile_filter(spec, cache_size=DEFAULT_CACHE_SIZE):
+    '''Compiles a filter spec such as remove_species_id:10090 into a memoized function (see
+    memoize). Filters are compiled once per spec and shared, so their memos are reused across
+    tables.
+
+    Input:
+        spec: filter spec, or None.
+        cache_size: size of each generation of the memo of a newly compiled filter.
+    Output:
+        a function from an id to the filtered id, or None if spec is None.
+    '''
+    if spec is None:
+        return None
+    id_filter = _compiled.get(spec)
+    if id_filter is None:
+        name, _, argument = spec.partition(':')
+        if name not in FILTERS:
+            raise ValueError('Unknown id filter: %s (known filters: %s)' % (name, ', '.join(sorted(FILTERS))))
+        id_filter = memoize(FILTERS[name](argument or None), cache_size)
+        id_filter.spec = spec
+        _compiled[spec] = id_filter
+    return id_filter
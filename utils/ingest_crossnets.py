@@ -0,0 +1,220 @@
+'''
+file: ingest_crossnets.py
+
+Script that creates the Mambo crossnet tables for a directory of link files of several types, e.g.
+the GeneMANIA files (one file per interaction type and study) or the STRING channel files.
+
+Files are assigned to types by file name patterns. The files of a type are added, in sorted file
+name order, to the full crossnet table in output_dir/<type_dir>, where <type_dir> is the type
+name in lower case without dashes followed by _links (e.g. coexpression_links). Each file also gets
+its own dataset specific table, with dataset ids 0, 1, 2, ... in the same order. Mambo ids are
+therefore the same on every run, however the work is scheduled.
+
+The mode files are read once, before the worker processes are started, and shared read-only by
+all workers. Types are built concurrently, largest first; the files of one type are built in
+order by a single worker. The script reads them in a mode_cache session (see mode_cache.py); a
+program that ingests several directories with the same mode files (e.g. gene-gene links from
+GeneMANIA and from another source) should call ingest_crossnets within one session, so that the
+mode files are parsed only once:
+
+with mode_cache.session():
+    ingest_crossnets('genemania_data', GENEMANIA_TYPES, gene_file, gene_file, 'gene-gene/genemania')
+    ingest_crossnets('reactome_data', [('Reactome', '*.tsv')], gene_file, gene_file, 'gene-gene/reactome')
+
+Usage:
+python ingest_crossnets.py <input_dir> <src_file> <dst_file>
+
+Positional Arguments:
+input_dir:               Directory containing the link files.
+src_file:                Path to a dataset specific file, as outputted by create_mambo_mode_table.py,
+                         corresponding to the source mode of all link files.
+dst_file:                Path to a dataset specific file, as outputted by create_mambo_mode_table.py,
+                         corresponding to the destination mode of all link files.
+
+Optional arguments:
+--preset                 genemania or string; use the types and file patterns of the GeneMANIA or STRING
+                         data in datasets/cancer_example.
+--type                   A type and its file name pattern, as <type>=<pattern>, e.g. Pathway=Pathway.*.txt.
+                         May be given several times; replaces the types of the preset.
+--dataset_name           Dataset name of every file. Defaults to the part of the file name matched by the
+                         first '*' of its pattern (e.g. Agnelli-Neri-2007 for Co-expression.Agnelli-Neri-2007.txt).
+--output_dir             Directory in which the per type directories are created. Defaults to the current
+                         working directory.
+--src_node_index:        The index of the column with the src node id. Defaults to 0.
+--dst_node_index:        The index of the column with the dst node id. Defaults to 1.
+--src_mode_filter        The filter (see id_filters.py) applied to the source node ids. Defaults to None.
+--dst_mode_filter        The filter (see id_filters.py) applied to the destination node ids. Defaults to None.
+--keep_missing_ids       Flag; Fail on ids that are not in the mode files instead of skipping their lines.
+--num_workers            Number of worker processes. Defaults to the number of CPUs.
+--metrics_file           Append the metrics of every built table to this file as JSON lines.
+
+Example usage:
+Creating the Gene-Gene link tables from GeneMANIA:
+
+python ingest_crossnets.py datasets/cancer_example/gene-gene/genemania_data/ miner-gene-0-ICGC-20160520.tsv miner-gene-0-ICGC-20160520.tsv --preset genemania --output_dir datasets/cancer_example/gene-gene/
+'''
+
+import argparse
+import fnmatch
+import mode_cache
+import multiprocessing
+import os
+import re
+import utils
+from create_mambo_crossnet_table import create_mambo_crossnet_table, BLOCK_SIZE, DELIMITER
+from metrics import BuildMetrics
+
+GENEMANIA_TYPES = [(name, name + '.*.txt') for name in [
+    'Co-expression', 'Co-localization', 'Genetic_interactions', 'Pathway', 'Physical_interactions', 'Predicted']]
+STRING_TYPES = [(name, name + '-*.tsv') for name in [
+    'neighborhood', 'fusion', 'cooccurence', 'coexpression', 'experimental', 'database', 'textmining',
+    'combined_score']]
+# Preset name -> (types, dataset name)
+PRESETS = {
+    'genemania': (GENEMANIA_TYPES, None),
+    'string': (STRING_TYPES, 'STRING'),
+}
+
+
+def get_type_dir(type_name):
+    '''Returns the name of the output directory of a link type, e.g. coexpression_links for
+    Co-expression.'''
+    return type_name.lower().replace('-', '') + '_links'
+
+
+def get_dataset_name(file_name, pattern):
+    '''Returns the part of file_name matched by the first '*' in pattern, or the file name
+    without its extension if there is none.'''
+    parts = pattern.split('*')
+    if len(parts) > 1:
+        regex = re.escape(parts[0]) + '(.*)' + '.*'.join(re.escape(part) for part in parts[1:])
+        match = re.match(regex + '$', file_name)
+        if match and match.group(1):
+            return match.group(1)
+    return os.path.splitext(file_name)[0]
+
+
+def find_type_files(input_dir, type_patterns, dataset_name=None):
+    '''Assigns the files in input_dir to link types. A file matching several patterns is
+    assigned to the first type.
+
+    Input:
+        input_dir: directory containing the link files.
+        type_patterns: list of (type, file name pattern) pairs.
+        dataset_name: dataset name of every file; see get_dataset_name if None.
+    Output:
+        a dictionary from type to a list of (path, dataset id, dataset name) tuples, sorted
+        by file name.
+    '''
+    type_files = dict((type_name, []) for type_name, _ in type_patterns)
+    for file_name in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, file_name)
+        if not os.path.isfile(path):
+            continue
+        for type_name, pattern in type_patterns:
+            if fnmatch.fnmatch(file_name, pattern):
+                files = type_files[type_name]
+                name = dataset_name or get_dataset_name(file_name, pattern)
+                files.append((path, len(files), name))
+                break
+    return type_files
+
+
+# State shared with the worker processes. It is set before the pool is created, so forked
+# workers inherit the mode mappings instead of re-reading them.
+_shared = {}
+
+
+def _ingest_type(task):
+    type_name, files = task
+    output_dir = os.path.join(_shared['output_dir'], get_type_dir(type_name))
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    for path, db_id, dataset_name in files:
+        metrics = BuildMetrics('%s:%s' % (type_name, dataset_name), metrics_file=_shared['metrics_file'])
+        create_mambo_crossnet_table(path, _shared['src_file'], _shared['dst_file'], dataset_name,
+                                    db_id, _shared['src_node_index'], _shared['dst_node_index'], None,
+                                    None, output_dir, None, None, _shared['src_mode_filter'],
+                                    _shared['dst_mode_filter'], -1, _shared['skip_missing_ids'],
+                                    delimiter=_shared['delimiter'], streaming=True,
+                                    block_size=_shared['block_size'], metrics=metrics,
+                                    src_mapping=_shared['src_mapping'], dst_mapping=_shared['dst_mapping'])
+    return type_name
+
+
+def ingest_crossnets(input_dir, type_patterns, src_file, dst_file, output_dir='.', dataset_name=None,
+                     src_node_index=0, dst_node_index=1, src_mode_filter=None, dst_mode_filter=None,
+                     skip_missing_ids=True, num_workers=None, metrics_file=None, delimiter=DELIMITER,
+                     block_size=BLOCK_SIZE):
+    '''Creates the crossnet tables of every link type in input_dir; see the file header.
+
+    Input:
+        type_patterns: list of (type, file name pattern) pairs, e.g. GENEMANIA_TYPES.
+        num_workers: number of worker processes; types are built in this process if it is 1.
+    Output:
+        the dictionary returned by find_type_files.
+    '''
+    type_files = find_type_files(input_dir, type_patterns, dataset_name)
+    src_mapping = utils.read_mode_file(src_file)
+    if os.path.samefile(src_file, dst_file):
+        dst_mapping = src_mapping
+    else:
+        dst_mapping = utils.read_mode_file(dst_file)
+    _shared.update(src_file=src_file, dst_file=dst_file, src_mapping=src_mapping, dst_mapping=dst_mapping,
+                   output_dir=output_dir, src_node_index=src_node_index, dst_node_index=dst_node_index,
+                   src_mode_filter=src_mode_filter, dst_mode_filter=dst_mode_filter,
+                   skip_missing_ids=skip_missing_ids, metrics_file=metrics_file, delimiter=delimiter,
+                   block_size=block_size)
+    # Largest types first, so that a big type does not start last and hold up the pool.
+    tasks = [(type_name, files) for type_name, files in type_files.items() if files]
+    tasks.sort(key=lambda task: -sum(os.path.getsize(path) for path, _, _ in task[1]))
+    num_workers = min(num_workers or multiprocessing.cpu_count(), max(len(tasks), 1))
+    try:
+        if num_workers == 1:
+            for task in tasks:
+                _ingest_type(task)
+        else:
+            pool = multiprocessing.Pool(num_workers)
+            try:
+                for _ in pool.imap_unordered(_ingest_type, tasks):
+                    pass
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        _shared.clear()
+    return type_files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create mambo crossnet tables for a directory of link files')
+    parser.add_argument('input_dir', help='directory containing the link files')
+    parser.add_argument('src_file', help='input file name. Should be a file outputted by create_mambo_mode_table (with properly formatted name).')
+    parser.add_argument('dst_file', help='input file name. Should be a file outputted by create_mambo_mode_table (with properly formatted name).')
+    parser.add_argument('--preset', choices=sorted(PRESETS.keys()), default=None)
+    parser.add_argument('--type', action='append', help='<type>=<file name pattern>; may be repeated', default=None)
+    parser.add_argument('--dataset_name', type=str, default=None)
+    parser.add_argument('--output_dir', help='directory in which the per type directories are created', default='.')
+    parser.add_argument('--src_node_index', type=int, default=0)
+    parser.add_argument('--dst_node_index', type=int, default=1)
+    parser.add_argument('--src_mode_filter', type=str, help='id filter spec, e.g. remove_species_id:10090', default=None)
+    parser.add_argument('--dst_mode_filter', type=str, help='id filter spec, e.g. remove_species_id:10090', default=None)
+    parser.add_argument('--keep_missing_ids', action='store_true', help='fail on ids not found in the mode files')
+    parser.add_argument('--num_workers', type=int, default=None)
+    parser.add_argument('--metrics_file', help='file to append the build metrics to as JSON lines', default=None)
+    args = parser.parse_args()
+
+    type_patterns = []
+    dataset_name = args.dataset_name
+    if args.preset is not None:
+        type_patterns, preset_dataset_name = PRESETS[args.preset]
+        dataset_name = dataset_name or preset_dataset_name
+    if args.type:
+        type_patterns = [tuple(type_pattern.split('=', 1)) for type_pattern in args.type]
+    if not type_patterns:
+        parser.error('either --preset or --type must be given')
+
+    with mode_cache.session():
+        ingest_crossnets(args.input_dir, type_patterns, args.src_file, args.dst_file, args.output_dir,
+                         dataset_name, args.src_node_index, args.dst_node_index, args.src_mode_filter,
+                         args.dst_mode_filter, not args.keep_missing_ids, args.num_workers, args.metrics_file)
@@ -0,0 +1,456 @@
+'''
+file: lookup_service.py
+
+Long-running local service that answers batched id lookups over built Mambo tables, so that
+clients resolving a few thousand ids do not have to load the tables themselves. Requires NumPy and
+Python 3.7 or later (asyncio), unlike the table builders, which run under Python 2: it is a
+separate runtime that only reads the tables they write. The modules it imports (columnar_table,
+compression, csr_adjacency, metapath and utils) are kept Python 2 and 3 compatible, and its tests
+(test_lookup_service.py) are run with python3.
+
+The service keeps, per dataset specific mode table (miner-<mode>-<db_id>-<dataset>-<date>.tsv), the
+mapping read by utils.read_mode_file and the memory-mapped columnar version of the table (see
+columnar_table.py, created next to the table if missing), and, per crossnet of the network
+catalog, the memory-mapped CSR index built by metapath.MetapathEngine (see csr_adjacency.py).
+The tables and indexes are loaded, and built if needed, before the service starts listening, so
+that requests never wait on a build. Requests are read and answered on the asyncio event loop,
+but looked up in a pool of worker threads, so a large lookup does not hold up the other clients.
+Responses are kept in an LRU cache, and the latency and throughput of the requests are reported
+by /stats.
+
+Requests are HTTP, over TCP or a Unix socket. All endpoints except the GET ones take a JSON body
+and return JSON:
+
+POST /mambo_ids          {"mode": m, "dataset": d, "ids": [...]} -> {"mambo_ids": [...]}; the mambo id of
+                         every dataset specific id, as in utils.read_mode_file, or null if it is unknown.
+POST /dataset_ids        {"mode": m, "dataset": d, "mambo_ids": [...]} -> {"dataset_ids": [...]}
+POST /attributes         {"mode": m, "dataset": d, "mambo_ids": [...]} -> {"columns": [...],
+                         "attributes": [...]}; the attribute columns of the mode table and, per mambo id,
+                         the list of its attribute values, or null.
+POST /neighbors          {"crossnet": c, "direction": "out" or "in", "mambo_ids": [...]} -> {"neighbors":
+                         [...], "edge_ids": [...]}; per mambo id, the list of its neighbors in the crossnet
+                         (destination nodes for out, source nodes for in) and the mambo edge ids.
+GET /tables              The modes, datasets and crossnets that can be queried.
+GET /stats               Per endpoint request counts, latency percentiles, throughput and cache counters.
+
+Malformed requests get a 400 response and failures while answering them (e.g. a table file that
+was removed) a 500 response, with the error in the JSON body.
+
+Usage:
+python3 lookup_service.py <catalog_file> <index_dir>
+
+Positional Arguments:
+catalog_file:            Path to a network catalog, as written by network_catalog.py or
+                         network_utils.build_network_incremental.
+index_dir:               Directory in which the crossnet indexes are kept.
+
+Optional arguments:
+--mode_dir               Directory containing dataset specific mode tables. May be given several times.
+                         Defaults to the directories of the full mode tables in the catalog.
+--host                   Host to listen on. Defaults to 127.0.0.1.
+--port                   Port to listen on. Defaults to 8475.
+--unix_socket            Listen on this Unix socket instead of a TCP port.
+--cache_entries          Number of responses kept in the LRU cache. Defaults to 4096.
+--num_workers            Number of worker threads answering requests. Defaults to the thread pool default.
+
+Example usage:
+python3 lookup_service.py miner.graph.catalog indexes --port 8475
+curl -d '{"mode": "gene", "dataset": "ICGC", "ids": ["ENSG00000183117"]}' localhost:8475/mambo_ids
+'''
+
+import argparse
+import asyncio
+import collections
+import columnar_table
+import compression
+import json
+import metapath
+import os
+import re
+import threading
+import time
+import utils
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_PORT = 8475
+CACHE_ENTRIES = 4096
+# Number of most recent requests per endpoint the latency percentiles are computed over.
+LATENCY_WINDOW = 10000
+MAX_BODY_SIZE = 1 << 26
+MODE_FILE_PATTERN = re.compile(r'^miner-[^-]+-\d+-[^-]+-[^-]+\.tsv')
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large',
+               500: 'Internal Server Error'}
+
+
+def find_mode_tables(directory):
+    '''Returns the paths of the dataset specific mode tables in a directory, as named by
+    utils.get_mode_file_name.'''
+    return [os.path.join(directory, file_name) for file_name in sorted(os.listdir(directory))
+            if MODE_FILE_PATTERN.match(file_name) and compression.strip_compression_suffix(file_name).endswith('.tsv')]
+
+
+def read_mode_columns(mode_file):
+    '''Returns the column names in the header of a dataset specific mode table.'''
+    columns = []
+    with compression.open_file(mode_file) as inF:
+        for line in inF:
+            if line[0] != '#':
+                break
+            if line[1:].strip().startswith('mambo_nid'):
+                columns = line[1:].strip().split('\t')
+    return columns
+
+
+class ModeTableIndex(object):
+    '''Lookups in a dataset specific mode table.'''
+
+    def __init__(self, mode_file):
+        self.path = mode_file
+        self.mapping = utils.read_mode_file(mode_file)
+        self.columns = read_mode_columns(mode_file)[2:]
+        cols_dir = columnar_table.get_columnar_dir_name(mode_file)
+        schema_file = os.path.join(cols_dir, columnar_table.SCHEMA_FILE)
+        if not os.path.isfile(schema_file) or os.path.getmtime(schema_file) < os.path.getmtime(mode_file):
+            columnar_table.write_columnar_table(mode_file, columnar_table.MODE_SCHEMA, cols_dir)
+        self.table = columnar_table.load_columnar_table(cols_dir)
+        mambo_nids = self.table['mambo_nid']
+        if np.all(mambo_nids[1:] > mambo_nids[:-1]):
+            self.order = None
+            self.sorted_nids = mambo_nids
+        else:
+            self.order = np.argsort(mambo_nids, kind='mergesort')
+            self.sorted_nids = mambo_nids[self.order]
+
+    def get_mambo_ids(self, ids):
+        return [self.mapping.get(str(dataset_id).strip()) for dataset_id in ids]
+
+    def get_rows(self, mambo_ids):
+        '''Returns the row of every mambo id in the table, or -1.'''
+        mambo_ids = np.asarray(mambo_ids, dtype=np.int64)
+        if len(self.sorted_nids) == 0:
+            return np.full(len(mambo_ids), -1, dtype=np.int64)
+        positions = np.searchsorted(self.sorted_nids, mambo_ids)
+        found = positions < len(self.sorted_nids)
+        found[found] = self.sorted_nids[positions[found]] == mambo_ids[found]
+        rows = positions if self.order is None else self.order[np.minimum(positions, len(self.order) - 1)]
+        return np.where(found, rows, -1)
+
+    def get_dataset_ids(self, mambo_ids):
+        column = self.table['dataset_nid']
+        return [column[row] if row >= 0 else None for row in self.get_rows(mambo_ids).tolist()]
+
+    def get_attributes(self, mambo_ids):
+        column = self.table['attrs']
+        attributes = []
+        for row in self.get_rows(mambo_ids).tolist():
+            if row < 0:
+                attributes.append(None)
+            elif not self.columns:
+                attributes.append([])
+            else:
+                attributes.append(column[row].split('\t'))
+        return attributes
+
+
+class LookupIndex(object):
+    '''The tables a lookup service answers from.
+
+    Input:
+        catalog: a network catalog, see network_utils.build_catalog.
+        index_dir: directory in which the crossnet indexes are kept.
+        mode_files: paths of dataset specific mode tables.
+    '''
+
+    def __init__(self, catalog, index_dir, mode_files):
+        self.catalog = catalog
+        # Serializes the loading of mode tables and indexes by the worker threads.
+        self.lock = threading.Lock()
+        self.engine = metapath.MetapathEngine(catalog, index_dir)
+        self.mode_files = {}
+        for mode_file in mode_files:
+            file_name = os.path.basename(mode_file)
+            key = (utils.parse_mode_name_from_name(file_name), utils.parse_dataset_name_from_name(file_name))
+            self.mode_files[key] = mode_file
+        self.mode_tables = {}
+
+    def get_mode_table(self, mode, dataset):
+        key = (mode, dataset)
+        if key not in self.mode_files:
+            raise ValueError('Unknown mode table: %s %s' % key)
+        with self.lock:
+            if key not in self.mode_tables:
+                self.mode_tables[key] = ModeTableIndex(self.mode_files[key])
+            return self.mode_tables[key]
+
+    def load(self):
+        '''Loads every mode table and crossnet index, building the missing or outdated ones.
+        Raises a ValueError if a full mode table of the catalog has a pending delta log (see
+        utils.check_no_delta_log), since the catalog and the indexes would miss its nodes.'''
+        for entry in self.catalog['modes'].values():
+            if 'path' in entry:
+                utils.check_no_delta_log(entry['path'])
+        for mode, dataset in sorted(self.mode_files):
+            self.get_mode_table(mode, dataset)
+        for crossnet in sorted(self.catalog['crossnets']):
+            self.engine.get_index(crossnet)
+
+    def get_neighbors(self, crossnet, mambo_ids, direction='out'):
+        if crossnet not in self.catalog['crossnets']:
+            raise ValueError('Unknown crossnet: %s' % crossnet)
+        if direction not in ('out', 'in'):
+            raise ValueError('Unknown direction: %s' % direction)
+        with self.lock:
+            index = self.engine.get_index(crossnet)
+        offsets = getattr(index, direction + '_offsets')
+        neighbors = getattr(index, direction + '_neighbors')
+        eids = getattr(index, direction + '_eids')
+        all_neighbors, all_eids = [], []
+        for mambo_id in mambo_ids:
+            mambo_id = int(mambo_id)
+            if 0 <= mambo_id < len(offsets) - 1:
+                start, end = offsets[mambo_id], offsets[mambo_id + 1]
+                all_neighbors.append(neighbors[start:end].tolist())
+                all_eids.append(eids[start:end].tolist())
+            else:
+                all_neighbors.append([])
+                all_eids.append([])
+        return all_neighbors, all_eids
+
+    def get_tables(self):
+        modes = collections.defaultdict(list)
+        for mode, dataset in sorted(self.mode_files):
+            modes[mode].append(dataset)
+        return {'modes': dict(modes), 'crossnets': dict((name, {'src': entry['src'], 'dst': entry['dst']})
+                                                         for name, entry in self.catalog['crossnets'].items())}
+
+
+class ResponseCache(object):
+    '''LRU cache of encoded responses.'''
+
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        response = self.entries.pop(key, None)
+        if response is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries[key] = response
+        return response
+
+    def put(self, key, response):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = response
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return {'entries': len(self.entries), 'max_entries': self.max_entries, 'hits': self.hits,
+                'misses': self.misses}
+
+
+class RequestStats(object):
+    '''Request counts and latencies per endpoint.'''
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.counts = collections.Counter()
+        self.ids = collections.Counter()
+        self.errors = collections.Counter()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+
+    def record(self, endpoint, seconds, num_ids, error=False):
+        self.counts[endpoint] += 1
+        self.ids[endpoint] += num_ids
+        if error:
+            self.errors[endpoint] += 1
+        self.latencies[endpoint].append(seconds)
+
+    def stats(self):
+        uptime = time.time() - self.start_time
+        endpoints = {}
+        for endpoint, count in self.counts.items():
+            latencies = np.array(self.latencies[endpoint]) * 1000
+            endpoints[endpoint] = {
+                'requests': count, 'ids': self.ids[endpoint], 'errors': self.errors[endpoint],
+                'requests_per_second': count / uptime,
+                'latency_ms': dict(('p%d' % p, float(np.percentile(latencies, p))) for p in (50, 90, 99))}
+        return {'uptime': uptime, 'requests': sum(self.counts.values()),
+                'requests_per_second': sum(self.counts.values()) / uptime, 'endpoints': endpoints}
+
+
+def encode_error(error):
+    return json.dumps({'error': '%s: %s' % (type(error).__name__, error)}).encode('utf-8')
+
+
+class LookupService(object):
+    '''Answers requests; see the file header. handle can be called directly, without a server,
+    and from several threads at once.
+
+    Input:
+        index: a LookupIndex.
+        cache_entries: number of responses kept in the LRU cache.
+        num_workers: number of worker threads answering the requests of handle_connection.
+    '''
+
+    def __init__(self, index, cache_entries=CACHE_ENTRIES, num_workers=None):
+        self.index = index
+        self.cache = ResponseCache(cache_entries)
+        self.request_stats = RequestStats()
+        # Guards the cache and the request stats, which are shared by the worker threads.
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(num_workers)
+        self.handlers = {
+            '/mambo_ids': self.mambo_ids,
+            '/dataset_ids': self.dataset_ids,
+            '/attributes': self.attributes,
+            '/neighbors': self.neighbors,
+        }
+
+    def mambo_ids(self, request):
+        table = self.index.get_mode_table(request['mode'], request['dataset'])
+        return {'mambo_ids': table.get_mambo_ids(request['ids'])}
+
+    def dataset_ids(self, request):
+        table = self.index.get_mode_table(request['mode'], request['dataset'])
+        return {'dataset_ids': table.get_dataset_ids(request['mambo_ids'])}
+
+    def attributes(self, request):
+        table = self.index.get_mode_table(request['mode'], request['dataset'])
+        return {'columns': table.columns, 'attributes': table.get_attributes(request['mambo_ids'])}
+
+    def neighbors(self, request):
+        neighbors, edge_ids = self.index.get_neighbors(request['crossnet'], request['mambo_ids'],
+                                                       request.get('direction', 'out'))
+        return {'neighbors': neighbors, 'edge_ids': edge_ids}
+
+    def handle(self, method, path, body=b''):
+        '''Answers a request.
+
+        Input:
+            method: 'GET' or 'POST'.
+            path: the endpoint, e.g. '/mambo_ids'.
+            body: the JSON request body, as bytes.
+        Output:
+            a tuple (status, encoded JSON response).
+        '''
+        start = time.time()
+        if method == 'GET' and path == '/stats':
+            with self.lock:
+                stats = self.request_stats.stats()
+                stats['cache'] = self.cache.stats()
+            return 200, json.dumps(stats, sort_keys=True).encode('utf-8')
+        if method == 'GET' and path == '/tables':
+            return 200, json.dumps(self.index.get_tables(), sort_keys=True).encode('utf-8')
+        handler = self.handlers.get(path)
+        if method != 'POST' or handler is None:
+            return 404, json.dumps({'error': 'Unknown endpoint: %s %s' % (method, path)}).encode('utf-8')
+        num_ids = 0
+        try:
+            request = json.loads(body.decode('utf-8'))
+            num_ids = len(request.get('ids', request.get('mambo_ids', [])))
+            key = (path, json.dumps(request, sort_keys=True))
+            with self.lock:
+                response = self.cache.get(key)
+            if response is None:
+                response = json.dumps(handler(request)).encode('utf-8')
+                with self.lock:
+                    self.cache.put(key, response)
+            status = 200
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            status, response = 400, encode_error(e)
+        except Exception as e:
+            status, response = 500, encode_error(e)
+        with self.lock:
+            self.request_stats.record(path, time.time() - start, num_ids, status != 200)
+        return status, response
+
+    async def handle_connection(self, reader, writer):
+        '''Serves the HTTP requests of a connection, which may be kept alive. The requests are
+        answered by handle in the worker threads, so the event loop keeps serving the other
+        connections meanwhile.'''
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    break
+                method, path = parts[0], parts[1].split('?')[0]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = headers.get('content-length', '0')
+                if not length.isdigit():
+                    status, response = 400, b'{"error": "Invalid Content-Length"}'
+                    keep_alive = False
+                elif int(length) > MAX_BODY_SIZE:
+                    status, response = 413, b'{"error": "Request too large"}'
+                    keep_alive = False
+                else:
+                    length = int(length)
+                    body = await reader.readexactly(length) if length else b''
+                    status, response = await loop.run_in_executor(self.executor, self.handle, method, path, body)
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                              'Connection: %s\r\n\r\n' % (status, STATUS_TEXT[status], len(response),
+                                                          'keep-alive' if keep_alive else 'close')).encode('latin-1'))
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        except Exception as e:
+            response = encode_error(e)
+            writer.write(('HTTP/1.1 500 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                          'Connection: close\r\n\r\n' % (STATUS_TEXT[500], len(response))).encode('latin-1'))
+            writer.write(response)
+        finally:
+            writer.close()
+
+
+async def serve(service, host='127.0.0.1', port=DEFAULT_PORT, unix_socket=None):
+    '''Serves requests until cancelled.'''
+    if unix_socket is not None:
+        server = await asyncio.start_unix_server(service.handle_connection, path=unix_socket)
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve id and neighbor lookups over built Mambo tables')
+    parser.add_argument('catalog_file', help='network catalog, as written by network_catalog.py or build_network_incremental')
+    parser.add_argument('index_dir', help='directory of the crossnet indexes')
+    parser.add_argument('--mode_dir', action='append', help='directory of dataset specific mode tables; may be repeated', default=None)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix_socket', default=None)
+    parser.add_argument('--cache_entries', type=int, default=CACHE_ENTRIES)
+    parser.add_argument('--num_workers', type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.catalog_file, 'r') as inF:
+        catalog = json.load(inF)
+    mode_dirs = args.mode_dir or sorted(set(os.path.dirname(os.path.abspath(entry['path']))
+                                            for entry in catalog['modes'].values()))
+    mode_files = [mode_file for mode_dir in mode_dirs for mode_file in find_mode_tables(mode_dir)]
+    index = LookupIndex(catalog, args.index_dir, mode_files)
+    index.load()
+    service = LookupService(index, args.cache_entries, args.num_workers)
+    asyncio.run(serve(service, args.host, args.port, args.unix_socket))
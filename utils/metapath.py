@@ -0,0 +1,411 @@
+'''
+file: metapath.py
+
+Metapath queries over the Mambo crossnet tables, e.g. disease -> protein -> function: for a batch
+of seed nodes of the first mode, the nodes of the last mode reachable along the metapath and the
+number of paths that reach each of them.
+
+Every crossnet is indexed by a CSR export (see csr_adjacency.py), which groups its edges by source
+and by destination node, so a crossnet can be followed in either direction. The indexes are built
+in index_dir on first use and rebuilt when the crossnet table has grown. A query expands the
+frontier of all seeds at once with array operations, one crossnet at a time; large seed batches
+are split across worker processes.
+
+A metapath that is queried often can be materialized with MetapathEngine.materialize: the path
+counts from every node of the first mode are computed once and stored as a CSR export in
+index_dir, and later queries of the metapath read them directly. This visits every node of the
+first mode, so it is only done when asked for: MetapathEngine.materialize_frequent materializes
+the metapaths queried most often so far.
+
+The results of the last queries are kept in memory, by metapath and seeds, so a repeated query is
+answered without following any crossnet, as long as its crossnets are unchanged.
+
+An index or materialized metapath is current as long as the stamps of its crossnets (see
+csr_adjacency.get_crossnet_stamp) are unchanged: the size and last bytes of each crossnet table
+and the number of nodes of its modes in the catalog.
+
+Usage:
+python metapath.py <catalog_file> <index_dir> <modes> <seeds_file>
+
+Positional Arguments:
+catalog_file:            Path to a network catalog, as written by network_catalog.py or
+                         network_utils.build_network_incremental.
+index_dir:               Directory in which the crossnet indexes and materialized metapaths are kept.
+modes:                   The modes of the metapath, separated by commas, e.g. disease,protein,function.
+seeds_file:              File containing the mambo node ids of the seeds, one per line.
+
+Optional arguments:
+--crossnet               The crossnet used for each step, when several crossnets connect the same two
+                         modes. Given once per step, in order.
+--num_workers            Number of worker processes. Defaults to the number of CPUs.
+--output_file            File to which the results are written, as seed, node and path count, tab
+                         separated. Defaults to standard output.
+
+Example usage:
+python metapath.py miner.graph.catalog indexes disease,protein,function disease_seeds.txt
+'''
+
+import argparse
+import csr_adjacency
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Seed batches smaller than this are not split across processes.
+PARALLEL_MIN_SEEDS = 1 << 12
+# Number of seeds expanded at a time when materializing a metapath.
+MATERIALIZE_BATCH_SIZE = 1 << 14
+# Number of query results kept in memory by a MetapathEngine.
+RESULT_CACHE_SIZE = 64
+
+
+def resolve_metapath(catalog, modes, crossnets=None):
+    '''Returns the steps of a metapath, as a tuple of (crossnet name, direction) pairs. The
+    direction is 'out' if the crossnet is followed from its source mode to its destination
+    mode, and 'in' otherwise. Crossnets within a single mode (e.g. gene-gene interactions) are
+    loaded undirected, so they are followed in 'both' directions.
+
+    Input:
+        catalog: a network catalog, see network_utils.build_catalog.
+        modes: the list of modes along the metapath.
+        crossnets: the crossnet of each step, or None to find the crossnet connecting each pair
+                   of modes. A step connecting two modes with several crossnets must be given.
+    '''
+    if len(modes) < 2:
+        raise ValueError('A metapath needs at least two modes')
+    if crossnets is not None and len(crossnets) != len(modes) - 1:
+        raise ValueError('Expected %d crossnets, got %d' % (len(modes) - 1, len(crossnets)))
+    steps = []
+    for i in range(len(modes) - 1):
+        src, dst = modes[i], modes[i + 1]
+        candidates = []
+        for name, entry in sorted(catalog['crossnets'].items()):
+            if crossnets is not None and name != crossnets[i]:
+                continue
+            if entry['src'] == entry['dst'] == src == dst:
+                candidates.append((name, 'both'))
+            elif (entry['src'], entry['dst']) == (src, dst):
+                candidates.append((name, 'out'))
+            elif (entry['src'], entry['dst']) == (dst, src):
+                candidates.append((name, 'in'))
+        if len(candidates) != 1:
+            raise ValueError('%s crossnets connect %s and %s: %s' % (
+                'No' if not candidates else 'Several', src, dst, ', '.join(name for name, _ in candidates)))
+        steps.append(candidates[0])
+    return tuple(steps)
+
+
+def expand(seed_indices, nodes, counts, offsets, neighbors, weights=None, skip_loops=False):
+    '''Follows one step from a frontier.
+
+    Input:
+        seed_indices, nodes, counts: arrays describing the frontier; for every entry, the index of
+            a seed, a node reached from it and the number of paths reaching the node.
+        offsets, neighbors: the CSR arrays of the step.
+        weights: the number of paths represented by every edge, or None for one path per edge.
+        skip_loops: if True, edges from a node to itself are not followed.
+    Output:
+        the new frontier, as a tuple (seed_indices, nodes, counts), sorted by seed index and node.
+    '''
+    in_range = nodes < len(offsets) - 1
+    if not in_range.all():
+        seed_indices, nodes, counts = seed_indices[in_range], nodes[in_range], counts[in_range]
+    starts = offsets[nodes].astype(np.int64)
+    degrees = offsets[nodes + 1] - starts
+    entries = np.repeat(np.arange(len(nodes)), degrees)
+    # Position of every edge of the frontier in neighbors: the start of the edges of its node
+    # plus its rank among them.
+    ranks = np.arange(len(entries)) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+    positions = starts[entries] + ranks
+    if skip_loops:
+        is_loop = neighbors[positions] == nodes[entries]
+        entries, positions = entries[~is_loop], positions[~is_loop]
+    new_counts = counts[entries]
+    if weights is not None:
+        new_counts = new_counts * weights[positions]
+    return aggregate(seed_indices[entries], neighbors[positions].astype(np.int64), new_counts)
+
+
+def aggregate(seed_indices, nodes, counts):
+    '''Sums the counts of the entries with the same seed index and node, and sorts the entries.'''
+    order = np.lexsort((nodes, seed_indices))
+    seed_indices, nodes, counts = seed_indices[order], nodes[order], counts[order]
+    if len(order) == 0:
+        return seed_indices, nodes, counts
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (seed_indices[1:] != seed_indices[:-1]) | (nodes[1:] != nodes[:-1])
+    starts = np.flatnonzero(first)
+    return seed_indices[starts], nodes[starts], np.add.reduceat(counts, starts)
+
+
+class MetapathResult(object):
+    '''The result of a metapath query: for every seed, the nodes reached and their path counts.
+    The arrays seed_indices, nodes and counts hold one entry per (seed, node) pair, sorted by
+    seed index (the position of the seed in seeds) and node. Results are cached by the engine
+    and shared by repeated queries, so the arrays are read-only.'''
+
+    def __init__(self, seeds, seed_indices, nodes, counts):
+        self.seeds = seeds
+        self.seed_indices = seed_indices
+        self.nodes = nodes
+        self.counts = counts
+        self.bounds = np.searchsorted(seed_indices, np.arange(len(seeds) + 1))
+        for array in (seeds, seed_indices, nodes, counts, self.bounds):
+            array.flags.writeable = False
+
+    def neighbors(self, i):
+        '''Returns the nodes reached from the i-th seed.'''
+        return self.nodes[self.bounds[i]:self.bounds[i + 1]]
+
+    def path_counts(self, i):
+        '''Returns the numbers of paths from the i-th seed to the nodes in neighbors(i).'''
+        return self.counts[self.bounds[i]:self.bounds[i + 1]]
+
+    def as_dict(self):
+        '''Returns a dictionary from seed to a dictionary from node to path count.'''
+        return dict((int(seed), dict(zip(self.neighbors(i).tolist(), self.path_counts(i).tolist())))
+                    for i, seed in enumerate(self.seeds))
+
+
+# State shared with the worker processes. It is set before the pool is created, so forked
+# workers inherit the engine and its memory-mapped indexes.
+_shared = {}
+
+
+def _query_chunk(bounds):
+    start, end = bounds
+    seed_indices, nodes, counts = _shared['engine'].expand_seeds(_shared['steps'], _shared['seeds'][start:end])
+    return seed_indices + start, nodes, counts
+
+
+class MetapathEngine(object):
+    '''Answers metapath queries over the crossnets of a network catalog.
+
+    Example usage:
+
+    engine = MetapathEngine(network_utils.read_catalog('miner.graph.catalog'), 'indexes')
+    result = engine.query(['chemical', 'protein', 'gene'], seeds)
+    for i, seed in enumerate(seeds):
+        print(seed, result.neighbors(i), result.path_counts(i))
+    # Later, e.g. between batches of queries:
+    engine.materialize_frequent(2)
+
+    Input:
+        catalog: a network catalog, see network_utils.build_catalog.
+        index_dir: directory in which the crossnet indexes and materialized metapaths are kept.
+        num_workers: number of worker processes for large seed batches. Defaults to the number
+                     of CPUs.
+        result_cache_size: number of query results kept in memory. 0 disables the cache.
+    '''
+
+    def __init__(self, catalog, index_dir, num_workers=None, result_cache_size=RESULT_CACHE_SIZE):
+        if np is None:
+            raise ImportError('numpy is required for metapath queries')
+        self.catalog = catalog
+        self.index_dir = index_dir
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.indexes = {}
+        # The crossnet stamps of the loaded crossnet indexes.
+        self.index_stamps = {}
+        # Number of queries of every metapath, by steps, see frequent_metapaths.
+        self.query_counts = {}
+        # The least recently used results first, by (steps, seeds), with the stamps of their
+        # crossnets.
+        self.results = OrderedDict()
+        self.result_cache_size = result_cache_size
+
+    def get_index(self, name):
+        '''Returns the CSR export of a crossnet, building it if it is missing or out of date.'''
+        index = self.indexes.get(name)
+        if index is None:
+            path = csr_adjacency.get_csr_dir_name(self.index_dir, name)
+            if not self.is_current(path, [name]):
+                csr_adjacency.export_crossnet_csr(self.catalog, name, self.index_dir)
+            index = self.indexes[name] = csr_adjacency.load_csr(path)
+            self.index_stamps[name] = csr_adjacency.get_crossnet_stamp(self.catalog, name)
+        return index
+
+    def is_current(self, path, crossnets):
+        '''Whether the export at path was built from the current versions of the crossnets.'''
+        schema_file = os.path.join(path, csr_adjacency.SCHEMA_FILE)
+        if not os.path.isfile(schema_file):
+            return False
+        with open(schema_file, 'r') as inF:
+            schema = json.load(inF)
+        return schema.get('crossnet_stamps') == csr_adjacency.get_crossnet_stamps(self.catalog, crossnets)
+
+    def get_materialized_dir_name(self, steps):
+        key = hashlib.sha1(json.dumps(steps).encode('utf-8')).hexdigest()[:16]
+        return csr_adjacency.get_csr_dir_name(self.index_dir, 'metapath-' + key)
+
+    def expand_seeds(self, steps, seeds):
+        '''Follows the steps of a metapath from seeds; returns the final frontier as in expand.'''
+        seed_indices = np.arange(len(seeds), dtype=np.int64)
+        nodes = np.asarray(seeds, dtype=np.int64)
+        counts = np.ones(len(seeds), dtype=np.int64)
+        for name, direction in steps:
+            index = self.get_index(name)
+            if direction != 'both':
+                seed_indices, nodes, counts = expand(seed_indices, nodes, counts,
+                                                     getattr(index, direction + '_offsets'),
+                                                     getattr(index, direction + '_neighbors'))
+                continue
+            # An undirected edge is stored once, as src -> dst, so both directions are followed;
+            # self loops are in both and are only followed once.
+            out = expand(seed_indices, nodes, counts, index.out_offsets, index.out_neighbors)
+            inward = expand(seed_indices, nodes, counts, index.in_offsets, index.in_neighbors, skip_loops=True)
+            seed_indices, nodes, counts = aggregate(*[np.concatenate(column) for column in zip(out, inward)])
+        return seed_indices, nodes, counts
+
+    def query(self, modes, seeds, crossnets=None):
+        '''Returns the nodes of the last mode reachable from each seed along a metapath, with the
+        number of paths reaching them.
+
+        Input:
+            modes, crossnets: the metapath, as in resolve_metapath.
+            seeds: sequence of mambo node ids of the first mode.
+        Output:
+            a MetapathResult.
+        '''
+        steps = resolve_metapath(self.catalog, modes, crossnets)
+        seeds = np.array(seeds, dtype=np.int64)
+        self.query_counts[steps] = self.query_counts.get(steps, 0) + 1
+        key = (steps, seeds.tobytes())
+        stamps = csr_adjacency.get_crossnet_stamps(self.catalog, sorted(set(name for name, _ in steps)))
+        cached = self.results.pop(key, None)
+        if cached is not None and cached[0] == stamps:
+            self.results[key] = cached
+            return cached[1]
+        for name, stamp in stamps.items():
+            if name in self.indexes and self.index_stamps[name] != stamp:
+                del self.indexes[name]
+        path = self.get_materialized_dir_name(steps)
+        if self.is_materialized(path, steps):
+            index = self.indexes.get(path)
+            if index is None:
+                index = self.indexes[path] = csr_adjacency.load_csr(path)
+            result = MetapathResult(seeds, *expand(np.arange(len(seeds), dtype=np.int64), seeds,
+                                                   np.ones(len(seeds), dtype=np.int64), index.out_offsets,
+                                                   index.out_neighbors, index.out_counts))
+        else:
+            result = MetapathResult(seeds, *self.expand_all(steps, seeds))
+        if self.result_cache_size > 0:
+            self.results[key] = (stamps, result)
+            while len(self.results) > self.result_cache_size:
+                self.results.popitem(last=False)
+        return result
+
+    def expand_all(self, steps, seeds):
+        '''expand_seeds, with large batches split across worker processes.'''
+        num_chunks = min(self.num_workers, len(seeds) // PARALLEL_MIN_SEEDS)
+        if num_chunks <= 1:
+            return self.expand_seeds(steps, seeds)
+        # Build the indexes before forking, so that the workers share them.
+        for name, _ in steps:
+            self.get_index(name)
+        chunk_bounds = np.linspace(0, len(seeds), num_chunks + 1).astype(int)
+        _shared.update(engine=self, steps=steps, seeds=seeds)
+        try:
+            pool = multiprocessing.Pool(num_chunks)
+            try:
+                chunks = pool.map(_query_chunk, list(zip(chunk_bounds[:-1], chunk_bounds[1:])))
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _shared.clear()
+        return tuple(np.concatenate([chunk[i] for chunk in chunks]) for i in range(3))
+
+    def is_materialized(self, path, steps):
+        return self.is_current(path, sorted(set(name for name, _ in steps)))
+
+    def materialize(self, steps):
+        '''Computes the path counts of a metapath from every node of its first mode and stores
+        them in index_dir, unless they are already stored and current. Later queries of the
+        metapath read them instead of following its crossnets.
+
+        Input:
+            steps: the metapath, as returned by resolve_metapath.
+        Output:
+            the path of the materialized metapath.
+        '''
+        path = self.get_materialized_dir_name(steps)
+        crossnets = sorted(set(name for name, _ in steps))
+        if self.is_materialized(path, steps):
+            return path
+        stamps = csr_adjacency.get_crossnet_stamps(self.catalog, crossnets)
+        self.indexes.pop(path, None)
+        name, direction = steps[0]
+        entry = self.catalog['crossnets'][name]
+        first_mode = entry['src'] if direction == 'out' else entry['dst']
+        num_nodes = csr_adjacency.get_num_nodes(self.catalog, first_mode)
+        sources, targets, counts = [], [], []
+        for start in range(0, num_nodes, MATERIALIZE_BATCH_SIZE):
+            seeds = np.arange(start, min(start + MATERIALIZE_BATCH_SIZE, num_nodes), dtype=np.int64)
+            seed_indices, nodes, path_counts = self.expand_all(steps, seeds)
+            sources.append(seeds[seed_indices])
+            targets.append(nodes)
+            counts.append(path_counts)
+        empty = np.zeros(0, dtype=np.int64)
+        sources = np.concatenate(sources or [empty])
+        targets = np.concatenate(targets or [empty])
+        name, direction = steps[-1]
+        entry = self.catalog['crossnets'][name]
+        last_mode = entry['dst'] if direction == 'out' else entry['src']
+        # The path counts take the place of the edge ids.
+        csr_adjacency.write_csr(path, sources, targets, np.concatenate(counts or [empty]), num_nodes,
+                                csr_adjacency.get_num_nodes(self.catalog, last_mode),
+                                metadata={'metapath': steps, 'crossnet_stamps': stamps})
+        for direction in csr_adjacency.DIRECTIONS:
+            os.rename(os.path.join(path, direction + '_eids.npy'), os.path.join(path, direction + '_counts.npy'))
+        return path
+
+    def frequent_metapaths(self, n, min_queries=2):
+        '''Returns the steps of the n metapaths queried most often, and at least min_queries times,
+        by this engine, most queried first.'''
+        ranked = sorted(((count, steps) for steps, count in self.query_counts.items() if count >= min_queries),
+                        key=lambda item: (-item[0], item[1]))
+        return [steps for _, steps in ranked[:n]]
+
+    def materialize_frequent(self, n, min_queries=2):
+        '''Materializes the metapaths returned by frequent_metapaths(n, min_queries), so that at
+        most n metapaths are materialized by one call. Metapaths that are already materialized and
+        current are not computed again.
+
+        Output:
+            the paths of the materialized metapaths.
+        '''
+        return [self.materialize(steps) for steps in self.frequent_metapaths(n, min_queries)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query the nodes reachable along a metapath')
+    parser.add_argument('catalog_file', help='network catalog, as written by network_catalog.py or build_network_incremental')
+    parser.add_argument('index_dir', help='directory of the crossnet indexes and materialized metapaths')
+    parser.add_argument('modes', help='modes of the metapath, separated by commas')
+    parser.add_argument('seeds_file', help='file with the mambo node ids of the seeds, one per line')
+    parser.add_argument('--crossnet', action='append', help='crossnet of each step; repeat once per step', default=None)
+    parser.add_argument('--num_workers', type=int, default=None)
+    parser.add_argument('--output_file', default=None)
+    args = parser.parse_args()
+
+    with open(args.catalog_file, 'r') as inF:
+        catalog = json.load(inF)
+    with open(args.seeds_file, 'r') as inF:
+        seeds = [int(line) for line in inF if line.strip()]
+    engine = MetapathEngine(catalog, args.index_dir, args.num_workers)
+    result = engine.query(args.modes.split(','), seeds, args.crossnet)
+    outF = open(args.output_file, 'w') if args.output_file else sys.stdout
+    for i, seed in enumerate(seeds):
+        for node, count in zip(result.neighbors(i), result.path_counts(i)):
+            outF.write('%d\t%d\t%d\n' % (seed, node, count))
+    if args.output_file:
+        outF.close()
@@ -0,0 +1,154 @@
+'''
+file: metrics.py
+
+Instrumentation for the table builders and network loaders.
+
+A BuildMetrics object records the time spent in each stage of a build (e.g. reading mode files,
+converting input lines, writing output), counters such as rows read, skipped, missing ids and
+written, and reports progress in lines per second while a long input is processed. When the
+build finishes, the results are appended as one JSON object to the metrics file and/or passed
+to the callback.
+
+The stages of a loop that handles one input line at a time (e.g. splitting, filtering and writing
+a line) take too little time per line to be timed on every line; a StageSampler estimates them
+from a sample of the lines instead.
+
+Example usage:
+
+metrics = BuildMetrics('string-coexpression', metrics_file='metrics.jsonl', progress_stream=sys.stderr)
+create_mambo_crossnet_table(..., metrics=metrics)
+'''
+
+import json
+import time
+from contextlib import contextmanager
+
+PROGRESS_INTERVAL = 30.0
+# A StageSampler times one input line in TIMING_SAMPLE_RATE.
+TIMING_SAMPLE_RATE = 64
+
+
+class BuildMetrics(object):
+    '''Collects stage timings, counters and progress of one build.
+
+    Input:
+        name: name of the build, included in the results.
+        metrics_file: if given, the results are appended to this file as a JSON line.
+        callback: if given, called with a dictionary for every progress report (event
+                  'progress') and with the results (event 'finish').
+        progress_interval: minimum number of seconds between progress reports.
+        progress_stream: if given, progress reports are also written to this stream.
+    '''
+
+    def __init__(self, name=None, metrics_file=None, callback=None,
+                 progress_interval=PROGRESS_INTERVAL, progress_stream=None):
+        self.name = name
+        self.metrics_file = metrics_file
+        self.callback = callback
+        self.progress_interval = progress_interval
+        self.progress_stream = progress_stream
+        self.stages = {}
+        self.counters = {}
+        self.info = {}
+        self.start_time = time.time()
+        self.last_progress = self.start_time
+        self.finished = False
+
+    @contextmanager
+    def stage(self, stage_name):
+        '''Context manager that adds the time spent in its body to the given stage.'''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(stage_name, time.time() - start)
+
+    def add_time(self, stage_name, seconds):
+        '''Adds time measured without stage to the given stage, e.g. by a StageSampler.'''
+        self.stages[stage_name] = self.stages.get(stage_name, 0.0) + seconds
+
+    def add(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def set(self, key, value):
+        '''Records a piece of information about the build, e.g. the output file name.'''
+        self.info[key] = value
+
+    def progress(self, lines):
+        '''Reports progress if progress_interval seconds passed since the last report.
+
+        Input:
+            lines: total number of input lines processed so far.
+        '''
+        now = time.time()
+        if now - self.last_progress < self.progress_interval:
+            return
+        self.last_progress = now
+        elapsed = now - self.start_time
+        report = {'event': 'progress', 'name': self.name, 'lines': lines, 'elapsed': elapsed,
+                  'lines_per_sec': lines / elapsed if elapsed > 0 else None}
+        if self.progress_stream is not None:
+            self.progress_stream.write('%s: %d lines in %.1fs (%.0f lines/sec)\n' % (
+                self.name, lines, elapsed, report['lines_per_sec'] or 0))
+            self.progress_stream.flush()
+        if self.callback is not None:
+            self.callback(report)
+
+    def results(self):
+        elapsed = time.time() - self.start_time
+        results = {'event': 'finish', 'name': self.name, 'elapsed': elapsed,
+                   'stages': dict(self.stages), 'counters': dict(self.counters)}
+        results.update(self.info)
+        if 'rows_read' in self.counters and elapsed > 0:
+            results['lines_per_sec'] = self.counters['rows_read'] / elapsed
+        return results
+
+    def finish(self):
+        '''Writes the results to the metrics file and passes them to the callback. Only the
+        first call has an effect, so a metrics object shared by nested builds reports once.'''
+        if self.finished:
+            return None
+        self.finished = True
+        results = self.results()
+        if self.metrics_file is not None:
+            with open(self.metrics_file, 'a') as outF:
+                outF.write(json.dumps(results, sort_keys=True) + '\n')
+        if self.callback is not None:
+            self.callback(results)
+        return results
+
+
+class StageSampler(object):
+    '''Estimates the time spent in the stages of a loop over input lines: every rate-th line is
+    timed, and its stage times, multiplied by rate, are added to the stages of metrics.
+
+    Example usage:
+
+    sampler = StageSampler(metrics)
+    for num_lines, line in enumerate(inF, 1):
+        sampled = sampler.start(num_lines)
+        vals = line.split('\t')
+        if sampled:
+            sampler.lap('split')
+        outF.write(...)
+        if sampled:
+            sampler.lap('write')
+    '''
+
+    def __init__(self, metrics, rate=TIMING_SAMPLE_RATE):
+        self.metrics = metrics
+        self.rate = rate
+        self.last = None
+
+    def start(self, num_lines):
+        '''Starts timing the num_lines-th line if it is sampled; returns whether it is.'''
+        if num_lines % self.rate:
+            return False
+        self.last = time.time()
+        return True
+
+    def lap(self, stage_name):
+        '''Adds the time since the start of the line or the last lap to the given stage.'''
+        now = time.time()
+        self.metrics.add_time(stage_name, (now - self.last) * self.rate)
+        self.last = now
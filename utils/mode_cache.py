@@ -0,0 +1,117 @@
+'''
+file: mode_cache.py
+
+Session-level cache of parsed mode tables.
+
+A network build reads the same dataset specific mode tables many times: every crossnet reads the
+mode tables of both of its modes (e.g. the CTD disease table is read for disease-chemical,
+disease-function and disease-protein). While a session is active, utils.read_mode_file parses
+each table once and serves later reads from a ModeCache, so the builders share the parsed tables
+without any change to their arguments.
+
+Entries are keyed by the absolute path of the table together with its size and modification
+time, so a table that is rewritten during the session is parsed again. The cache has a memory
+budget; when it is exceeded, the least recently used tables are evicted.
+
+The cached dictionaries are shared by every caller and must not be modified.
+
+Example usage:
+
+with mode_cache.session(memory_budget=4 << 30) as cache:
+    create_mambo_crossnet_table(...)
+    create_mambo_crossnet_table(...)
+print(cache.stats())
+'''
+
+import os
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_MEMORY_BUDGET = 2 << 30
+# Size of an int value of a mapping; ints are not shared between dictionaries.
+INT_SIZE = sys.getsizeof(1 << 40)
+
+
+def estimate_size(mapping):
+    '''Returns the approximate memory use in bytes of a dictionary from strings to ints.'''
+    return sys.getsizeof(mapping) + sum(sys.getsizeof(key) for key in mapping) + INT_SIZE * len(mapping)
+
+
+def get_stamp(path):
+    '''Returns the (size, modification time) of a file, which identifies its version.'''
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+class ModeCache(object):
+    '''LRU cache of parsed mode tables with a memory budget.
+
+    Input:
+        memory_budget: approximate maximum number of bytes used by the cached tables. A table
+                       larger than the budget is returned but not cached.
+    '''
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        # Absolute path -> (stamp, mapping, estimated size), least recently used first.
+        self.entries = OrderedDict()
+        self.memory_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, loader):
+        '''Returns the parsed table at path, calling loader(path) to parse it if it is not
+        cached or changed since it was cached.'''
+        key = os.path.abspath(path)
+        stamp = get_stamp(path)
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            if entry[0] == stamp:
+                self.hits += 1
+                self.entries[key] = entry
+                return entry[1]
+            self.memory_used -= entry[2]
+        self.misses += 1
+        mapping = loader(path)
+        size = estimate_size(mapping)
+        if size <= self.memory_budget:
+            self.entries[key] = (stamp, mapping, size)
+            self.memory_used += size
+            while self.memory_used > self.memory_budget:
+                _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.memory_used -= evicted_size
+                self.evictions += 1
+        return mapping
+
+    def clear(self):
+        self.entries.clear()
+        self.memory_used = 0
+
+    def stats(self):
+        return {'tables': len(self.entries), 'memory_used': self.memory_used,
+                'memory_budget': self.memory_budget, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+_session = None
+
+
+def get_session():
+    '''Returns the cache of the active session, or None.'''
+    return _session
+
+
+@contextmanager
+def session(memory_budget=DEFAULT_MEMORY_BUDGET):
+    '''Context manager that makes utils.read_mode_file use a new ModeCache, which it yields.
+    The previous session, if any, is restored on exit.'''
+    global _session
+    previous = _session
+    _session = ModeCache(memory_budget)
+    try:
+        yield _session
+    finally:
+        _session.clear()
+        _session = previous
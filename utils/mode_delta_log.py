@@ -0,0 +1,146 @@
+'''
+file: mode_delta_log.py
+
+Append-only delta log of a mapped full mode table (as written by create_mapped_mode_table.py).
+
+Without the log, adding a dataset to a mapped mode reads the whole full mode table and rewrites it
+with the new dataset id appended to the comma separated dataset ids of every node, so the cost of
+the Nth dataset grows with the size of the mode. With --delta_log, create_mapped_mode_table.py
+leaves the full mode table (the base snapshot) untouched and appends one <mambo_nid>\t<dataset_id>
+row per node of the new dataset to the delta log next to it, so adding a dataset costs time in
+proportion to the dataset. read_full_mode_table merges the base and the log into integer dataset
+id sets, and compaction folds the log into the base, after which the full mode table has the
+usual layout again. The other readers of full mode tables (the network_utils loaders and
+build_catalog, csr_adjacency and lookup_service) read the full mode table only, so they raise a
+ValueError while a delta log is pending (see utils.check_no_delta_log); utils.get_max_id includes
+the ids in the log.
+
+The delta log of miner-protein-20160520.tsv is miner-protein-20160520.delta.tsv, compressed like
+the full mode table.
+
+Usage:
+python mode_delta_log.py <full_mode_file>
+
+Positional Arguments:
+full_mode_file:          Path to the full mode table whose delta log is compacted.
+
+Optional arguments:
+--binary_output          Flag; Also rewrite the binary columnar version of the full mode table (see
+                         columnar_table.py).
+
+Example usage:
+python mode_delta_log.py outputs/protein/miner-protein-20160520.tsv
+'''
+
+import argparse
+import columnar_table
+import compression
+import os
+import utils
+from collections import OrderedDict
+
+DELIMITER = '\t'
+
+
+def get_delta_log_file_name(full_mode_file):
+    '''Returns the path of the delta log of a full mode table, compressed like the table.'''
+    return utils.get_delta_log_file_name(full_mode_file)
+
+
+def write_full_mode_header(outF, mode_name, delimiter=DELIMITER):
+    outF.write('# Full mode table for %s\n' % mode_name)
+    outF.write('# File generated on: %s\n' % utils.get_current_date())
+    outF.write('# mambo_nid%sdataset_ids\n' % delimiter)
+
+
+def open_delta_log(full_mode_file, mode_name, delimiter=DELIMITER):
+    '''Opens the delta log of a full mode table for appending. The full mode table is created,
+    empty, if it does not exist yet, so that the base snapshot and the log always come in pairs.
+
+    Output:
+        a file object to write <mambo_nid>\t<dataset_id> rows to.
+    '''
+    if not os.path.isfile(full_mode_file):
+        with compression.open_file(full_mode_file, 'w') as outF:
+            write_full_mode_header(outF, mode_name, delimiter)
+    delta_file = get_delta_log_file_name(full_mode_file)
+    is_new = not os.path.isfile(delta_file)
+    outF = compression.open_file(delta_file, 'a')
+    if is_new:
+        outF.write('# Delta log of the full mode table %s\n' % os.path.basename(full_mode_file))
+        outF.write('# mambo_nid%sdataset_id\n' % delimiter)
+    return outF
+
+
+def read_full_mode_table(full_mode_file, delimiter=DELIMITER):
+    '''Reads a full mode table together with its delta log, if any.
+
+    Input:
+        full_mode_file: path to the full mode table.
+    Output:
+        an OrderedDict from mambo id to the set of its dataset ids, in the order of the full
+        mode table followed by the nodes first seen in the delta log.
+    '''
+    memberships = OrderedDict()
+    if os.path.isfile(full_mode_file):
+        with compression.open_file(full_mode_file) as inF:
+            for line in inF:
+                if line[0] == '#' or not line.strip():
+                    continue
+                vals = line.strip().split(delimiter)
+                memberships[int(vals[0])] = set(int(db_id) for db_id in vals[1].split(','))
+    delta_file = get_delta_log_file_name(full_mode_file)
+    if os.path.isfile(delta_file):
+        with compression.open_file(delta_file) as inF:
+            for line in inF:
+                if line[0] == '#' or not line.strip():
+                    continue
+                vals = line.strip().split(delimiter)
+                memberships.setdefault(int(vals[0]), set()).add(int(vals[1]))
+    return memberships
+
+
+def compact(full_mode_file, mode_name=None, binary_output=False, delimiter=DELIMITER):
+    '''Folds the delta log of a full mode table into the table and removes the log. The table
+    is replaced atomically, and the log is only removed after the table was replaced.
+
+    Input:
+        full_mode_file: path to the full mode table.
+        mode_name: the name of the mode, for the header. Defaults to the name in the header
+                   of the table.
+        binary_output: if True, also rewrite the binary columnar version of the table.
+    Output:
+        the number of nodes in the compacted table.
+    '''
+    delta_file = get_delta_log_file_name(full_mode_file)
+    if not os.path.isfile(delta_file):
+        return None
+    if mode_name is None:
+        with compression.open_file(full_mode_file) as inF:
+            mode_name = inF.readline().strip()[len('# Full mode table for '):]
+    memberships = read_full_mode_table(full_mode_file, delimiter)
+    tmp_file = '%s.tmp%d' % (full_mode_file, os.getpid())
+    with compression.open_file(tmp_file, 'w', compression=compression.get_compression(full_mode_file)) as outF:
+        write_full_mode_header(outF, mode_name, delimiter)
+        for mambo_nid, db_ids in memberships.items():
+            outF.write('%d%s%s\n' % (mambo_nid, delimiter, ','.join(str(db_id) for db_id in sorted(db_ids))))
+    # The table is rewritten, not appended to, so its ledger is rebuilt.
+    ledger_file = utils.get_ledger_file_name(full_mode_file)
+    if os.path.isfile(ledger_file):
+        os.remove(ledger_file)
+    os.rename(tmp_file, full_mode_file)
+    os.remove(delta_file)
+    utils.update_ledger(full_mode_file)
+    if binary_output:
+        columnar_table.write_columnar_table(full_mode_file, columnar_table.MAPPED_FULL_MODE_SCHEMA,
+                                            delimiter=delimiter)
+    return len(memberships)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compact the delta log of a mapped full mode table')
+    parser.add_argument('full_mode_file', help='full mode table written by create_mapped_mode_table.py')
+    parser.add_argument('--binary_output', action='store_true', help='also rewrite the binary columnar table')
+    args = parser.parse_args()
+
+    compact(args.full_mode_file, binary_output=args.binary_output)
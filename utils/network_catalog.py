@@ -0,0 +1,81 @@
+'''
+file: network_catalog.py
+
+Script that writes or refreshes the catalog of a network (see network_utils.build_catalog) from the
+ledgers of its full mode and crossnet tables, without building a TMMNet. The catalog tells
+csr_adjacency.py, metapath.py and network_utils.LazyNetwork which tables make up the network and how
+large they are. Only the ledger files next to the tables are written, and only when they are stale;
+tables in read-only directories can be cataloged too.
+
+Usage:
+python network_catalog.py <catalog_file>
+
+Positional Arguments:
+catalog_file:            Path of the catalog. Without --mode and --crossnet, the existing catalog is
+                         refreshed from the tables it lists, e.g. after datasets were appended to them.
+
+Optional arguments:
+--mode                   A mode and its full mode table, as <mode>=<path>. May be given several times.
+--crossnet               A crossnet and its full crossnet table, as <src>,<dst>,<edge_id>=<path>. May be
+                         given several times.
+--prefix                 Prefix of the crossnet names. Defaults to miner.
+
+Example usage:
+python network_catalog.py miner.catalog --mode gene=gene/miner-gene-20160520.tsv --mode protein=protein/miner-protein-20160520.tsv --crossnet gene,protein,GeneProteinId=gene-protein/miner-gene-protein-20160521.tsv
+python network_catalog.py miner.catalog
+'''
+
+import argparse
+
+import network_utils
+
+
+def parse_table_specs(mode_specs, crossnet_specs, prefix='miner'):
+    '''Returns the mode_tables and crossnet_tables arguments of network_utils.build_catalog for the
+    --mode and --crossnet arguments. Raises a ValueError for a malformed argument.'''
+    mode_tables = {}
+    for spec in mode_specs:
+        if '=' not in spec:
+            raise ValueError('Expected <mode>=<path>, got %s' % spec)
+        mode, path = spec.split('=', 1)
+        mode_tables[mode] = path
+    crossnet_tables = []
+    for spec in crossnet_specs:
+        names, _, path = spec.partition('=')
+        names = names.split(',')
+        if not path or len(names) != 3:
+            raise ValueError('Expected <src>,<dst>,<edge_id>=<path>, got %s' % spec)
+        crossnet_tables.append({'src': names[0], 'dst': names[1], 'edge_id': names[2], 'path': path,
+                                'prefix': prefix})
+    return mode_tables, crossnet_tables
+
+
+def refresh_catalog(catalog_file):
+    '''Rebuilds a catalog from the current ledgers of the tables it lists, and writes it back.
+
+    Output:
+        the new catalog.
+    '''
+    mode_tables, crossnet_tables = network_utils.get_catalog_tables(network_utils.read_catalog(catalog_file))
+    catalog = network_utils.build_catalog(mode_tables, crossnet_tables)
+    network_utils.write_catalog(catalog_file, catalog)
+    return catalog
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write or refresh the catalog of a network')
+    parser.add_argument('catalog_file', help='path of the catalog')
+    parser.add_argument('--mode', action='append', help='<mode>=<full mode table>; may be repeated', default=[])
+    parser.add_argument('--crossnet', action='append', help='<src>,<dst>,<edge_id>=<full crossnet table>; may be repeated',
+                        default=[])
+    parser.add_argument('--prefix', type=str, default='miner')
+    args = parser.parse_args()
+
+    if args.mode or args.crossnet:
+        try:
+            mode_tables, crossnet_tables = parse_table_specs(args.mode, args.crossnet, args.prefix)
+        except ValueError as e:
+            parser.error(str(e))
+        network_utils.write_catalog(args.catalog_file, network_utils.build_catalog(mode_tables, crossnet_tables))
+    else:
+        refresh_catalog(args.catalog_file)
@@ -1,9 +1,20 @@
+import hashlib
+import json
+import multiprocessing
+import os
+
+import compression
 import snap
+import utils
+from metrics import BuildMetrics
 
 DELIMITER  = "\t"
+HASH_BLOCK_SIZE = 1 << 20
 
 
 def get_num_elem_per_mode(Graph):
+    '''Returns a dictionary from mode name to number of nodes of a loaded graph. See
+    get_catalog_num_elem_per_mode for a graph that is not loaded.'''
     mode_num_elem = {}
     modeneti = Graph.BegModeNetI()
     while modeneti < Graph.EndModeNetI():
@@ -15,11 +26,11 @@ def get_num_elem_per_mode(Graph):
       
 
 def get_num_elem_per_link(Graph):
+    '''Returns a dictionary from crossnet name to number of edges of a loaded graph. See
+    get_catalog_num_elem_per_link for a graph that is not loaded.'''
     link_num_elem = {}
-    crossnetids = snap.TIntV()
     crossneti = Graph.BegCrossNetI()
     while crossneti < Graph.EndCrossNetI():
-        crossnetids.Add(crossneti.GetCrossId())
         name = Graph.GetCrossName(crossneti.GetCrossId())
         crossnet = crossneti.GetCrossNet()
         link_num_elem[name] = crossnet.GetEdges()
@@ -27,24 +38,643 @@ def get_num_elem_per_link(Graph):
     return link_num_elem
 
 
-def load_mode_to_graph(mode, filename, Graph, context):
-    modeId = mode + 'Id'
+def get_table_cache_file_name(filename):
+    return filename + '.bin'
+
+
+def get_table_cache_stamp_file_name(filename):
+    return get_table_cache_file_name(filename) + '.json'
+
+
+def get_schema(columns):
+    '''Returns a snap.Schema for a list of (column name, snap attribute type) pairs.'''
     schema = snap.Schema()
-    schema.Add(snap.TStrTAttrPr(modeId, snap.atStr))
-    schema.Add(snap.TStrTAttrPr("datasetId", snap.atStr))
-    modenet = snap.TTable.LoadSS(schema, filename, context, "\t", snap.TBool(False))
-    snap.LoadModeNetToNet(Graph, mode, modenet, modeId, snap.TStrV())
+    for name, attr_type in columns:
+        schema.Add(snap.TStrTAttrPr(name, attr_type))
+    return schema
+
+
+def get_table_stamp(filename, columns, relevant_columns):
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime,
+            'columns': [columns[index][0] for index in relevant_columns]}
+
+
+def load_table(columns, filename, context, metrics=None, use_cache=True, relevant_columns=None):
+    '''Loads a table file into a snap.TTable. With use_cache, the table is also saved in the
+    binary TTable format next to filename (see get_table_cache_file_name), and later loads
+    read that file instead of parsing the text again, as long as filename has the same size
+    and modification time and the loaded columns are unchanged. Only tables whose loaded
+    columns are all integers are cached: string values are stored as indices into context,
+    so a binary table with strings could not be loaded into another context.
+
+    Input:
+        columns: list of (column name, snap attribute type) pairs, one per column of the file.
+        metrics: a BuildMetrics object that counts the cache hits and misses.
+        relevant_columns: indices of the columns to load. Defaults to all.
+    Output:
+        the snap.TTable.
+    '''
+    if metrics is None:
+        metrics = BuildMetrics()
+    if relevant_columns is None:
+        relevant_columns = range(len(columns))
+    cache_file = get_table_cache_file_name(filename)
+    stamp_file = get_table_cache_stamp_file_name(filename)
+    use_cache = use_cache and all(columns[index][1] == snap.atInt for index in relevant_columns)
+    if use_cache:
+        stamp = get_table_stamp(filename, columns, relevant_columns)
+        if os.path.isfile(cache_file) and os.path.isfile(stamp_file):
+            with open(stamp_file, 'r') as inF:
+                if json.load(inF) == stamp:
+                    metrics.add('table_cache_hits', 1)
+                    return snap.TTable.Load(snap.TFIn(cache_file), context)
+        metrics.add('table_cache_misses', 1)
+    relevant = snap.TIntV()
+    for index in relevant_columns:
+        relevant.Add(index)
+    table = snap.TTable.LoadSS(get_schema(columns), filename, context, relevant, DELIMITER, snap.TBool(False))
+    if use_cache:
+        # The stamp is written last, so an interrupted save leaves no valid cache behind.
+        if os.path.isfile(stamp_file):
+            os.remove(stamp_file)
+        table.SaveBin(cache_file)
+        tmp_file = '%s.tmp%d' % (stamp_file, os.getpid())
+        with open(tmp_file, 'w') as outF:
+            json.dump(stamp, outF)
+        os.rename(tmp_file, stamp_file)
+    return table
+
 
+def get_mode_columns(mode):
+    return [(mode + 'Id', snap.atInt), ("datasetId", snap.atStr)]
 
-def load_crossnet_to_graph(context, edgeId, srcName, dstName, filepath, Graph, prefix="miner"):
+
+def get_crossnet_columns(edgeId, srcName, dstName):
+    return [(edgeId, snap.atInt), ("datasetId", snap.atInt), (srcName + "SrcId", snap.atInt),
+            (dstName + "DstId", snap.atInt)]
+
+
+def load_mode_to_graph(mode, filename, Graph, context, metrics=None, use_cache=True):
+    '''Loads a full mode table into Graph. If metrics (a BuildMetrics object) is given, the
+    time spent parsing the table and building the mode net and the number of rows are added
+    to it. Only the node ids are loaded, as integers, so the table is cached as in load_table;
+    the dataset ids of a mapped mode table are comma separated lists. Raises a ValueError if
+    the table has a pending delta log, see utils.check_no_delta_log.'''
+    utils.check_no_delta_log(filename)
+    if metrics is None:
+        metrics = BuildMetrics()
+    modeId = mode + 'Id'
+    with metrics.stage('load_mode_table'):
+        modenet = load_table(get_mode_columns(mode), filename, context, metrics, use_cache, [0])
+    with metrics.stage('load_mode_net'):
+        snap.LoadModeNetToNet(Graph, mode, modenet, modeId, snap.TStrV())
+    metrics.add('mode_rows', modenet.GetNumRows())
+
+
+def get_crossnet_name(srcName, dstName, prefix="miner"):
+    return prefix + "-" + dstName + "-" + srcName
+
+
+def load_crossnet_to_graph(context, edgeId, srcName, dstName, filepath, Graph, prefix="miner", metrics=None,
+                           use_cache=True):
+    '''Loads a full crossnet table into Graph. metrics and use_cache are used as in
+    load_mode_to_graph.'''
+    if metrics is None:
+        metrics = BuildMetrics()
     srcId = srcName + "SrcId"
     dstId = dstName + "DstId"
-    schema = snap.Schema()
-    schema.Add(snap.TStrTAttrPr(edgeId, snap.atStr))
-    schema.Add(snap.TStrTAttrPr("datasetId", snap.atStr))
-    schema.Add(snap.TStrTAttrPr(srcId, snap.atStr))
-    schema.Add(snap.TStrTAttrPr(dstId, snap.atStr))
-    crossnet = snap.TTable.LoadSS(schema, filepath, context, DELIMITER, snap.TBool(False))
-    crossName = prefix + "-" + dstName + "-" + srcName
-    Graph.AddCrossNet(srcName, dstName, crossName, False)
-    snap.LoadCrossNetToNet(Graph, srcName, dstName, crossName, crossnet, srcId, dstId, snap.TStrV())
+    with metrics.stage('load_crossnet_table'):
+        crossnet = load_table(get_crossnet_columns(edgeId, srcName, dstName), filepath, context, metrics, use_cache)
+    crossName = get_crossnet_name(srcName, dstName, prefix)
+    with metrics.stage('load_crossnet_net'):
+        Graph.AddCrossNet(srcName, dstName, crossName, False)
+        snap.LoadCrossNetToNet(Graph, srcName, dstName, crossName, crossnet, srcId, dstId, snap.TStrV())
+    metrics.add('crossnet_rows', crossnet.GetNumRows())
+
+
+def get_catalog_file_name(graph_file):
+    return graph_file + '.catalog'
+
+
+def get_table_catalog_entry(filename):
+    '''Returns the catalog entry of a full mode or crossnet table, from its ledger (see
+    utils.get_ledger, which does not need write access to the table directory).'''
+    ledger = utils.get_ledger(filename)
+    return {'path': filename, 'num_rows': ledger['num_rows'], 'dataset_ids': ledger['dataset_ids'],
+            'min_id': ledger['min_id'], 'max_id': ledger['next_id'] - 1}
+
+
+def build_catalog(mode_tables, crossnet_tables):
+    '''Returns the catalog of a network: per mode, the number of nodes, and per crossnet,
+    the modes it connects and the number of edges, each with the path of the table, the ids
+    of the contributing datasets and the range of mambo ids. It is built from the ledgers of
+    the tables, which the table builders keep up to date, so no table is loaded, and only
+    the rows appended since a ledger was written are read. See network_catalog.py to write
+    a catalog without building a TMMNet. Raises a ValueError if a mode table has a pending
+    delta log, see utils.check_no_delta_log.
+
+    Input:
+        mode_tables, crossnet_tables: as in load_network.
+    Output:
+        a dictionary with keys modes and crossnets, from mode and crossnet name to entry.
+    '''
+    for filename in mode_tables.values():
+        utils.check_no_delta_log(filename)
+    modes = {}
+    for mode, filename in mode_tables.items():
+        modes[mode] = get_table_catalog_entry(filename)
+        modes[mode]['num_nodes'] = modes[mode].pop('num_rows')
+    crossnets = {}
+    for table in crossnet_tables:
+        name = get_crossnet_name(table['src'], table['dst'], table.get('prefix', 'miner'))
+        crossnets[name] = get_table_catalog_entry(table['path'])
+        crossnets[name]['num_edges'] = crossnets[name].pop('num_rows')
+        crossnets[name].update(edge_id=table['edge_id'], src=table['src'], dst=table['dst'],
+                               prefix=table.get('prefix', 'miner'))
+    return {'modes': modes, 'crossnets': crossnets}
+
+
+def write_catalog(catalog_file, catalog):
+    tmp_file = '%s.tmp%d' % (catalog_file, os.getpid())
+    with open(tmp_file, 'w') as outF:
+        json.dump(catalog, outF, indent=1, sort_keys=True)
+    os.rename(tmp_file, catalog_file)
+
+
+def read_catalog(catalog_file):
+    with open(catalog_file, 'r') as inF:
+        return json.load(inF)
+
+
+def get_catalog_num_elem_per_mode(catalog):
+    '''Returns a dictionary from mode name to number of nodes, like get_num_elem_per_mode.'''
+    return dict((mode, entry['num_nodes']) for mode, entry in catalog['modes'].items())
+
+
+def get_catalog_num_elem_per_link(catalog):
+    '''Returns a dictionary from crossnet name to number of edges, like get_num_elem_per_link.'''
+    return dict((name, entry['num_edges']) for name, entry in catalog['crossnets'].items())
+
+
+def get_catalog_tables(catalog):
+    '''Returns the mode and crossnet tables of a catalog, as the arguments mode_tables and
+    crossnet_tables of load_network, LazyNetwork and build_network_incremental.'''
+    mode_tables = dict((mode, entry['path']) for mode, entry in catalog['modes'].items())
+    crossnet_tables = [dict((key, entry[key]) for key in ('edge_id', 'src', 'dst', 'path', 'prefix'))
+                       for _, entry in sorted(catalog['crossnets'].items())]
+    return mode_tables, crossnet_tables
+
+
+def _cache_table(task):
+    columns, filename, relevant_columns = task
+    metrics = BuildMetrics(filename)
+    load_table(columns, filename, snap.TTableContext(), metrics, True, relevant_columns)
+    return metrics.counters
+
+
+def cache_tables(mode_tables, crossnet_tables, num_workers=None, metrics=None):
+    '''Parses the given mode and crossnet tables concurrently, each in a worker process, and
+    saves them in the binary table cache (see load_table), so that loading them afterwards
+    only reads the binary files. Tables that are already cached are not parsed again.
+
+    Input:
+        mode_tables, crossnet_tables: as in load_network.
+        num_workers: number of worker processes. Defaults to the number of CPUs.
+        metrics: a BuildMetrics object that receives the time spent and the cache counters.
+    '''
+    if metrics is None:
+        metrics = BuildMetrics()
+    tasks = [(get_mode_columns(mode), filename, [0]) for mode, filename in mode_tables.items()]
+    tasks.extend((get_crossnet_columns(table['edge_id'], table['src'], table['dst']), table['path'], None)
+                 for table in crossnet_tables)
+    if not tasks:
+        return
+    # Largest tables first, so that a big table does not start last and hold up the pool.
+    tasks.sort(key=lambda task: -os.path.getsize(task[1]))
+    num_workers = min(num_workers or multiprocessing.cpu_count(), len(tasks))
+    with metrics.stage('cache_tables'):
+        if num_workers == 1:
+            counters = [_cache_table(task) for task in tasks]
+        else:
+            pool = multiprocessing.Pool(num_workers)
+            try:
+                counters = pool.map(_cache_table, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+    for table_counters in counters:
+        for name in ('table_cache_hits', 'table_cache_misses'):
+            metrics.add(name, table_counters.get(name, 0))
+
+
+def load_network(mode_tables, crossnet_tables, Graph=None, context=None, num_workers=None, metrics=None):
+    '''Loads mode and crossnet tables into a TMMNet. The tables are parsed concurrently by
+    cache_tables, and then attached to the graph one at a time from their binary caches,
+    modes before the crossnets that connect them.
+
+    Example usage:
+
+    Graph = load_network({'gene': 'gene/miner-gene-20160520.tsv', 'protein': ...},
+                         [{'edge_id': 'GeneProteinId', 'src': 'gene', 'dst': 'protein',
+                           'path': 'gene-protein/miner-gene-protein-20160521.tsv'}, ...])
+
+    Input:
+        mode_tables: dictionary from mode name to full mode table path.
+        crossnet_tables: list of dictionaries with keys edge_id, src, dst, path and,
+            optionally, prefix; the arguments of load_crossnet_to_graph.
+        Graph: the TMMNet to add to. Defaults to a new TMMNet.
+        context: the snap.TTableContext to load tables with.
+        num_workers: number of worker processes parsing the tables.
+        metrics: a BuildMetrics object that receives the timings of the load.
+    Output:
+        the TMMNet.
+    '''
+    if Graph is None:
+        Graph = snap.TMMNet.New()
+    if context is None:
+        context = snap.TTableContext()
+    if metrics is None:
+        metrics = BuildMetrics()
+    for filename in mode_tables.values():
+        utils.check_no_delta_log(filename)
+    cache_tables(mode_tables, crossnet_tables, num_workers, metrics)
+    for mode in sorted(mode_tables):
+        load_mode_to_graph(mode, mode_tables[mode], Graph, context, metrics)
+    for table in crossnet_tables:
+        load_crossnet_to_graph(context, table['edge_id'], table['src'], table['dst'], table['path'],
+                               Graph, table.get('prefix', 'miner'), metrics)
+    metrics.finish()
+    return Graph
+
+
+class LazyNetwork(object):
+    '''A multimodal network whose modes and crossnets are loaded from their tables on first
+    access, so that an analysis that uses a few link types only pays for those. The catalog
+    of names and sizes is built from the table ledgers (see build_catalog) without loading
+    any table, once per network; a saved catalog can be passed instead, and then lists the
+    tables too.
+
+    Example usage:
+
+    network = LazyNetwork({'gene': 'gene/miner-gene-20160520.tsv', 'protein': ...},
+                          [{'edge_id': 'GeneProteinId', 'src': 'gene', 'dst': 'protein',
+                            'path': 'gene-protein/miner-gene-protein-20160521.tsv'}, ...])
+    print(network.get_num_elem_per_link())
+    CrossNet = network.get_crossnet('miner-protein-gene')
+
+    network = LazyNetwork(catalog=read_catalog('miner.graph.catalog'))
+
+    Input:
+        mode_tables, crossnet_tables: as in load_network. Default to the tables of catalog.
+        context: the snap.TTableContext to load tables with.
+        metrics: a BuildMetrics object that receives the timings of the loads.
+        use_cache: whether tables are loaded through the binary table cache, see load_table.
+        catalog: the catalog of the network, e.g. read with read_catalog. Defaults to the
+            catalog built from the tables on first use.
+    '''
+
+    def __init__(self, mode_tables=None, crossnet_tables=None, context=None, metrics=None, use_cache=True,
+                 catalog=None):
+        if catalog is not None and mode_tables is None and crossnet_tables is None:
+            mode_tables, crossnet_tables = get_catalog_tables(catalog)
+        elif mode_tables is None or crossnet_tables is None:
+            raise ValueError('Either the tables or a catalog must be given')
+        self.Graph = snap.TMMNet.New()
+        self.context = snap.TTableContext() if context is None else context
+        self.metrics = BuildMetrics() if metrics is None else metrics
+        self.use_cache = use_cache
+        self.mode_tables = dict(mode_tables)
+        self.crossnet_tables = dict((get_crossnet_name(table['src'], table['dst'], table.get('prefix', 'miner')), table)
+                                    for table in crossnet_tables)
+        self.catalog = catalog
+        self.loaded_modes = set()
+        self.loaded_crossnets = set()
+
+    def get_mode_names(self):
+        return sorted(self.mode_tables)
+
+    def get_crossnet_names(self):
+        return sorted(self.crossnet_tables)
+
+    def get_catalog(self):
+        '''Returns the catalog of the network, see build_catalog. It is built on the first call
+        only, so rows appended to the tables afterwards are not counted.'''
+        if self.catalog is None:
+            self.catalog = build_catalog(self.mode_tables, self.crossnet_tables.values())
+        return self.catalog
+
+    def get_num_elem_per_mode(self):
+        return get_catalog_num_elem_per_mode(self.get_catalog())
+
+    def get_num_elem_per_link(self):
+        return get_catalog_num_elem_per_link(self.get_catalog())
+
+    def get_mode(self, mode):
+        '''Returns the mode net of a mode, loading it if needed.'''
+        if mode not in self.mode_tables:
+            raise ValueError('Unknown mode: %s' % mode)
+        if mode not in self.loaded_modes:
+            load_mode_to_graph(mode, self.mode_tables[mode], self.Graph, self.context, self.metrics,
+                               self.use_cache)
+            self.loaded_modes.add(mode)
+        return self.Graph.GetModeNetByName(mode)
+
+    def get_crossnet(self, name):
+        '''Returns a crossnet, loading it and the modes it connects if needed.'''
+        if name not in self.crossnet_tables:
+            raise ValueError('Unknown crossnet: %s' % name)
+        if name not in self.loaded_crossnets:
+            table = self.crossnet_tables[name]
+            self.get_mode(table['src'])
+            self.get_mode(table['dst'])
+            load_crossnet_to_graph(self.context, table['edge_id'], table['src'], table['dst'], table['path'],
+                                   self.Graph, table.get('prefix', 'miner'), self.metrics, self.use_cache)
+            self.loaded_crossnets.add(name)
+        return self.Graph.GetCrossNetByName(name)
+
+    def unload_crossnet(self, name):
+        '''Frees a loaded crossnet; it is loaded again on its next access.'''
+        if name in self.loaded_crossnets:
+            self.Graph.DelCrossNet(name)
+            self.loaded_crossnets.remove(name)
+
+
+class GraphSink(object):
+    '''Adds the rows produced by the create_* builders to a TMMNet while the tables are built,
+    instead of writing the tables and loading them back with load_mode_to_graph and
+    load_crossnet_to_graph. The ids arrive as integers, so no table has to be parsed and no
+    id column is string typed.
+
+    Example usage:
+
+    graph_sink = GraphSink()
+    create_mambo_mode_table(..., mode_name='gene', ..., sink=graph_sink.mode('gene'))
+    create_mambo_mode_table(..., mode_name='protein', ..., sink=graph_sink.mode('protein'))
+    create_mambo_crossnet_table(..., sink=graph_sink.crossnet('gene', 'protein'))
+    Graph = graph_sink.Graph
+
+    Input:
+        Graph: the TMMNet to add to. Defaults to a new TMMNet.
+        prefix: prefix of the crossnet names, as in load_crossnet_to_graph.
+        metrics: a BuildMetrics object that receives the time spent adding rows and the
+            numbers of rows added.
+    '''
+
+    def __init__(self, Graph=None, prefix="miner", metrics=None):
+        self.Graph = snap.TMMNet.New() if Graph is None else Graph
+        self.prefix = prefix
+        self.metrics = BuildMetrics() if metrics is None else metrics
+        self.modes = set()
+        self.crossnets = set()
+
+    def add_mode(self, mode):
+        if mode not in self.modes:
+            self.Graph.AddModeNet(mode)
+            self.modes.add(mode)
+        return self.Graph.GetModeNetByName(mode)
+
+    def mode(self, mode):
+        '''Returns a sink for a mode builder, which adds a node per (mambo_nid, db_id) row.
+        A node already in the mode, e.g. one shared by several datasets, is added once.'''
+        ModeNet = self.add_mode(mode)
+        metrics = self.metrics
+
+        def add_rows(rows):
+            with metrics.stage('add_mode_rows'):
+                for nid, _ in rows:
+                    if not ModeNet.IsNode(nid):
+                        ModeNet.AddNode(nid)
+            metrics.add('mode_rows', len(rows))
+        return add_rows
+
+    def crossnet(self, srcName, dstName, prefix=None):
+        '''Returns a sink for a crossnet builder, which adds an edge per (mambo_eid, db_id,
+        src_mambo_nid, dst_mambo_nid) row. The edge ids are the mambo edge ids. The nodes of
+        both modes must have been added before rows are passed to it.'''
+        crossName = get_crossnet_name(srcName, dstName, self.prefix if prefix is None else prefix)
+        if crossName not in self.crossnets:
+            self.add_mode(srcName)
+            self.add_mode(dstName)
+            self.Graph.AddCrossNet(srcName, dstName, crossName, False)
+            self.crossnets.add(crossName)
+        CrossNet = self.Graph.GetCrossNetByName(crossName)
+        metrics = self.metrics
+
+        def add_rows(rows):
+            with metrics.stage('add_crossnet_rows'):
+                for eid, _, src_nid, dst_nid in rows:
+                    CrossNet.AddEdge(src_nid, dst_nid, eid)
+            metrics.add('crossnet_rows', len(rows))
+        return add_rows
+
+
+def get_manifest_file_name(graph_file):
+    return graph_file + '.manifest'
+
+
+def get_table_hash(filename, previous=None):
+    '''Returns the content hash entry of a table file. The hash of previous (an entry
+    returned by an earlier call) is reused if the file size and modification time
+    are unchanged.'''
+    return hash_table(filename, previous)[0]
+
+
+def hash_table(filename, previous=None):
+    '''Like get_table_hash, but also tells whether the file only grew since previous.
+
+    Output:
+        a tuple (entry, appended_from): the content hash entry, and the size of the file in
+        previous if its first previous['size'] bytes are unchanged, i.e. rows were only
+        appended to it since, or None otherwise.
+    '''
+    stat = os.stat(filename)
+    if previous is not None and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime:
+        return previous, None
+    prefix_size = previous['size'] if previous is not None and previous['size'] < stat.st_size else None
+    appended_from = None
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as inF:
+        if prefix_size is not None:
+            remaining = prefix_size
+            while remaining > 0:
+                block = inF.read(min(HASH_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                sha1.update(block)
+                remaining -= len(block)
+            if sha1.hexdigest() == previous['sha1']:
+                appended_from = prefix_size
+        for block in iter(lambda: inF.read(HASH_BLOCK_SIZE), b''):
+            sha1.update(block)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': sha1.hexdigest()}, appended_from
+
+
+def read_appended_rows(filename, offset):
+    '''Returns the rows of a table file from byte offset on, as lists of byte strings.'''
+    with compression.open_file(filename, 'rb', offset) as inF:
+        return [line.rstrip(b'\n').split(b'\t') for line in inF if line[:1] != b'#']
+
+
+def read_build_manifest(graph_file):
+    manifest_file = get_manifest_file_name(graph_file)
+    if not os.path.isfile(manifest_file) or not os.path.isfile(graph_file):
+        return None
+    with open(manifest_file, 'r') as inF:
+        manifest = json.load(inF)
+    graph_hash = get_table_hash(graph_file, manifest['graph'])
+    if graph_hash['sha1'] != manifest['graph']['sha1']:
+        return None
+    return manifest
+
+
+def write_build_manifest(graph_file, manifest):
+    manifest_file = get_manifest_file_name(graph_file)
+    tmp_file = '%s.tmp%d' % (manifest_file, os.getpid())
+    with open(tmp_file, 'w') as outF:
+        json.dump(manifest, outF, indent=1, sort_keys=True)
+    os.rename(tmp_file, manifest_file)
+
+
+def build_network_incremental(graph_file, mode_tables, crossnet_tables, context=None, metrics=None,
+                              use_cache=True, num_workers=None):
+    '''Builds a TMMNet from mode and crossnet tables and saves it to graph_file, reusing
+    the previously saved graph when possible. A manifest next to graph_file records the
+    content hashes and dataset ids of the input tables and the content hash of the saved
+    graph, and a catalog (see build_catalog and get_catalog_file_name) describes its contents.
+
+    The table builders append the rows of every dataset they add to the full tables, so a
+    table to which rows were only appended (e.g. a new STRING channel or GeneMANIA study) is
+    updated in place: the appended nodes or edges are added to the saved graph, and the
+    other rows are not read again. Any other change is detected per whole table, not per
+    dataset: a mode whose table was otherwise modified is reloaded, along with the crossnets
+    that touch it, and a crossnet whose table was otherwise modified is reloaded in full.
+    Modes and crossnets no longer listed are deleted.
+
+    Input:
+        graph_file: path of the saved graph.
+        mode_tables: dictionary from mode name to full mode table path.
+        crossnet_tables: list of dictionaries with keys edge_id, src, dst, path and,
+            optionally, prefix; the arguments of load_crossnet_to_graph.
+        context: the snap.TTableContext to load tables with.
+        metrics: a BuildMetrics object that receives the timings of the build, and the names
+            of the updated modes and crossnets and the dataset ids they gained (info
+            appended_tables).
+        use_cache: whether reloaded tables use the binary table cache, see load_table. With
+            the cache, the reloaded tables are parsed concurrently by cache_tables.
+        num_workers: number of worker processes parsing the tables.
+    Output:
+        a tuple (Graph, reloaded), where reloaded lists the reloaded mode and crossnet names.
+    '''
+    if context is None:
+        context = snap.TTableContext()
+    if metrics is None:
+        metrics = BuildMetrics()
+    if metrics.name is None:
+        metrics.name = os.path.basename(graph_file)
+    metrics.set('output_files', [graph_file, get_catalog_file_name(graph_file)])
+    for filename in mode_tables.values():
+        utils.check_no_delta_log(filename)
+    manifest = read_build_manifest(graph_file)
+    if manifest is None:
+        manifest = {'modes': {}, 'crossnets': {}}
+        Graph = snap.TMMNet.New()
+    else:
+        with metrics.stage('load_graph'):
+            Graph = snap.TMMNet.Load(snap.TFIn(graph_file))
+    old_modes = manifest['modes']
+    old_crossnets = manifest['crossnets']
+
+    # Offset from which rows were appended, for the tables that only grew.
+    appended_modes = {}
+    appended_crossnets = {}
+    with metrics.stage('hash_tables'):
+        modes = {}
+        for mode, filename in mode_tables.items():
+            previous = old_modes.get(mode)
+            if previous is not None and previous['path'] != filename:
+                previous = None
+            modes[mode], appended_from = hash_table(filename, previous)
+            modes[mode]['path'] = filename
+            if appended_from is not None:
+                appended_modes[mode] = appended_from
+        crossnets = {}
+        for table in crossnet_tables:
+            name = get_crossnet_name(table['src'], table['dst'], table.get('prefix', 'miner'))
+            previous = old_crossnets.get(name)
+            if previous is not None and previous['path'] != table['path']:
+                previous = None
+            crossnets[name], appended_from = hash_table(table['path'], previous)
+            crossnets[name].update(table)
+            if appended_from is not None:
+                appended_crossnets[name] = appended_from
+
+    changed_modes = set(mode for mode in modes if mode not in appended_modes and
+                        (mode not in old_modes or old_modes[mode]['sha1'] != modes[mode]['sha1']))
+    deleted_crossnets = set()
+    for mode in old_modes:
+        if mode in changed_modes or mode not in modes:
+            # Deleting a mode also deletes the crossnets attached to it.
+            Graph.DelModeNet(mode)
+            deleted_crossnets.update(name for name, table in old_crossnets.items()
+                                     if mode in (table['src'], table['dst']))
+    changed_crossnets = set()
+    for name, table in crossnets.items():
+        if table['src'] in changed_modes or table['dst'] in changed_modes:
+            changed_crossnets.add(name)
+        elif name not in appended_crossnets and (name not in old_crossnets or old_crossnets[name]['sha1'] != table['sha1']):
+            changed_crossnets.add(name)
+    for name in old_crossnets:
+        if name not in deleted_crossnets and (name in changed_crossnets or name not in crossnets):
+            Graph.DelCrossNet(name)
+
+    appended_crossnets = dict((name, offset) for name, offset in appended_crossnets.items()
+                              if name not in changed_crossnets)
+    if use_cache:
+        cache_tables(dict((mode, modes[mode]['path']) for mode in changed_modes),
+                     [crossnets[name] for name in changed_crossnets], num_workers, metrics)
+    for mode in sorted(changed_modes):
+        load_mode_to_graph(mode, modes[mode]['path'], Graph, context, metrics, use_cache)
+    with metrics.stage('add_appended_rows'):
+        for mode in sorted(appended_modes):
+            ModeNet = Graph.GetModeNetByName(mode)
+            for row in read_appended_rows(modes[mode]['path'], appended_modes[mode]):
+                if not ModeNet.IsNode(int(row[0])):
+                    ModeNet.AddNode(int(row[0]))
+                metrics.add('mode_rows_appended', 1)
+    for name in sorted(changed_crossnets):
+        table = crossnets[name]
+        load_crossnet_to_graph(context, table['edge_id'], table['src'], table['dst'], table['path'],
+                               Graph, table.get('prefix', 'miner'), metrics, use_cache)
+    with metrics.stage('add_appended_rows'):
+        for name in sorted(appended_crossnets):
+            CrossNet = Graph.GetCrossNetByName(name)
+            for row in read_appended_rows(crossnets[name]['path'], appended_crossnets[name]):
+                CrossNet.AddEdge(int(row[2]), int(row[3]), int(row[0]))
+                metrics.add('crossnet_rows_appended', 1)
+
+    # The dataset ids of every table, from its ledger, to report the datasets an update added.
+    appended_tables = {}
+    for entries, old_entries, appended in ((modes, old_modes, appended_modes),
+                                           (crossnets, old_crossnets, appended_crossnets)):
+        for name, entry in entries.items():
+            entry['dataset_ids'] = utils.get_ledger(entry['path'])['dataset_ids']
+            if name in appended:
+                appended_tables[name] = sorted(set(entry['dataset_ids']) -
+                                               set(old_entries[name].get('dataset_ids', [])))
+    metrics.set('appended_tables', appended_tables)
+
+    with metrics.stage('save_graph'):
+        FOut = snap.TFOut(graph_file)
+        Graph.Save(FOut)
+        FOut.Flush()
+        # TFOut only closes the file when it is destroyed.
+        del FOut
+        write_build_manifest(graph_file, {'modes': modes, 'crossnets': crossnets,
+                                          'graph': get_table_hash(graph_file)})
+    with metrics.stage('write_catalog'):
+        write_catalog(get_catalog_file_name(graph_file), build_catalog(mode_tables, crossnet_tables))
+    metrics.add('modes_reloaded', len(changed_modes))
+    metrics.add('crossnets_reloaded', len(changed_crossnets))
+    metrics.finish()
+    return Graph, sorted(changed_modes) + sorted(changed_crossnets)
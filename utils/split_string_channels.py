@@ -0,0 +1,186 @@
+'''
+file: split_string_channels.py
+
+Script that splits a STRING detailed links file (e.g. protein.links.detailed.v10.txt) into one file
+per evidence channel (neighborhood, fusion, cooccurence, coexpression, experimental, database,
+textmining, combined_score), each with the links that have a non-zero score in that channel.
+
+The links file is streamed once and every row is written to the outputs of all its non-zero
+channels at the same time, so the full table is never held in memory and the cost does not grow
+with the number of channels. Output rows are buffered in memory and appended to their files in
+bulk, which keeps the number of open files at one even when there are thousands of outputs.
+
+Output formats:
+table                    output_dir/<channel>.tsv, with all the columns of the input, tab separated.
+crossnet                 output_dir/<channel>-<species>.tsv, with the columns protein1, protein2 and the
+                         channel score, one file per channel and species (the taxonomy id prefix of
+                         protein1). These are input files of create_mambo_crossnet_table.py, with the
+                         dataset specific mode table of the species as src and dst file, and can be
+                         built with ingest_crossnets.py --preset string.
+
+Usage:
+python split_string_channels.py <links_file> <output_dir>
+
+Positional Arguments:
+links_file:              Path to the STRING detailed links file, optionally gzip compressed as downloaded. It is
+                         space separated, with a header line naming the columns; the first two are protein1 and
+                         protein2.
+output_dir:              Directory to which the channel files are written.
+
+Optional arguments:
+--channels               Channels to extract. Defaults to all score columns of the links file.
+--output_format          table or crossnet. Defaults to table.
+--buffer_lines           Number of output rows buffered in memory before they are written. Defaults to 1M.
+--metrics_file           Append the row counters of the split to this file as a JSON line.
+--progress               Flag; Periodically print the number of lines processed and lines per second to stderr.
+
+Example usage:
+python split_string_channels.py datasets/protein_example/string/protein.links.detailed.v10.txt datasets/protein_example/string/channels --output_format crossnet
+'''
+
+import argparse
+import compression
+import os
+import sys
+from metrics import BuildMetrics
+
+BLOCK_SIZE = 1 << 24
+BUFFER_LINES = 1 << 20
+DELIMITER = ' '
+OUTPUT_FORMATS = ['table', 'crossnet']
+
+
+def get_channel_file_name(output_dir, channel, species=None):
+    if species is None:
+        return os.path.join(output_dir, '%s.tsv' % channel)
+    return os.path.join(output_dir, '%s-%s.tsv' % (channel, species))
+
+
+class _OutputBuffers(object):
+    '''Rows waiting to be written, per output file. Each file is truncated and given its header
+    the first time it is written to, and appended to afterwards.'''
+
+    def __init__(self, buffer_lines):
+        self.buffer_lines = buffer_lines
+        self.buffers = {}
+        self.headers = {}
+        self.num_buffered = 0
+        self.started = set()
+
+    def get(self, path, header):
+        buf = self.buffers.get(path)
+        if buf is None:
+            buf = self.buffers[path] = []
+            self.headers[path] = header
+        return buf
+
+    def flush(self):
+        for path, buf in self.buffers.items():
+            if not buf:
+                continue
+            if path in self.started:
+                mode = 'a'
+            else:
+                mode = 'w'
+                self.started.add(path)
+                buf.insert(0, self.headers[path])
+            with open(path, mode) as outF:
+                outF.writelines(buf)
+            del buf[:]
+        self.num_buffered = 0
+
+    def output_files(self):
+        return sorted(self.started)
+
+
+def split_string_channels(links_file, output_dir, channels=None, output_format='table',
+                          buffer_lines=BUFFER_LINES, block_size=BLOCK_SIZE, metrics=None):
+    '''Splits a STRING detailed links file by channel in one pass; see the file header.
+
+    Input:
+        channels: list of channel (column) names, or None for every score column.
+        output_format: 'table' or 'crossnet'.
+        buffer_lines: number of output rows buffered before they are written.
+    Output:
+        a dictionary from channel to the number of rows written for it.
+    '''
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError('Unknown output format: %s' % output_format)
+    if metrics is None:
+        metrics = BuildMetrics()
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    buffers = _OutputBuffers(buffer_lines)
+    num_read = 0
+    with metrics.stage('split'), compression.open_file(links_file) as inF:
+        columns = inF.readline().split()
+        if channels is None:
+            channels = columns[2:]
+        for channel in channels:
+            if channel not in columns[2:]:
+                raise ValueError('Unknown channel: %s (channels in %s: %s)' % (
+                    channel, links_file, ', '.join(columns[2:])))
+        channel_indices = [(channel, columns.index(channel)) for channel in channels]
+        channel_rows = dict((channel, 0) for channel in channels)
+        table_header = '# %s\n' % '\t'.join(columns)
+        crossnet_headers = dict((channel, '# %s\t%s\t%s\n' % (columns[0], columns[1], channel))
+                                for channel in channels)
+        # (channel, species) -> buffer, so that the common case is one dictionary lookup.
+        crossnet_buffers = {}
+
+        while True:
+            lines = inF.readlines(block_size)
+            if not lines:
+                break
+            for line in lines:
+                vals = line.split()
+                if len(vals) < len(columns):
+                    continue
+                num_read += 1
+                row = None
+                for channel, index in channel_indices:
+                    score = vals[index]
+                    if score == '0':
+                        continue
+                    channel_rows[channel] += 1
+                    if output_format == 'table':
+                        if row is None:
+                            row = '\t'.join(vals) + '\n'
+                        buffers.get(get_channel_file_name(output_dir, channel), table_header).append(row)
+                    else:
+                        species = vals[0].partition('.')[0]
+                        buf = crossnet_buffers.get((channel, species))
+                        if buf is None:
+                            buf = crossnet_buffers[(channel, species)] = buffers.get(
+                                get_channel_file_name(output_dir, channel, species), crossnet_headers[channel])
+                        buf.append('%s\t%s\t%s\n' % (vals[0], vals[1], score))
+                    buffers.num_buffered += 1
+                if buffers.num_buffered >= buffer_lines:
+                    buffers.flush()
+            metrics.progress(num_read)
+        buffers.flush()
+
+    metrics.add('rows_read', num_read)
+    metrics.add('rows_written', sum(channel_rows.values()))
+    metrics.set('channel_rows', channel_rows)
+    metrics.set('output_files', buffers.output_files())
+    metrics.finish()
+    return channel_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Split a STRING detailed links file into one file per channel')
+    parser.add_argument('links_file', help='STRING detailed links file, e.g. protein.links.detailed.v10.txt')
+    parser.add_argument('output_dir', help='directory to which the channel files are written')
+    parser.add_argument('--channels', nargs='+', help='channels to extract; defaults to all', default=None)
+    parser.add_argument('--output_format', choices=OUTPUT_FORMATS, default='table')
+    parser.add_argument('--buffer_lines', type=int, help='output rows buffered before writing', default=BUFFER_LINES)
+    parser.add_argument('--metrics_file', help='file to append the metrics to as a JSON line', default=None)
+    parser.add_argument('--progress', action='store_true', help='print progress to stderr')
+    args = parser.parse_args()
+
+    metrics = BuildMetrics(os.path.basename(args.links_file), metrics_file=args.metrics_file,
+                           progress_stream=sys.stderr if args.progress else None)
+    split_string_channels(args.links_file, args.output_dir, args.channels, args.output_format,
+                          args.buffer_lines, metrics=metrics)
@@ -0,0 +1,33 @@
+'''
+file: test_benchmark_builders.py
+
+Smoke test of the builder benchmarks (see benchmark_builders.py). Like the builders, it requires
+Python 2, and is skipped under Python 3.
+
+Usage:
+python -m unittest test_benchmark_builders
+'''
+
+import sys
+import unittest
+
+
+@unittest.skipIf(sys.version_info[0] >= 3, 'the builders require Python 2')
+class BenchmarkBuildersTest(unittest.TestCase):
+
+    def test_run_benchmarks(self):
+        import benchmark_builders
+        results = benchmark_builders.run_benchmarks([200])
+        self.assertEqual([result['benchmark'] for result in results], benchmark_builders.BENCHMARKS)
+        for result in results:
+            self.assertTrue(set(['benchmark', 'rows', 'num_attrs', 'dup_ratio', 'distinct_nodes', 'rows_per_sec',
+                                 'seconds', 'peak_rss_bytes', 'output_bytes', 'stages', 'counters']) <= set(result))
+            self.assertEqual(result['rows'], 200)
+            self.assertTrue(result['output_bytes'] > 0)
+        counters = dict((result['benchmark'], result['counters']) for result in results)
+        self.assertEqual(counters['crossnet']['rows_read'], 200)
+        self.assertEqual(counters['crossnet'], counters['crossnet_streaming'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+'''
+file: test_columnar_table.py
+
+Tests for the binary columnar tables (see columnar_table.py).
+
+Usage:
+python -m unittest test_columnar_table
+'''
+
+import os
+import unittest
+
+import columnar_table
+from testing import TableTestCase
+
+
+class UpdateColumnarTableTest(TableTestCase):
+
+    def setUp(self):
+        super(UpdateColumnarTableTest, self).setUp()
+        self.tsv_file = self.write_table('miner-node-full.tsv', ['mambo_nid', 'dataset_id'], [])
+
+    def append(self, ids, db_id):
+        '''Appends rows to the tsv table; returns its size before the append.'''
+        size = os.path.getsize(self.tsv_file)
+        with open(self.tsv_file, 'a') as outF:
+            outF.writelines('%d\t%d\n' % (mambo_nid, db_id) for mambo_nid in ids)
+        return size
+
+    def read_ids(self):
+        table = columnar_table.load_columnar_table(columnar_table.get_columnar_dir_name(self.tsv_file))
+        try:
+            return table['mambo_nid'].tolist()
+        finally:
+            table.close()
+
+    def test_append(self):
+        columnar_table.update_columnar_table(self.tsv_file, columnar_table.FULL_MODE_SCHEMA,
+                                             self.append(range(3), 0))
+        columnar_table.update_columnar_table(self.tsv_file, columnar_table.FULL_MODE_SCHEMA,
+                                             self.append(range(3, 5), 1))
+        self.assertEqual(self.read_ids(), list(range(5)))
+
+    def test_rebuild_after_unmirrored_append(self):
+        columnar_table.update_columnar_table(self.tsv_file, columnar_table.FULL_MODE_SCHEMA,
+                                             self.append(range(3), 0))
+        self.append(range(3, 5), 1)
+        columnar_table.update_columnar_table(self.tsv_file, columnar_table.FULL_MODE_SCHEMA,
+                                             self.append(range(5, 6), 2))
+        self.assertEqual(self.read_ids(), list(range(6)))
+
+    def test_append_after_interrupted_append(self):
+        columnar_table.update_columnar_table(self.tsv_file, columnar_table.FULL_MODE_SCHEMA,
+                                             self.append(range(3), 0))
+        # An append that died before rewriting schema.json leaves orphan rows behind.
+        cols_dir = columnar_table.get_columnar_dir_name(self.tsv_file)
+        with open(os.path.join(cols_dir, 'mambo_nid.i64'), 'ab') as outF:
+            outF.write(b'\x07' * 12)
+        columnar_table.update_columnar_table(self.tsv_file, columnar_table.FULL_MODE_SCHEMA,
+                                             self.append(range(3, 5), 1))
+        self.assertEqual(self.read_ids(), list(range(5)))
+        self.assertEqual(os.path.getsize(os.path.join(cols_dir, 'dataset_id.i64')), 5 * 8)
+
+    def test_truncate_string_columns(self):
+        path = os.path.join(self.tmp_dir, 'mapped.cols')
+        schema = columnar_table.MAPPED_FULL_MODE_SCHEMA
+        with columnar_table.ColumnarTableWriter(path, schema) as writer:
+            writer.write_rows([(0, '1,2'), (1, '3')])
+        writer = columnar_table.ColumnarTableWriter(path, schema, append=True)
+        writer.write_rows([(2, 'orphan')])
+        for col_file, heap_file in writer.files:
+            col_file.close()
+            if heap_file is not None:
+                heap_file.close()
+        with columnar_table.ColumnarTableWriter(path, schema, append=True) as writer:
+            writer.write_rows([(2, '4')])
+        table = columnar_table.load_columnar_table(path)
+        try:
+            self.assertEqual(list(table['dataset_ids']), ['1,2', '3', '4'])
+        finally:
+            table.close()
+        self.assertEqual(os.path.getsize(os.path.join(path, 'dataset_ids.heap')), 5)
+
+    def test_rebuild_after_lost_rows(self):
+        columnar_table.update_columnar_table(self.tsv_file, columnar_table.FULL_MODE_SCHEMA,
+                                             self.append(range(3), 0))
+        cols_dir = columnar_table.get_columnar_dir_name(self.tsv_file)
+        with open(os.path.join(cols_dir, 'mambo_nid.i64'), 'r+b') as outF:
+            outF.truncate(8)
+        columnar_table.update_columnar_table(self.tsv_file, columnar_table.FULL_MODE_SCHEMA,
+                                             self.append(range(3, 5), 1))
+        self.assertEqual(self.read_ids(), list(range(5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+'''
+file: test_compression.py
+
+Tests for reading and writing compressed tables (see compression.py).
+
+Usage:
+python -m unittest test_compression
+'''
+
+import os
+import unittest
+
+import compression
+from testing import TableTestCase
+
+FIRST = ['# header\n', '0\t1\n', '1\t1\n']
+SECOND = ['2\t2\n', '3\t2\n']
+
+
+class OpenFileTest(TableTestCase):
+
+    def setUp(self):
+        super(OpenFileTest, self).setUp()
+        path = os.environ.get('PATH', '')
+        self.addCleanup(os.environ.__setitem__, 'PATH', path)
+
+    def check_appends(self, name):
+        '''Writes a table in two parts and checks it can be read whole and from the size it had
+        after the first part.'''
+        path = os.path.join(self.tmp_dir, name)
+        with compression.open_file(path, 'w') as outF:
+            outF.writelines(FIRST)
+        size = os.path.getsize(path)
+        with compression.open_file(path, 'r', size) as inF:
+            self.assertEqual(list(inF), [])
+        with compression.open_file(path, 'a') as outF:
+            outF.writelines(SECOND)
+        with compression.open_file(path) as inF:
+            self.assertEqual(list(inF), FIRST + SECOND)
+        with compression.open_file(path, 'r', size) as inF:
+            self.assertEqual(list(inF), SECOND)
+        with compression.open_file(path, 'rb', size) as inF:
+            self.assertEqual(list(inF), [line.encode('ascii') for line in SECOND])
+        # Closing a reader before the end of its input is not an error.
+        with compression.open_file(path) as inF:
+            self.assertEqual(inF.readline(), FIRST[0])
+        return path
+
+    def test_plain(self):
+        self.check_appends('table.tsv')
+
+    def test_gzip(self):
+        path = self.check_appends('table.tsv.gz')
+        self.assertEqual(compression.get_compression(path), compression.GZIP)
+        self.assertEqual(compression.strip_compression_suffix(path), os.path.join(self.tmp_dir, 'table.tsv'))
+
+    def test_gzip_module(self):
+        # Without pigz and gzip on the PATH, the gzip module is used.
+        os.environ['PATH'] = ''
+        self.check_appends('table.tsv.gz')
+
+    @unittest.skipIf(compression.zstandard is None and compression.find_executable('zstd') is None,
+                     'requires the zstandard module or the zstd command')
+    def test_zstd(self):
+        self.check_appends('table.tsv.zst')
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            compression.open_file(os.path.join(self.tmp_dir, 'table.tsv.gz'), 'x')
+
+
+if __name__ == '__main__':
+    unittest.main()
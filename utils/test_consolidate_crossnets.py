@@ -0,0 +1,58 @@
+'''
+file: test_consolidate_crossnets.py
+
+Tests for the consolidation of duplicate crossnet edges (see consolidate_crossnets.py).
+
+Usage:
+python -m unittest test_consolidate_crossnets
+'''
+
+import json
+import os
+import unittest
+
+import compression
+import consolidate_crossnets
+from testing import TableTestCase
+
+CROSSNET_HEADER = ['mambo_eid', 'dataset_id', 'src_mambo_nid', 'dst_mambo_nid']
+# Rows of two gene-gene tables; edge 0 - 1 is reported by both, the second time reversed.
+TABLES = [
+    [(0, 5, 0, 1), (1, 5, 1, 2), (2, 7, 1, 2)],
+    [(0, 3, 1, 0), (1, 3, 2, 3)],
+]
+
+
+class ConsolidateCrossnetsTest(TableTestCase):
+
+    def setUp(self):
+        super(ConsolidateCrossnetsTest, self).setUp()
+        self.input_files = [self.write_table('miner-gene-gene-%d.tsv' % i, CROSSNET_HEADER, rows)
+                            for i, rows in enumerate(TABLES)]
+        self.output_file = os.path.join(self.tmp_dir, 'miner-gene-gene-consolidated.tsv')
+
+    def read_rows(self, path):
+        with compression.open_file(path) as inF:
+            return [line.rstrip('\n').split('\t') for line in inF if line[0] != '#']
+
+    def test_directed(self):
+        sources = consolidate_crossnets.consolidate_crossnets(self.input_files, self.output_file)
+        self.assertEqual(sources, [(self.input_files[0], 5), (self.input_files[0], 7), (self.input_files[1], 3)])
+        # dataset_id is the dataset id of the lowest contributing source, not its index.
+        self.assertEqual(self.read_rows(self.output_file),
+                         [['0', '5', '0', '1'], ['1', '5', '1', '2'], ['2', '3', '1', '0'], ['3', '3', '2', '3']])
+        provenance = self.read_rows(consolidate_crossnets.get_provenance_file_name(self.output_file))
+        self.assertEqual(provenance[1], ['1', '3', '0:1,1:2'])
+        with open(consolidate_crossnets.get_sources_file_name(self.output_file)) as inF:
+            self.assertEqual(json.load(inF)[2], {'table': self.input_files[1], 'dataset_id': 3})
+
+    def test_undirected(self):
+        consolidate_crossnets.consolidate_crossnets(self.input_files, self.output_file, undirected=True)
+        self.assertEqual(self.read_rows(self.output_file),
+                         [['0', '5', '0', '1'], ['1', '5', '1', '2'], ['2', '3', '2', '3']])
+        provenance = self.read_rows(consolidate_crossnets.get_provenance_file_name(self.output_file))
+        self.assertEqual(provenance[0], ['0', '5', '0:0,2:0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
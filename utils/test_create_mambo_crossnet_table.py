@@ -0,0 +1,136 @@
+'''
+file: test_create_mambo_crossnet_table.py
+
+Tests for the crossnet table builder (see create_mambo_crossnet_table.py). Like the builder, they
+require Python 2, and are skipped under Python 3.
+
+Usage:
+python -m unittest test_create_mambo_crossnet_table
+'''
+
+import os
+import sys
+import unittest
+
+import utils
+from testing import TableTestCase
+
+GENES = [(0, 'G0'), (1, 'G1'), (2, 'G2')]
+# Input links; G9 is not in the mode table.
+LINKS = [('G0', 'G1', 0.5), ('G1', 'G2', 0.1), ('G9', 'G0', 0.2), ('G2', 'G0', 0.7)]
+
+
+@unittest.skipIf(sys.version_info[0] >= 3, 'the builder requires Python 2')
+class CrossnetBuilderTest(TableTestCase):
+
+    def setUp(self):
+        super(CrossnetBuilderTest, self).setUp()
+        self.mode_file = self.write_table('miner-gene-0-ICGC-20160520.tsv', ['mambo_nid', 'dataset_nid'], GENES)
+        self.input_file = self.write_table('links.tsv', None, LINKS)
+
+    def build(self, name, db_id, input_files=None, parallel=False, skip_missing_ids=True, **kwargs):
+        import create_mambo_crossnet_table
+        out_dir = os.path.join(self.tmp_dir, name)
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        full_file = os.path.join(out_dir, 'miner-gene-gene.tsv')
+        db_file = os.path.join(out_dir, 'miner-gene-gene-%d-LINKS.tsv' % db_id)
+        if parallel:
+            build = create_mambo_crossnet_table.create_mambo_crossnet_table_parallel
+        else:
+            build = create_mambo_crossnet_table.create_mambo_crossnet_table
+        build(input_files or self.input_file, self.mode_file, self.mode_file, 'LINKS', db_id, 0, 1, None, None,
+              out_dir, full_file, db_file, None, None, -1, skip_missing_ids, **kwargs)
+        return full_file, db_file
+
+    def read(self, path):
+        with open(path) as inF:
+            return [line for line in inF if not line.startswith('# File generated on')]
+
+    def test_streaming_matches_line_by_line(self):
+        for db_id in (0, 1):
+            line_files = self.build('line', db_id)
+            streaming_files = self.build('streaming', db_id, streaming=True, block_size=16)
+            for line_file, streaming_file in zip(line_files, streaming_files):
+                self.assertEqual(self.read(line_file), self.read(streaming_file))
+        rows = [line.split() for line in self.read(line_files[0]) if line[0] != '#']
+        self.assertEqual(rows[:3], [['0', '0', '0', '1'], ['1', '0', '1', '2'], ['2', '0', '2', '0']])
+        self.assertEqual(len(rows), 6)
+
+    def test_streaming_strips_fields(self):
+        # Fields with surrounding whitespace, a line without attributes, an empty id and a trailing
+        # empty attribute; the second input has only the line end to strip.
+        inputs = [['G0 \t G1\t0.5 \r\n', 'G1\tG2\n', '\tG0\t0.3\n', 'G2\tG0\t0.7\t\n'],
+                  ['G0\tG1\t0.5\n', 'G1\tG2\n', '\tG0\t0.3\n', 'G2\tG0\t0.7\t\n', 'G1\tG0\t0.2']]
+        for num, lines in enumerate(inputs):
+            input_file = os.path.join(self.tmp_dir, 'links-%d.tsv' % num)
+            with open(input_file, 'w') as outF:
+                outF.writelines(lines)
+            line_files = self.build('line-%d' % num, 0, input_file)
+            streaming_files = self.build('streaming-%d' % num, 0, input_file, streaming=True)
+            for line_file, streaming_file in zip(line_files, streaming_files):
+                self.assertEqual(self.read(line_file), self.read(streaming_file))
+        rows = [line.rstrip('\n').split('\t') for line in self.read(streaming_files[1]) if line[0] != '#']
+        self.assertEqual(rows, [['0', '0', '0', '0.5'], ['1', '0', '0'], ['2', '0', '0', '0.7', ''],
+                                ['3', '0', '0', '0.2']])
+        with self.assertRaises(KeyError):
+            self.build('streaming-missing', 0, streaming=True, skip_missing_ids=False)
+
+    def test_stage_timings(self):
+        from metrics import BuildMetrics
+        input_file = self.write_table('links-all.tsv', None, [('G%d' % (i % 3), 'G0', i) for i in range(200)])
+        for streaming, stages in ((False, ['process']), (True, ['read'])):
+            metrics = BuildMetrics()
+            self.build('streaming' if streaming else 'line', 0, input_file, streaming=streaming, metrics=metrics)
+            # The line-by-line mode estimates the stages of its lines from every 64th line.
+            self.assertTrue(set(stages + ['split', 'filter', 'convert', 'write']) <= set(metrics.stages))
+            self.assertEqual((metrics.counters['rows_read'], metrics.counters['rows_written']), (200, 200))
+
+    def test_ledger_matches_scan(self):
+        for db_id in (0, 1):
+            full_file, _ = self.build('streaming', db_id, streaming=True)
+            self.assertEqual(utils.read_ledger(full_file), utils.scan_table(full_file))
+        self.assertEqual(utils.read_ledger(full_file)['dataset_ids'], [0, 1])
+        # A stale ledger is rebuilt from the table.
+        os.remove(utils.get_ledger_file_name(full_file))
+        full_file, _ = self.build('streaming', 2)
+        self.assertEqual(utils.read_ledger(full_file), utils.scan_table(full_file))
+        self.assertEqual(utils.read_ledger(full_file)['next_id'], 9)
+
+    def test_parallel_matches_serial(self):
+        links = [('G%d' % (i % 3), 'G%d' % (i * 7 % 4), i) for i in range(40)]
+        input_files = [self.write_table('links-0.tsv', None, links[:25]),
+                       self.write_table('links-1.tsv', None, links[25:])]
+        serial_input = self.write_table('links-all.tsv', None, links)
+        for db_id in (0, 1):
+            serial_files = self.build('serial', db_id, serial_input)
+            # A tiny block size splits the input into many shards.
+            parallel_files = self.build('parallel', db_id, input_files, parallel=True, num_workers=2, block_size=64)
+            for serial_file, parallel_file in zip(serial_files, parallel_files):
+                self.assertEqual(self.read(serial_file), self.read(parallel_file))
+        self.assertEqual(utils.read_ledger(parallel_files[0]), utils.scan_table(parallel_files[0]))
+        self.assertEqual(utils.read_ledger(parallel_files[0])['next_id'], 60)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmp_dir, 'parallel'))),
+                         sorted(os.listdir(os.path.join(self.tmp_dir, 'serial'))))
+
+    def test_split_input_files(self):
+        from create_mambo_crossnet_table import split_input_files
+        input_file = self.write_table('links-all.tsv', None, [('G%d' % i, 'G0', i) for i in range(100)])
+        shards = split_input_files([input_file], 8, 1)
+        self.assertTrue(len(shards) > 1)
+        self.assertEqual(shards[0][1], 0)
+        self.assertEqual(shards[-1][2], os.path.getsize(input_file))
+        with open(input_file, 'rb') as inF:
+            data = inF.read()
+        for (_, _, end), (_, start, _) in zip(shards, shards[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(data[end - 1:end], b'\n')
+
+    def test_parallel_missing_id(self):
+        with self.assertRaises(KeyError):
+            self.build('parallel', 0, parallel=True, skip_missing_ids=False, num_workers=2)
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'parallel')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
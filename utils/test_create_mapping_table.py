@@ -0,0 +1,84 @@
+'''
+file: test_create_mapping_table.py
+
+Tests for the mapping table builder (see create_mapping_table.py). The comparisons of its
+array-backed and dictionary versions require NumPy and Python 3, under which both write their
+rows in the same order.
+
+Usage:
+python -m unittest test_create_mapping_table
+'''
+
+import os
+import sys
+import unittest
+
+import create_mapping_table
+from create_mapping_table import create_mapping_table_arrays, create_mapping_table_dicts
+from testing import TableTestCase
+
+BUILDS = [create_mapping_table_dicts]
+if create_mapping_table.np is not None:
+    BUILDS.append(create_mapping_table_arrays)
+
+
+def read_rows(path):
+    with open(path) as inF:
+        return [line.rstrip('\n').split('\t') for line in inF]
+
+
+class MappingTableTest(TableTestCase):
+
+    def build(self, build, name, steps):
+        '''Adds each (rows, output_index2, title) mapping of steps to the table self.tmp_dir/name
+        with build; returns the path of the table and its rows after each step.'''
+        output_file = os.path.join(self.tmp_dir, name, 'mapping.tsv')
+        tables = []
+        for num, (rows, output_index2, title) in enumerate(steps):
+            mapping_file = self.write_table(os.path.join(name, 'mapping-%d.tsv' % num), ['name', title], rows)
+            build(mapping_file, 0, 1, output_file, 0, output_index2, 'name', title)
+            tables.append(read_rows(output_file)[1:])
+        return output_file, tables
+
+    def test_none_placeholders(self):
+        steps = [([('a', 'A'), ('b', 'B'), ('NULL', 'X')], 1, 'upper'),
+                 ([('c', '3'), ('a', '1'), ('a', '11')], 2, 'number')]
+        for build in BUILDS:
+            _, tables = self.build(build, build.__name__, steps)
+            # A new name gets None for the columns of the earlier mappings, and a name missing from
+            # the new mapping gets None for its column.
+            self.assertEqual(sorted(tables[-1]), [['0', 'a', 'A', '11'],
+                                                  ['1', 'b', 'B', 'None'],
+                                                  ['2', 'c', 'None', '3']])
+
+    def test_uid_stability(self):
+        steps = [([('n%d' % i, 'f%d' % i) for i in range(30)], 1, 'first'),
+                 ([('n%d' % (i * 7 % 45), 's%d' % i) for i in range(30)], 2, 'second'),
+                 ([('n%d' % i, 't%d' % i) for i in range(50, 40, -1)], 3, 'third')]
+        for build in BUILDS:
+            _, tables = self.build(build, build.__name__, steps)
+            uids = [dict((row[1], int(row[0])) for row in rows) for rows in tables]
+            self.assertEqual([len(step_uids) for step_uids in uids], [30, 38, 46])
+            for before, after in zip(uids, uids[1:]):
+                self.assertEqual(sorted(after.values()), list(range(len(after))))
+                # Names keep their uids, and new names get the uids after those of earlier names.
+                for node, uid in after.items():
+                    self.assertEqual(uid, before[node] if node in before else max(uid, len(before)))
+            if build is not create_mapping_table_dicts:
+                # New names get uids in order of first appearance.
+                self.assertEqual(uids[0], dict(('n%d' % i, i) for i in range(30)))
+                self.assertEqual([uids[2]['n%d' % i] for i in range(50, 43, -1)], list(range(38, 45)))
+
+    @unittest.skipIf(create_mapping_table.np is None or sys.version_info[0] < 3,
+                     'requires NumPy and the insertion-ordered dictionaries of Python 3')
+    def test_arrays_match_dicts(self):
+        steps = [([('n%d' % (i * 13 % 40), 'f%d' % i) for i in range(60)], 1, 'first'),
+                 ([('n%d' % (i * 7 % 55), 's%d' % i) for i in range(40)] + [('NULL', 's99')], 2, 'second'),
+                 ([('n%d' % (i * 3 % 70), 't%d' % i) for i in range(20)], 1, 'third')]
+        tables = [self.build(build, build.__name__, steps)[0] for build in BUILDS]
+        with open(tables[0]) as dicts, open(tables[1]) as arrays:
+            self.assertEqual(dicts.read(), arrays.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+'''
+file: test_csr_adjacency.py
+
+Tests for the CSR exports of crossnets (see csr_adjacency.py).
+
+Usage:
+python -m unittest test_csr_adjacency
+'''
+
+import os
+import unittest
+
+import csr_adjacency
+import utils
+from testing import TableTestCase
+
+# (src, dst) edges of a chemical-gene crossnet.
+EDGES = [(1, 0), (0, 2), (1, 2)]
+
+
+class CSRAdjacencyTest(TableTestCase):
+
+    def setUp(self):
+        super(CSRAdjacencyTest, self).setUp()
+        self.crossnet_file = self.write_table('miner-chemical-gene.tsv',
+                                              ['mambo_eid', 'dataset_id', 'src_mambo_nid', 'dst_mambo_nid'],
+                                              [(eid, 0) + edge for eid, edge in enumerate(EDGES)])
+        self.catalog = {'modes': {'chemical': {'max_id': 1}, 'gene': {'max_id': 2}},
+                        'crossnets': {'chemical-gene': {'path': self.crossnet_file, 'src': 'chemical',
+                                                        'dst': 'gene', 'num_edges': len(EDGES)}}}
+
+    def test_export(self):
+        csr = csr_adjacency.load_csr(csr_adjacency.export_crossnet_csr(self.catalog, 'chemical-gene', self.tmp_dir))
+        self.assertEqual(csr.neighbors(1).tolist(), [0, 2])
+        self.assertEqual(csr.edge_ids(2, 'in').tolist(), [1, 2])
+        self.assertEqual(csr.degrees('in').tolist(), [1, 0, 2])
+
+    def test_crossnet_stamp(self):
+        stamp = csr_adjacency.get_crossnet_stamp(self.catalog, 'chemical-gene')
+        self.assertEqual(stamp['num_nodes'], {'chemical': 2, 'gene': 3})
+        # A current ledger is read, not rewritten.
+        ledger_file = utils.get_ledger_file_name(self.crossnet_file)
+        os.utime(ledger_file, (0, 0))
+        self.assertEqual(csr_adjacency.get_crossnet_stamp(self.catalog, 'chemical-gene'), stamp)
+        self.assertEqual(os.path.getmtime(ledger_file), 0)
+        with open(self.crossnet_file, 'a') as outF:
+            outF.write('3\t1\t0\t0\n')
+        self.assertNotEqual(csr_adjacency.get_crossnet_stamp(self.catalog, 'chemical-gene'), stamp)
+
+    def test_stale_catalog(self):
+        self.catalog['modes']['gene']['max_id'] = 1
+        with self.assertRaises(ValueError):
+            csr_adjacency.export_crossnet_csr(self.catalog, 'chemical-gene', self.tmp_dir)
+        with self.assertRaises(ValueError):
+            csr_adjacency.export_network_csr(self.catalog, self.tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+'''
+file: test_external_sort.py
+
+Tests for the bounded-memory sort (see external_sort.py) and the bounded-memory modes of the
+mapping and mapped mode builders that use it.
+
+Usage:
+python -m unittest test_external_sort
+'''
+
+import os
+import random
+import sys
+import unittest
+
+import compression
+import external_sort
+from create_mapped_mode_table import create_mapped_mode_table
+from create_mapping_table import create_mapping_table
+from testing import TableTestCase
+
+
+class ExternalSorterTest(TableTestCase):
+
+    def test_sort_is_stable_across_runs(self):
+        rng = random.Random(0)
+        records = [('k%02d' % rng.randrange(20), i) for i in range(500)]
+        with external_sort.ExternalSorter(lambda record: record[0], 1000, self.tmp_dir) as sorter:
+            for record in records:
+                sorter.add(record)
+            self.assertTrue(len(sorter.runs) > 1)
+            self.assertEqual(list(sorter), sorted(records, key=lambda record: record[0]))
+            tmp_dir = sorter.tmp_dir
+        self.assertFalse(os.path.exists(tmp_dir))
+
+    def test_sort_in_memory(self):
+        with external_sort.ExternalSorter(lambda record: record[1], tmp_dir=self.tmp_dir) as sorter:
+            for record in [('b', 2), ('a', 1), ('c', 1)]:
+                sorter.add(record)
+            self.assertEqual(sorter.runs, [])
+            self.assertEqual(list(sorter), [('a', 1), ('c', 1), ('b', 2)])
+
+    def test_group_by_key(self):
+        records = [('a', 1), ('a', 2), ('b', 3), ('a', 4)]
+        self.assertEqual(list(external_sort.group_by_key(records, lambda record: record[0])),
+                         [('a', [('a', 1), ('a', 2)]), ('b', [('b', 3)]), ('a', [('a', 4)])])
+        self.assertEqual(list(external_sort.group_by_key([], lambda record: record[0])), [])
+
+    def test_parse_memory_budget(self):
+        self.assertEqual(external_sort.parse_memory_budget('512M'), 512 << 20)
+        self.assertEqual(external_sort.parse_memory_budget('1.5g'), 3 << 29)
+        self.assertEqual(external_sort.parse_memory_budget('4096'), 4096)
+
+
+def read_rows(path):
+    with compression.open_file(path) as inF:
+        return [line for line in inF if line[0] != '#']
+
+
+class MappedModeMergeJoinTest(TableTestCase):
+
+    def build(self, name, memory_budget):
+        '''Adds three datasets to a new mapped mode; new names are added to the mapping file.'''
+        out = os.path.join(self.tmp_dir, name)
+        mapping_file = self.write_table(os.path.join(name, 'mapping.tsv'), ['mambo_id', 'name'],
+                                        [(i, 'n%d' % i) for i in range(30)])
+        full_mode_file = os.path.join(out, 'miner-node-full.tsv')
+        for db_id in range(3):
+            nodes = [('n%d' % (i * (db_id + 3) % 45),) for i in range(40)]
+            input_file = self.write_table(os.path.join(name, 'input-%d.tsv' % db_id), ['name'], nodes)
+            create_mapped_mode_table('node', input_file, 'D%d' % db_id, db_id, mapping_file, True, 1, 0,
+                                     out, full_mode_file, os.path.join(out, 'db-%d.tsv' % db_id),
+                                     memory_budget=memory_budget, tmp_dir=out)
+        return out
+
+    def test_matches_in_memory_build(self):
+        in_memory = self.build('in_memory', None)
+        external = self.build('external', 500)
+        for name in ['mapping.tsv', 'db-0.tsv', 'db-1.tsv', 'db-2.tsv']:
+            self.assertEqual(read_rows(os.path.join(in_memory, name)), read_rows(os.path.join(external, name)))
+        # The external build writes the full mode table in mambo id order.
+        rows = read_rows(os.path.join(external, 'miner-node-full.tsv'))
+        self.assertEqual(sorted(read_rows(os.path.join(in_memory, 'miner-node-full.tsv'))), sorted(rows))
+        self.assertEqual(rows, sorted(rows, key=lambda row: int(row.split('\t')[0])))
+        self.assertEqual([name for name in os.listdir(external) if name.startswith('mambo-sort-')], [])
+
+
+class MappingMergeJoinTest(TableTestCase):
+
+    def build(self, name, memory_budget):
+        '''Maps names to a first and then a second naming scheme; returns the name -> uid maps
+        and the rows without uids after each step.'''
+        output_file = os.path.join(self.tmp_dir, name, 'mapping.tsv')
+        first = self.write_table(os.path.join(name, 'first.tsv'), ['name', 'first'],
+                                 [('n%d' % i, 'f%d' % i) for i in range(30)])
+        second = self.write_table(os.path.join(name, 'second.tsv'), ['name', 'second'],
+                                  [('n%d' % (i * 7 % 45), 's%d' % i) for i in range(30)] + [('NULL', 's99')])
+        steps = []
+        for mapping_file, output_index2, title in [(first, 1, 'first'), (second, 2, 'second')]:
+            create_mapping_table(mapping_file, 0, 1, output_file, 0, output_index2, 'name', title,
+                                 memory_budget=memory_budget, tmp_dir=self.tmp_dir)
+            rows = [row.rstrip('\n').split('\t') for row in read_rows(output_file)]
+            steps.append((dict((row[1], int(row[0])) for row in rows), sorted(row[1:] for row in rows)))
+        return steps
+
+    def test_matches_in_memory_build(self):
+        in_memory = self.build('in_memory', None)
+        external = self.build('external', 300)
+        for (_, in_memory_rows), (_, external_rows) in zip(in_memory, external):
+            self.assertEqual(in_memory_rows, external_rows)
+        self.assertEqual(len(external[1][1]), 38)
+        for (first_uids, _), (second_uids, _) in (in_memory, external):
+            self.assertEqual(sorted(second_uids.values()), list(range(38)))
+            # Names keep their uids when the second naming scheme is added.
+            for node, uid in first_uids.items():
+                self.assertEqual(second_uids[node], uid)
+        # The external build gives new names uids in order of first appearance.
+        self.assertEqual(external[0][0], dict(('n%d' % i, i) for i in range(30)))
+
+
+if __name__ == '__main__':
+    unittest.main()
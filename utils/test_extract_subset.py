@@ -0,0 +1,92 @@
+'''
+file: test_extract_subset.py
+
+Tests for extracting the links between a set of nodes (see extract_subset.py).
+
+Usage:
+python -m unittest test_extract_subset
+'''
+
+import gzip
+import os
+import unittest
+
+import compression
+import extract_subset
+from testing import TableTestCase
+
+# Source, destination and score of raw STRING style links.
+LINKS = [('9606.P1', '9606.P2', 900), ('9606.P2', '9606.P9', 800), ('9606.P9', '9606.P1', 700),
+         ('9606.P3', '9606.P1', 600)]
+
+
+class ExtractSubsetTest(TableTestCase):
+
+    def setUp(self):
+        super(ExtractSubsetTest, self).setUp()
+        self.ids_file = self.write_table('ids.tsv', None, [('P1',), ('P2',), ('P3',)])
+
+    def read(self, path):
+        with compression.open_file(path) as inF:
+            return inF.readlines()
+
+    def test_filter_lines(self):
+        lines = ['%s\t%s\t%d\n' % link for link in LINKS] + ['9606.P1\n', '\n']
+        kept, num_short = extract_subset.filter_lines(lines, {'9606.P1', '9606.P2'}, {'9606.P2'}, 0, 1, '\t')
+        # P1 -> P2 is kept; P2 -> P9 has an allowed source only.
+        self.assertEqual(kept, lines[:1])
+        self.assertEqual(num_short, 1)
+
+    def test_extract_file(self):
+        input_file = self.write_table('links.tsv', ['protein1', 'protein2', 'score'], LINKS)
+        with open(input_file, 'a') as outF:
+            outF.write('# trailer\n')
+        output_file = os.path.join(self.tmp_dir, 'links-subset.tsv')
+        ids = extract_subset.read_node_ids(self.ids_file)
+        counters = extract_subset.extract_file(input_file, output_file, ids, ids, src_mode_filter='remove_species_id',
+                                               dst_mode_filter='remove_species_id', header_lines=1)
+        # The ids are filtered for the lookup only: the lines are written unchanged.
+        self.assertEqual(self.read(output_file), ['# protein1\tprotein2\tscore\n', '9606.P1\t9606.P2\t900\n',
+                                                  '9606.P3\t9606.P1\t600\n', '# trailer\n'])
+        self.assertEqual(counters, {'rows_read': 5, 'rows_skipped': 1, 'rows_filtered': 2, 'rows_written': 2})
+
+    def test_header_lines_become_comments(self):
+        input_file = self.write_table('links.tsv', None, [('Gene_A', 'Gene_B', 'Weight'), ('P1', 'P2', 1)])
+        output_file = os.path.join(self.tmp_dir, 'links-subset.tsv')
+        ids = extract_subset.read_node_ids(self.ids_file)
+        extract_subset.extract_file(input_file, output_file, ids, ids, header_lines=1)
+        self.assertEqual(self.read(output_file), ['# Gene_A\tGene_B\tWeight\n', 'P1\tP2\t1\n'])
+
+    def test_compressed_output(self):
+        input_dir = os.path.join(self.tmp_dir, 'input')
+        input_file = self.write_table(os.path.join('input', 'links.tsv'), None, LINKS)
+        with open(input_file, 'rb') as inF, gzip.open(input_file + '.gz', 'wb') as outF:
+            outF.write(inF.read())
+        os.remove(input_file)
+        output_dir = os.path.join(self.tmp_dir, 'output')
+        extract_subset.extract_subset(input_dir, output_dir, self.ids_file, src_mode_filter='remove_species_id',
+                                      dst_mode_filter='remove_species_id', num_workers=1)
+        output_file = os.path.join(output_dir, 'links.tsv.gz')
+        with gzip.open(output_file, 'rb') as inF:
+            self.assertEqual(inF.read(), b'9606.P1\t9606.P2\t900\n9606.P3\t9606.P1\t600\n')
+
+    def test_parallel_matches_serial(self):
+        input_dir = os.path.join(self.tmp_dir, 'input')
+        for i in range(3):
+            self.write_table(os.path.join('input', 'Pathway.%d.txt' % i), ['Gene_A', 'Gene_B', 'Weight'],
+                             [('P%d' % (j % 4), 'P%d' % (j * 7 % 5), j) for j in range(30 * i, 30 * i + 40)])
+        self.write_table(os.path.join('input', 'README'), None, [('not', 'links')])
+        outputs = []
+        for num_workers in (1, 2):
+            output_dir = os.path.join(self.tmp_dir, 'output-%d' % num_workers)
+            counters = extract_subset.extract_subset(input_dir, output_dir, self.ids_file, patterns=['Pathway.*'],
+                                                     header_lines=1, num_workers=num_workers, block_size=64)
+            outputs.append((counters, dict((file_name, self.read(os.path.join(output_dir, file_name)))
+                                           for file_name in sorted(os.listdir(output_dir)))))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(sorted(outputs[0][1]), ['Pathway.0.txt', 'Pathway.1.txt', 'Pathway.2.txt'])
+        self.assertTrue(all(counters['rows_written'] > 0 for counters in outputs[0][0].values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
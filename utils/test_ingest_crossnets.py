@@ -0,0 +1,98 @@
+'''
+file: test_ingest_crossnets.py
+
+Tests for the multi-file crossnet ingestion driver (see ingest_crossnets.py). Like the crossnet
+builder, they require Python 2, and are skipped under Python 3.
+
+Usage:
+python -m unittest test_ingest_crossnets
+'''
+
+import os
+import sys
+import unittest
+
+import utils
+from testing import TableTestCase
+
+GENES = [(i, 'G%d' % i) for i in range(6)]
+TYPES = [('Co-expression', 'Co-expression.*.txt'), ('Pathway', 'Pathway.*.txt'), ('Any', '*.txt')]
+
+
+def read_dir(path):
+    '''Returns the contents of the files under path without their date lines, by relative path.'''
+    contents = {}
+    for root, _, file_names in os.walk(path):
+        for file_name in file_names:
+            with open(os.path.join(root, file_name)) as inF:
+                contents[os.path.relpath(os.path.join(root, file_name), path)] = [
+                    line for line in inF if not line.startswith('# File generated on')]
+    return contents
+
+
+@unittest.skipIf(sys.version_info[0] >= 3, 'the crossnet builder requires Python 2')
+class IngestCrossnetsTest(TableTestCase):
+
+    def setUp(self):
+        super(IngestCrossnetsTest, self).setUp()
+        self.mode_file = self.write_table('miner-gene-0-ICGC-20160520.tsv', ['mambo_nid', 'dataset_nid'], GENES)
+        self.input_dir = os.path.join(self.tmp_dir, 'genemania')
+        for i, name in enumerate(['Co-expression.B-2010.txt', 'Co-expression.A-2007.txt', 'Pathway.C-2012.txt',
+                                  'Other.D.txt']):
+            links = [('Gene_A', 'Gene_B', 'Weight')] + [('G%d' % (j % 6), 'G%d' % ((j + i + 1) % 7), j)
+                                                      for j in range(10 * (i + 1))]
+            self.write_table(os.path.join('genemania', name), None, links)
+
+    def ingest(self, name, num_workers):
+        import ingest_crossnets
+        output_dir = os.path.join(self.tmp_dir, name)
+        type_files = ingest_crossnets.ingest_crossnets(self.input_dir, TYPES, self.mode_file, self.mode_file,
+                                                       output_dir, num_workers=num_workers)
+        return output_dir, type_files
+
+    def test_find_type_files(self):
+        import ingest_crossnets
+        type_files = ingest_crossnets.find_type_files(self.input_dir, TYPES)
+        names = dict((type_name, [(os.path.basename(path), db_id, dataset) for path, db_id, dataset in files])
+                     for type_name, files in type_files.items())
+        # Files are assigned to the first matching type, with dataset ids in file name order.
+        self.assertEqual(names, {
+            'Co-expression': [('Co-expression.A-2007.txt', 0, 'A-2007'), ('Co-expression.B-2010.txt', 1, 'B-2010')],
+            'Pathway': [('Pathway.C-2012.txt', 0, 'C-2012')],
+            'Any': [('Other.D.txt', 0, 'Other.D')],
+        })
+        self.assertEqual(ingest_crossnets.get_type_dir('Co-expression'), 'coexpression_links')
+        self.assertEqual(ingest_crossnets.get_dataset_name('links.tsv', 'links.tsv'), 'links')
+
+    def test_parallel_matches_serial(self):
+        serial_dir, _ = self.ingest('serial', 1)
+        parallel_dir, _ = self.ingest('parallel', 3)
+        serial = read_dir(serial_dir)
+        self.assertEqual(serial, read_dir(parallel_dir))
+        self.assertEqual(sorted(os.listdir(serial_dir)), ['any_links', 'coexpression_links', 'pathway_links'])
+        full_file = os.path.join(serial_dir, 'coexpression_links', utils.get_full_cross_file_name('gene', 'gene'))
+        ledger = utils.read_ledger(full_file)
+        self.assertEqual(ledger, utils.scan_table(full_file))
+        self.assertEqual(ledger['dataset_ids'], [0, 1])
+        # Dataset 0 (A-2007) comes first, so its edges get the first mambo ids.
+        db_file = os.path.join(serial_dir, 'coexpression_links', utils.get_cross_file_name('gene', 'gene', 0, 'A-2007'))
+        rows = [line.split('\t') for line in serial[os.path.relpath(db_file, serial_dir)] if line[0] != '#']
+        self.assertEqual(rows[0][0], '0')
+
+    def test_mode_files_parsed_once_per_session(self):
+        import mode_cache
+        with mode_cache.session() as cache:
+            for name in ('first', 'second'):
+                self.ingest(name, 1)
+        self.assertEqual((cache.misses, cache.hits), (1, 1))
+
+    def test_missing_ids(self):
+        import ingest_crossnets
+        with self.assertRaises(KeyError):
+            ingest_crossnets.ingest_crossnets(self.input_dir, TYPES, self.mode_file, self.mode_file,
+                                              os.path.join(self.tmp_dir, 'out'), skip_missing_ids=False,
+                                              num_workers=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+'''
+file: test_lookup_service.py
+
+Tests for the lookup service (see lookup_service.py). Like the service, they require Python 3,
+and are skipped under Python 2.
+
+Usage:
+python3 -m unittest test_lookup_service
+'''
+
+import json
+import os
+import socket
+import threading
+import unittest
+
+from testing import TableTestCase
+
+try:
+    import asyncio
+    import lookup_service
+except (ImportError, SyntaxError):
+    lookup_service = None
+
+# (mambo_nid, dataset_nid, score) rows of a gene mode table.
+GENES = [(0, 'ENSG0', 'a'), (2, 'ENSG2', 'b'), (1, 'ENSG1', 'c')]
+# (src, dst) edges of a gene-gene crossnet.
+EDGES = [(0, 1), (0, 2), (2, 1)]
+
+
+@unittest.skipIf(lookup_service is None, 'requires Python 3')
+class LookupServiceTest(TableTestCase):
+
+    def setUp(self):
+        super(LookupServiceTest, self).setUp()
+        mode_file = self.write_table('miner-gene-0-ICGC-20160520.tsv', ['mambo_nid', 'dataset_nid', 'score'], GENES)
+        crossnet_file = self.write_table('miner-gene-gene.tsv',
+                                         ['mambo_eid', 'dataset_id', 'src_mambo_nid', 'dst_mambo_nid'],
+                                         [(eid, 0) + edge for eid, edge in enumerate(EDGES)])
+        catalog = {'modes': {'gene': {'max_id': 2}},
+                   'crossnets': {'gene-gene': {'path': crossnet_file, 'src': 'gene', 'dst': 'gene',
+                                               'num_edges': len(EDGES)}}}
+        missing_file = os.path.join(self.tmp_dir, 'miner-gene-1-GONE-20160520.tsv')
+        self.index = lookup_service.LookupIndex(catalog, os.path.join(self.tmp_dir, 'indexes'),
+                                                [mode_file, missing_file])
+        self.service = lookup_service.LookupService(self.index)
+
+    def post(self, path, request):
+        status, response = self.service.handle('POST', path, json.dumps(request).encode('utf-8'))
+        return status, json.loads(response.decode('utf-8'))
+
+    def test_lookups(self):
+        status, response = self.post('/mambo_ids', {'mode': 'gene', 'dataset': 'ICGC', 'ids': ['ENSG2', 'X']})
+        self.assertEqual((status, response), (200, {'mambo_ids': [2, None]}))
+        status, response = self.post('/dataset_ids', {'mode': 'gene', 'dataset': 'ICGC', 'mambo_ids': [1, 2, 7]})
+        self.assertEqual(response, {'dataset_ids': ['ENSG1', 'ENSG2', None]})
+        status, response = self.post('/attributes', {'mode': 'gene', 'dataset': 'ICGC', 'mambo_ids': [2]})
+        self.assertEqual(response, {'columns': ['score'], 'attributes': [['b']]})
+        status, response = self.post('/neighbors', {'crossnet': 'gene-gene', 'direction': 'in', 'mambo_ids': [1, 9]})
+        self.assertEqual(response, {'neighbors': [[0, 2], []], 'edge_ids': [[0, 2], []]})
+
+    def test_errors(self):
+        status, _ = self.post('/mambo_ids', {'mode': 'gene', 'dataset': 'STRING', 'ids': []})
+        self.assertEqual(status, 400)
+        status, _ = self.service.handle('POST', '/mambo_ids', b'not json')
+        self.assertEqual(status, 400)
+        status, response = self.post('/mambo_ids', {'mode': 'gene', 'dataset': 'GONE', 'ids': ['ENSG0']})
+        self.assertEqual(status, 500)
+        self.assertIn('error', response)
+        status, _ = self.service.handle('GET', '/nothing')
+        self.assertEqual(status, 404)
+
+    def test_load(self):
+        del self.index.mode_files[('gene', 'GONE')]
+        self.index.load()
+        self.assertEqual(sorted(self.index.mode_tables), [('gene', 'ICGC')])
+        self.assertIn('gene-gene', self.index.engine.indexes)
+
+    def request_all(self, raw_requests, before_request=None, on_response=None):
+        '''Sends raw HTTP requests, each over its own connection, to a server on a free port;
+        returns the raw responses, in the order they were received. before_request and
+        on_response are called with the index of every request before it is sent and when its
+        response was received.'''
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(self.service.handle_connection, '127.0.0.1', 0))
+        responses = []
+
+        def client(index, raw_request):
+            if before_request is not None:
+                before_request(index)
+            conn = socket.create_connection(server.sockets[0].getsockname()[:2])
+            conn.sendall(raw_request)
+            chunks = []
+            while True:
+                chunk = conn.recv(1 << 16)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            conn.close()
+            responses.append((index, b''.join(chunks)))
+            if on_response is not None:
+                on_response(index)
+
+        threads = [threading.Thread(target=client, args=(index, raw_request))
+                   for index, raw_request in enumerate(raw_requests)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            loop.run_until_complete(asyncio.sleep(0.01))
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+        return responses
+
+    def request(self, raw_request):
+        '''Sends raw HTTP requests over one connection; returns the raw response.'''
+        return self.request_all([raw_request])[0][1]
+
+    def test_connection(self):
+        body = json.dumps({'crossnet': 'gene-gene', 'mambo_ids': [0]}).encode('utf-8')
+        request = b'POST /neighbors HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body)
+        response = self.request(request + b'GET /tables HTTP/1.1\r\nConnection: close\r\n\r\n')
+        self.assertEqual(response.count(b'HTTP/1.1 200 OK'), 2)
+        self.assertIn(b'{"neighbors": [[1, 2]], "edge_ids": [[0, 1]]}', response)
+        response = self.request(b'POST /neighbors HTTP/1.1\r\nContent-Length: x\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 400 Bad Request'))
+
+    def test_slow_request_does_not_block(self):
+        started = threading.Event()
+        released = threading.Event()
+
+        def slow(request):
+            started.set()
+            released.wait(10)
+            return {}
+        self.service.handlers['/slow'] = slow
+        responses = self.request_all([b'POST /slow HTTP/1.1\r\nContent-Length: 2\r\nConnection: close\r\n\r\n{}',
+                                      b'GET /stats HTTP/1.1\r\nConnection: close\r\n\r\n'],
+                                     lambda index: index == 1 and started.wait(10),
+                                     lambda index: released.set())
+        # /stats is answered while /slow still waits in a worker thread.
+        self.assertEqual([index for index, _ in responses], [1, 0])
+        self.assertTrue(all(response.startswith(b'HTTP/1.1 200 OK') for _, response in responses))
+
+
+if __name__ == '__main__':
+    unittest.main()
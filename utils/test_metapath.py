@@ -0,0 +1,105 @@
+'''
+file: test_metapath.py
+
+Tests for the metapath query engine (see metapath.py).
+
+Usage:
+python -m unittest test_metapath
+'''
+
+import os
+import unittest
+
+import metapath
+from testing import TableTestCase
+
+CROSSNET_HEADER = ['mambo_eid', 'dataset_id', 'src_mambo_nid', 'dst_mambo_nid']
+# Edges of a gene-gene crossnet, stored once as src -> dst, with a self loop on gene 3.
+GENE_GENE = [(0, 1), (1, 2), (3, 3), (3, 0)]
+# Edges of a chemical-gene crossnet.
+CHEMICAL_GENE = [(0, 0), (1, 2)]
+
+
+class MetapathTest(TableTestCase):
+
+    def setUp(self):
+        super(MetapathTest, self).setUp()
+        crossnets = {}
+        for name, src, dst, edges in (('gene-gene', 'gene', 'gene', GENE_GENE),
+                                      ('chemical-gene', 'chemical', 'gene', CHEMICAL_GENE)):
+            path = self.write_crossnet(name, edges)
+            crossnets[name] = {'path': path, 'src': src, 'dst': dst, 'num_edges': len(edges)}
+        catalog = {'modes': {'gene': {'max_id': 3}, 'chemical': {'max_id': 1}}, 'crossnets': crossnets}
+        self.engine = metapath.MetapathEngine(catalog, os.path.join(self.tmp_dir, 'indexes'), num_workers=1)
+
+    def write_crossnet(self, name, edges):
+        return self.write_table(name + '.tsv', CROSSNET_HEADER,
+                                [(eid, 0, src_nid, dst_nid) for eid, (src_nid, dst_nid) in enumerate(edges)])
+
+    def test_same_mode_crossnet_is_undirected(self):
+        self.assertEqual(metapath.resolve_metapath(self.engine.catalog, ['gene', 'gene']),
+                         (('gene-gene', 'both'),))
+        result = self.engine.query(['gene', 'gene'], [0, 1, 2, 3]).as_dict()
+        self.assertEqual(result, {0: {1: 1, 3: 1}, 1: {0: 1, 2: 1}, 2: {1: 1}, 3: {0: 1, 3: 1}})
+
+    def test_path_counts(self):
+        result = self.engine.query(['chemical', 'gene', 'gene'], [0, 1]).as_dict()
+        self.assertEqual(result, {0: {1: 1, 3: 1}, 1: {1: 1}})
+        result = self.engine.query(['gene', 'gene', 'chemical'], [1]).as_dict()
+        self.assertEqual(result, {1: {0: 1, 1: 1}})
+
+    def test_materialized_query(self):
+        steps = metapath.resolve_metapath(self.engine.catalog, ['chemical', 'gene', 'gene'])
+        expected = self.engine.query(['chemical', 'gene', 'gene'], [0, 1]).as_dict()
+        for _ in range(5):
+            self.engine.query(['chemical', 'gene', 'gene'], [0, 1])
+        path = self.engine.get_materialized_dir_name(steps)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.engine.materialize(steps), path)
+        # Other seeds than the cached results, so the materialized metapath is read.
+        self.assertEqual(self.engine.query(['chemical', 'gene', 'gene'], [1, 0]).as_dict(), expected)
+
+    def test_materialize_frequent(self):
+        for modes, num_queries in ((['chemical', 'gene'], 1), (['gene', 'gene'], 3), (['chemical', 'gene', 'gene'], 2)):
+            for _ in range(num_queries):
+                self.engine.query(modes, [0])
+        frequent = self.engine.frequent_metapaths(2)
+        self.assertEqual(frequent, [(('gene-gene', 'both'),), (('chemical-gene', 'out'), ('gene-gene', 'both'))])
+        self.assertEqual(self.engine.frequent_metapaths(5, min_queries=3), frequent[:1])
+        paths = self.engine.materialize_frequent(1)
+        self.assertEqual(paths, [self.engine.get_materialized_dir_name(frequent[0])])
+        self.assertTrue(os.path.isdir(paths[0]))
+        self.assertFalse(os.path.exists(self.engine.get_materialized_dir_name(frequent[1])))
+
+    def test_result_cache(self):
+        self.engine.result_cache_size = 2
+        result = self.engine.query(['chemical', 'gene'], [0, 1])
+        self.assertIs(self.engine.query(['chemical', 'gene'], [0, 1]), result)
+        self.assertEqual(result.as_dict(), {0: {0: 1}, 1: {2: 1}})
+        # A crossnet table that grew invalidates the results that use it.
+        with open(self.engine.catalog['crossnets']['chemical-gene']['path'], 'a') as outF:
+            outF.write('2\t0\t0\t2\n')
+        result = self.engine.query(['chemical', 'gene'], [0, 1])
+        self.assertEqual(result.as_dict(), {0: {0: 1, 2: 1}, 1: {2: 1}})
+        # The least recently used result is evicted.
+        self.engine.query(['chemical', 'gene'], [0])
+        self.engine.query(['chemical', 'gene'], [1])
+        self.assertEqual(len(self.engine.results), 2)
+        self.assertIsNot(self.engine.query(['chemical', 'gene'], [0, 1]), result)
+
+    def test_stale_index(self):
+        index_path = self.engine.get_index('chemical-gene').path
+        self.assertTrue(self.engine.is_current(index_path, ['chemical-gene']))
+        # Rewritten with the same number of edges.
+        self.write_crossnet('chemical-gene', [(0, 1), (1, 2)])
+        self.assertFalse(self.engine.is_current(index_path, ['chemical-gene']))
+        self.engine.indexes.clear()
+        self.assertEqual(self.engine.query(['chemical', 'gene'], [0]).as_dict(), {0: {1: 1}})
+        self.assertTrue(self.engine.is_current(index_path, ['chemical-gene']))
+        # A mode that grew.
+        self.engine.catalog['modes']['gene']['max_id'] = 4
+        self.assertFalse(self.engine.is_current(index_path, ['chemical-gene']))
+
+
+if __name__ == '__main__':
+    unittest.main()
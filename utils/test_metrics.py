@@ -0,0 +1,81 @@
+'''
+file: test_metrics.py
+
+Tests for the build instrumentation (see metrics.py).
+
+Usage:
+python -m unittest test_metrics
+'''
+
+import io
+import json
+import os
+import time
+import unittest
+
+from metrics import BuildMetrics, StageSampler
+from testing import TableTestCase
+
+
+class BuildMetricsTest(TableTestCase):
+
+    def test_stages_and_counters(self):
+        metrics = BuildMetrics('build')
+        for _ in range(2):
+            with metrics.stage('read'):
+                time.sleep(0.01)
+        with self.assertRaises(KeyError):
+            with metrics.stage('convert'):
+                raise KeyError('G9')
+        metrics.add('rows_read', 3)
+        metrics.add('rows_read')
+        metrics.set('output_files', ['out.tsv'])
+        results = metrics.results()
+        self.assertEqual(sorted(results['stages']), ['convert', 'read'])
+        self.assertTrue(results['stages']['read'] >= 0.02)
+        self.assertEqual(results['counters'], {'rows_read': 4})
+        self.assertEqual((results['name'], results['output_files']), ('build', ['out.tsv']))
+        self.assertIn('lines_per_sec', results)
+
+    def test_finish(self):
+        metrics_file = os.path.join(self.tmp_dir, 'metrics.jsonl')
+        events = []
+        for name in ('first', 'second'):
+            metrics = BuildMetrics(name, metrics_file=metrics_file, callback=events.append)
+            metrics.add('rows_written', 2)
+            self.assertEqual(metrics.finish()['name'], name)
+            # Only the first call reports.
+            self.assertIsNone(metrics.finish())
+        with open(metrics_file, 'r') as inF:
+            lines = [json.loads(line) for line in inF]
+        self.assertEqual([line['name'] for line in lines], ['first', 'second'])
+        self.assertEqual(lines[0]['counters'], {'rows_written': 2})
+        self.assertEqual(lines, events)
+
+    def test_progress(self):
+        stream = io.StringIO()
+        events = []
+        metrics = BuildMetrics(u'build', callback=events.append, progress_interval=0, progress_stream=stream)
+        metrics.progress(100)
+        self.assertEqual([(event['event'], event['lines']) for event in events], [('progress', 100)])
+        self.assertTrue(stream.getvalue().startswith(u'build: 100 lines in '))
+        metrics.progress_interval = 3600
+        metrics.progress(200)
+        self.assertEqual(len(events), 1)
+
+    def test_stage_sampler(self):
+        metrics = BuildMetrics()
+        sampler = StageSampler(metrics, rate=4)
+        sampled = [num_lines for num_lines in range(1, 10) if sampler.start(num_lines)]
+        self.assertEqual(sampled, [4, 8])
+        sampler.start(12)
+        time.sleep(0.01)
+        sampler.lap('split')
+        sampler.lap('write')
+        # The time of a sampled line stands for rate lines.
+        self.assertTrue(metrics.stages['split'] >= 0.04)
+        self.assertTrue(metrics.stages['write'] < metrics.stages['split'])
+
+
+if __name__ == '__main__':
+    unittest.main()
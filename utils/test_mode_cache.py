@@ -0,0 +1,78 @@
+'''
+file: test_mode_cache.py
+
+Tests for the session cache of parsed mode tables (see mode_cache.py).
+
+Usage:
+python -m unittest test_mode_cache
+'''
+
+import unittest
+
+import mode_cache
+import utils
+from testing import TableTestCase
+
+
+def get_rows(num_rows, prefix):
+    return [(i, '%s%d' % (prefix, i)) for i in range(num_rows)]
+
+
+class ModeCacheTest(TableTestCase):
+
+    def setUp(self):
+        super(ModeCacheTest, self).setUp()
+        self.paths = [self.write_table('mode-%d.tsv' % i, ['mambo_nid', 'dataset_nid'], get_rows(50, 'N%d-' % i))
+                      for i in range(3)]
+        self.loaded = []
+        self.size = mode_cache.estimate_size(utils._read_mode_file(self.paths[0]))
+
+    def load(self, path):
+        self.loaded.append(path)
+        return utils._read_mode_file(path)
+
+    def test_lru_eviction(self):
+        # Room for two of the three tables.
+        cache = mode_cache.ModeCache(int(self.size * 2.5))
+        for i in [0, 1, 0, 2, 0, 1]:
+            self.assertEqual(cache.get(self.paths[i], self.load)['N%d-7' % i], 7)
+        # Table 1 is evicted by table 2 and table 2 by table 1; table 0 stays in use.
+        self.assertEqual(self.loaded, [self.paths[i] for i in [0, 1, 2, 1]])
+        self.assertEqual(cache.stats()['evictions'], 2)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['tables'], 2)
+        self.assertTrue(cache.memory_used <= cache.memory_budget)
+
+    def test_table_over_budget(self):
+        cache = mode_cache.ModeCache(self.size // 2)
+        for _ in range(2):
+            cache.get(self.paths[0], self.load)
+        self.assertEqual(len(self.loaded), 2)
+        self.assertEqual(cache.stats()['tables'], 0)
+        self.assertEqual(cache.memory_used, 0)
+
+    def test_rewritten_table(self):
+        cache = mode_cache.ModeCache()
+        cache.get(self.paths[0], self.load)
+        self.write_table('mode-0.tsv', ['mambo_nid', 'dataset_nid'], get_rows(60, 'M'))
+        self.assertEqual(cache.get(self.paths[0], self.load)['M55'], 55)
+        self.assertEqual(len(self.loaded), 2)
+        self.assertEqual(cache.stats()['tables'], 1)
+        self.assertEqual(cache.memory_used, mode_cache.estimate_size(utils._read_mode_file(self.paths[0])))
+
+    def test_session(self):
+        self.assertIsNone(mode_cache.get_session())
+        with mode_cache.session() as outer:
+            first = utils.read_mode_file(self.paths[0])
+            self.assertIs(utils.read_mode_file(self.paths[0]), first)
+            with mode_cache.session() as inner:
+                self.assertIsNot(utils.read_mode_file(self.paths[0]), first)
+                self.assertIs(mode_cache.get_session(), inner)
+            self.assertIs(mode_cache.get_session(), outer)
+            self.assertEqual(outer.stats()['hits'], 1)
+        self.assertIsNone(mode_cache.get_session())
+        self.assertEqual(outer.stats()['tables'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+'''
+file: test_mode_delta_log.py
+
+Tests for the delta log of mapped full mode tables (see mode_delta_log.py).
+
+Usage:
+python -m unittest test_mode_delta_log
+'''
+
+import os
+import unittest
+
+import compression
+import csr_adjacency
+import mode_delta_log
+import utils
+from create_mapped_mode_table import create_mapped_mode_table
+from testing import TableTestCase
+
+# (dataset id, node names, memory budget) of the datasets added, in order.
+DATASETS = [
+    (0, ['a', 'b', 'c'], None),
+    (1, ['b', 'd'], 1000),
+    (2, ['c', 'd', 'e'], 1000),
+]
+
+
+class DeltaLogTest(TableTestCase):
+
+    def build(self, name, delta_from):
+        '''Adds DATASETS to a new mapped mode, with the delta log from dataset delta_from on.'''
+        out = os.path.join(self.tmp_dir, name)
+        os.makedirs(out)
+        mapping_file = os.path.join(out, 'mapping.tsv')
+        with open(mapping_file, 'w') as outF:
+            outF.write('# mambo_id\tname\n')
+            for i, node in enumerate(['a', 'b', 'c']):
+                outF.write('%d\t%s\n' % (i, node))
+        full_mode_file = os.path.join(out, 'miner-node-full.tsv')
+        for db_id, nodes, memory_budget in DATASETS:
+            input_file = os.path.join(out, 'input-%d.tsv' % db_id)
+            with open(input_file, 'w') as outF:
+                outF.write('name\n')
+                outF.writelines('%s\n' % node for node in nodes)
+            create_mapped_mode_table('node', input_file, 'D%d' % db_id, db_id, mapping_file, False, 1, 0,
+                                     out, full_mode_file, os.path.join(out, 'db-%d.tsv' % db_id),
+                                     memory_budget=memory_budget, tmp_dir=out, delta_log=db_id >= delta_from)
+        return full_mode_file
+
+    def read_rows(self, full_mode_file):
+        with compression.open_file(full_mode_file) as inF:
+            return [line for line in inF if line[0] != '#']
+
+    def test_external_builds_keep_base(self):
+        reference = mode_delta_log.read_full_mode_table(self.build('rewrite', len(DATASETS)))
+        full_mode_file = self.build('delta', 1)
+        self.assertEqual(self.read_rows(full_mode_file), ['0\t0\n', '1\t0\n', '2\t0\n'])
+        self.assertEqual(mode_delta_log.read_full_mode_table(full_mode_file), reference)
+        self.assertEqual(reference[3], set([1, 2]))
+        self.assertEqual(mode_delta_log.compact(full_mode_file), len(reference))
+        self.assertFalse(os.path.isfile(mode_delta_log.get_delta_log_file_name(full_mode_file)))
+        self.assertEqual(mode_delta_log.read_full_mode_table(full_mode_file), reference)
+
+    def test_delta_only(self):
+        reference = mode_delta_log.read_full_mode_table(self.build('rewrite', len(DATASETS)))
+        full_mode_file = self.build('delta', 0)
+        self.assertEqual(self.read_rows(full_mode_file), [])
+        mode_delta_log.compact(full_mode_file)
+        self.assertEqual(mode_delta_log.read_full_mode_table(full_mode_file), reference)
+
+    def test_readers_see_pending_log(self):
+        full_mode_file = self.build('delta', 1)
+        # Node e (mambo id 4) is only in the delta log.
+        self.assertEqual(utils.get_max_id(full_mode_file), 5)
+        catalog = {'modes': {'node': {'path': full_mode_file, 'max_id': 2}}}
+        with self.assertRaises(ValueError):
+            csr_adjacency.get_num_nodes(catalog, 'node')
+        mode_delta_log.compact(full_mode_file)
+        self.assertEqual(utils.get_max_id(full_mode_file), 5)
+        self.assertEqual(csr_adjacency.get_num_nodes(catalog, 'node'), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
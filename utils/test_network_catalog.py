@@ -0,0 +1,44 @@
+'''
+file: test_network_catalog.py
+
+Tests for writing and refreshing network catalogs (see network_catalog.py).
+
+Usage:
+python -m unittest test_network_catalog
+'''
+
+import os
+import unittest
+
+import network_catalog
+import network_utils
+from testing import TableTestCase
+
+
+class NetworkCatalogTest(TableTestCase):
+
+    def test_refresh_catalog(self):
+        gene_file = self.write_table('miner-gene.tsv', ['mambo_nid', 'dataset_id'], [(0, 0), (1, 0)])
+        crossnet_file = self.write_table('miner-gene-gene.tsv', None, [(0, 1, 0, 1)])
+        mode_tables, crossnet_tables = network_catalog.parse_table_specs(
+            ['gene=' + gene_file], ['gene,gene,GeneGeneId=' + crossnet_file])
+        self.assertEqual(crossnet_tables, [{'src': 'gene', 'dst': 'gene', 'edge_id': 'GeneGeneId',
+                                            'path': crossnet_file, 'prefix': 'miner'}])
+        catalog_file = os.path.join(self.tmp_dir, 'miner.catalog')
+        network_utils.write_catalog(catalog_file, network_utils.build_catalog(mode_tables, crossnet_tables))
+        with open(crossnet_file, 'a') as outF:
+            outF.write('1\t2\t1\t0\n')
+        catalog = network_catalog.refresh_catalog(catalog_file)
+        self.assertEqual(network_utils.read_catalog(catalog_file), catalog)
+        self.assertEqual(network_utils.get_catalog_num_elem_per_link(catalog), {'miner-gene-gene': 2})
+        self.assertEqual(catalog['crossnets']['miner-gene-gene']['dataset_ids'], [1, 2])
+
+    def test_malformed_specs(self):
+        with self.assertRaises(ValueError):
+            network_catalog.parse_table_specs(['gene'], [])
+        with self.assertRaises(ValueError):
+            network_catalog.parse_table_specs([], ['gene,GeneGeneId=miner-gene-gene.tsv'])
+
+
+if __name__ == '__main__':
+    unittest.main()
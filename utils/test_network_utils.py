@@ -0,0 +1,194 @@
+'''
+file: test_network_utils.py
+
+Tests for loading tables and networks (see network_utils.py).
+
+Usage:
+python -m unittest test_network_utils
+'''
+
+import os
+import unittest
+
+import snap
+
+import network_utils
+import utils
+from create_mapped_mode_table import create_mapped_mode_table
+from metrics import BuildMetrics
+from testing import TableTestCase
+
+GENES = [(0, 0), (1, 0), (2, 1)]
+PROTEINS = [(0, 1), (1, 1)]
+# (mambo_eid, dataset_id, src_mambo_nid, dst_mambo_nid) rows of a gene-protein crossnet.
+GENE_PROTEIN = [(0, 2, 0, 1), (1, 2, 2, 0), (2, 3, 1, 1)]
+
+MODE_HEADER = ['mambo_nid', 'dataset_id']
+CROSSNET_HEADER = ['mambo_eid', 'dataset_id', 'src_mambo_nid', 'dst_mambo_nid']
+
+
+def read_rows(table, columns):
+    rows = []
+    rowi = table.BegRI()
+    while rowi < table.EndRI():
+        rows.append(tuple(rowi.GetIntAttr(name) for name, _ in columns))
+        rowi.Next()
+    return rows
+
+
+def get_out_edges(Graph, srcName, crossName):
+    '''Returns a dictionary from the nodes of the source mode of a crossnet to their edge ids.'''
+    ModeNet = Graph.GetModeNetByName(srcName)
+    out_edges = {}
+    for node in ModeNet.Nodes():
+        edge_ids = snap.TIntV()
+        ModeNet.GetNeighborsByCrossNet(node.GetId(), crossName, edge_ids, True)
+        out_edges[node.GetId()] = sorted(edge_ids)
+    return out_edges
+
+
+class NetworkTest(TableTestCase):
+
+    def setUp(self):
+        super(NetworkTest, self).setUp()
+        self.mode_tables = {'gene': self.write_table('miner-gene.tsv', MODE_HEADER, GENES),
+                            'protein': self.write_table('miner-protein.tsv', MODE_HEADER, PROTEINS)}
+        self.crossnet_tables = [{'edge_id': 'GeneProteinId', 'src': 'gene', 'dst': 'protein',
+                                 'path': self.write_table('miner-gene-protein.tsv', CROSSNET_HEADER, GENE_PROTEIN)}]
+
+    def test_table_cache_round_trip(self):
+        columns = network_utils.get_crossnet_columns('GeneProteinId', 'gene', 'protein')
+        metrics = BuildMetrics()
+        for _ in range(2):
+            table = network_utils.load_table(columns, self.crossnet_tables[0]['path'], snap.TTableContext(), metrics)
+            self.assertEqual(read_rows(table, columns), GENE_PROTEIN)
+        self.assertEqual(metrics.counters, {'table_cache_misses': 1, 'table_cache_hits': 1})
+        self.assertTrue(os.path.isfile(network_utils.get_table_cache_file_name(self.crossnet_tables[0]['path'])))
+
+    def append_rows(self, path, rows):
+        with open(path, 'a') as outF:
+            outF.writelines('\t'.join(str(value) for value in row) + '\n' for row in rows)
+
+    def test_build_network_incremental(self):
+        graph_file = os.path.join(self.tmp_dir, 'miner.graph')
+        Graph, reloaded = network_utils.build_network_incremental(graph_file, self.mode_tables, self.crossnet_tables)
+        self.assertEqual(reloaded, ['gene', 'protein', 'miner-protein-gene'])
+        self.assertEqual(network_utils.build_network_incremental(graph_file, self.mode_tables,
+                                                                 self.crossnet_tables)[1], [])
+        # A new dataset appended to the gene table and to the crossnet is added in place.
+        self.append_rows(self.mode_tables['gene'], [(3, 4)])
+        self.append_rows(self.crossnet_tables[0]['path'], [(3, 4, 3, 0)])
+        metrics = BuildMetrics()
+        Graph, reloaded = network_utils.build_network_incremental(graph_file, self.mode_tables, self.crossnet_tables,
+                                                                  metrics=metrics)
+        self.assertEqual(reloaded, [])
+        self.assertEqual(metrics.info['appended_tables'], {'gene': [4], 'miner-protein-gene': [4]})
+        Graph = snap.TMMNet.Load(snap.TFIn(graph_file))
+        self.assertEqual(network_utils.get_num_elem_per_mode(Graph), {'gene': 4, 'protein': 2})
+        self.assertEqual(network_utils.get_num_elem_per_link(Graph), {'miner-protein-gene': 4})
+        self.assertTrue(Graph.GetCrossNetByName('miner-protein-gene').IsEdge(3))
+        # A rewritten table is reloaded in full.
+        self.write_table('miner-gene-protein.tsv', CROSSNET_HEADER, GENE_PROTEIN[:2])
+        Graph, reloaded = network_utils.build_network_incremental(graph_file, self.mode_tables, self.crossnet_tables)
+        self.assertEqual(reloaded, ['miner-protein-gene'])
+        self.assertEqual(network_utils.get_num_elem_per_link(Graph), {'miner-protein-gene': 2})
+
+    def test_catalog(self):
+        catalog = network_utils.build_catalog(self.mode_tables, self.crossnet_tables)
+        self.assertEqual(catalog['modes']['gene'], {'path': self.mode_tables['gene'], 'num_nodes': 3,
+                                                    'dataset_ids': [0, 1], 'min_id': 0, 'max_id': 2})
+        self.assertEqual(catalog['crossnets']['miner-protein-gene'],
+                         {'path': self.crossnet_tables[0]['path'], 'num_edges': 3, 'dataset_ids': [2, 3],
+                          'min_id': 0, 'max_id': 2, 'edge_id': 'GeneProteinId', 'src': 'gene',
+                          'dst': 'protein', 'prefix': 'miner'})
+        catalog_file = os.path.join(self.tmp_dir, 'miner.catalog')
+        network_utils.write_catalog(catalog_file, catalog)
+        self.assertEqual(network_utils.read_catalog(catalog_file), catalog)
+        self.assertEqual(network_utils.get_catalog_tables(catalog),
+                         (self.mode_tables, [dict(self.crossnet_tables[0], prefix='miner')]))
+        Graph = network_utils.load_network(self.mode_tables, self.crossnet_tables, num_workers=1)
+        self.assertEqual(network_utils.get_catalog_num_elem_per_mode(catalog), network_utils.get_num_elem_per_mode(Graph))
+        self.assertEqual(network_utils.get_catalog_num_elem_per_link(catalog), network_utils.get_num_elem_per_link(Graph))
+        # Current ledgers are read, not rewritten.
+        ledger_file = utils.get_ledger_file_name(self.mode_tables['gene'])
+        os.utime(ledger_file, (0, 0))
+        self.append_rows(self.crossnet_tables[0]['path'], [(3, 4, 2, 0)])
+        catalog = network_utils.build_catalog(self.mode_tables, self.crossnet_tables)
+        self.assertEqual(os.path.getmtime(ledger_file), 0)
+        self.assertEqual(network_utils.get_catalog_num_elem_per_link(catalog), {'miner-protein-gene': 4})
+
+    def test_lazy_network(self):
+        self.mode_tables['function'] = self.write_table('miner-function.tsv', MODE_HEADER, [(0, 5)])
+        self.crossnet_tables.append({'edge_id': 'ProteinFunctionId', 'src': 'protein', 'dst': 'function',
+                                     'path': self.write_table('miner-protein-function.tsv', CROSSNET_HEADER,
+                                                              [(0, 6, 1, 0)])})
+        network = network_utils.LazyNetwork(self.mode_tables, self.crossnet_tables)
+        # The counts come from the catalog, without loading any table.
+        self.assertEqual(network.get_num_elem_per_mode(), {'gene': 3, 'protein': 2, 'function': 1})
+        self.assertEqual(network.get_num_elem_per_link(), {'miner-protein-gene': 3, 'miner-function-protein': 1})
+        self.assertEqual((network.Graph.GetModeNets(), network.Graph.GetCrossNets()), (0, 0))
+        # The catalog is built once per network.
+        self.assertIs(network.get_catalog(), network.get_catalog())
+        # A crossnet is loaded with its modes only.
+        CrossNet = network.get_crossnet('miner-protein-gene')
+        self.assertEqual(CrossNet.GetEdges(), 3)
+        self.assertEqual((network.loaded_modes, network.loaded_crossnets), ({'gene', 'protein'}, {'miner-protein-gene'}))
+        self.assertEqual((network.Graph.GetModeNets(), network.Graph.GetCrossNets()), (2, 1))
+        network.unload_crossnet('miner-protein-gene')
+        self.assertEqual((network.loaded_crossnets, network.Graph.GetCrossNets()), (set(), 0))
+        self.assertEqual(network.get_crossnet('miner-protein-gene').GetEdges(), 3)
+        with self.assertRaises(ValueError):
+            network.get_crossnet('miner-gene-function')
+        # A saved catalog lists the tables.
+        network = network_utils.LazyNetwork(catalog=network.get_catalog())
+        self.assertEqual(network.get_crossnet_names(), ['miner-function-protein', 'miner-protein-gene'])
+        self.assertEqual(network.get_crossnet('miner-function-protein').GetEdges(), 1)
+        self.assertEqual(network.loaded_modes, {'protein', 'function'})
+
+    def test_pending_delta_log(self):
+        self.write_table('miner-gene.delta.tsv', ['mambo_nid', 'dataset_id'], [(3, 4)])
+        with self.assertRaises(ValueError):
+            network_utils.build_catalog(self.mode_tables, self.crossnet_tables)
+        with self.assertRaises(ValueError):
+            network_utils.load_network(self.mode_tables, self.crossnet_tables, num_workers=1)
+        with self.assertRaises(ValueError):
+            network_utils.LazyNetwork(self.mode_tables, self.crossnet_tables).get_mode('gene')
+
+    def test_load_network_from_cache(self):
+        for _ in range(2):
+            Graph = network_utils.load_network(self.mode_tables, self.crossnet_tables, num_workers=1)
+            self.assertEqual(network_utils.get_num_elem_per_mode(Graph), {'gene': 3, 'protein': 2})
+            self.assertEqual(network_utils.get_num_elem_per_link(Graph), {'miner-protein-gene': 3})
+
+    def test_graph_sink_matches_loaded_network(self):
+        metrics = BuildMetrics()
+        graph_sink = network_utils.GraphSink(metrics=metrics)
+        gene_sink = graph_sink.mode('gene')
+        # Node 0 is in two datasets and is added once.
+        gene_sink(GENES[:2])
+        gene_sink([(0, 2)] + GENES[2:])
+        graph_sink.mode('protein')(PROTEINS)
+        crossnet_sink = graph_sink.crossnet('gene', 'protein')
+        crossnet_sink(GENE_PROTEIN[:1])
+        crossnet_sink(GENE_PROTEIN[1:])
+        Graph = network_utils.load_network(self.mode_tables, self.crossnet_tables, num_workers=1)
+        for get_num_elem in (network_utils.get_num_elem_per_mode, network_utils.get_num_elem_per_link):
+            self.assertEqual(get_num_elem(graph_sink.Graph), get_num_elem(Graph))
+        out_edges = get_out_edges(Graph, 'gene', 'miner-protein-gene')
+        self.assertEqual(get_out_edges(graph_sink.Graph, 'gene', 'miner-protein-gene'), out_edges)
+        self.assertEqual(out_edges, {0: [0], 1: [2], 2: [1]})
+        self.assertEqual(metrics.counters, {'mode_rows': 6, 'crossnet_rows': 3})
+
+    def test_graph_sink_from_builder(self):
+        mapping_file = self.write_table('mapping.tsv', ['mambo_id', 'name'], [(0, 'a'), (1, 'b')])
+        graph_sink = network_utils.GraphSink()
+        for db_id, nodes in enumerate([['a', 'b'], ['b', 'c']]):
+            input_file = self.write_table('input-%d.tsv' % db_id, ['name'], [(node,) for node in nodes])
+            create_mapped_mode_table('node', input_file, 'D%d' % db_id, db_id, mapping_file, False, 1, 0,
+                                     self.tmp_dir, None, None, sink=graph_sink.mode('node'))
+        ModeNet = graph_sink.Graph.GetModeNetByName('node')
+        self.assertEqual(sorted(node.GetId() for node in ModeNet.Nodes()), [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+'''
+file: test_split_string_channels.py
+
+Tests for the STRING channel splitter (see split_string_channels.py). The test that ingests its
+output needs the crossnet builder, which requires Python 2; it is skipped under Python 3.
+
+Usage:
+python -m unittest test_split_string_channels
+'''
+
+import os
+import sys
+import unittest
+
+import compression
+import split_string_channels
+from testing import TableTestCase
+
+COLUMNS = ['protein1', 'protein2', 'neighborhood', 'fusion', 'combined_score']
+LINKS = [
+    ('9606.P0', '9606.P1', 0, 5, 150),
+    ('9606.P1', '9606.P2', 300, 0, 400),
+    ('10090.P3', '10090.P4', 0, 0, 700),
+    ('9606.P2', '9606.P0', 200, 0, 900),
+]
+PROTEINS = [(i, 'P%d' % i) for i in range(5)]
+
+
+def read_rows(path):
+    with compression.open_file(path) as inF:
+        return [line.rstrip('\n').split('\t') for line in inF]
+
+
+class SplitStringChannelsTest(TableTestCase):
+
+    def setUp(self):
+        super(SplitStringChannelsTest, self).setUp()
+        self.links_file = os.path.join(self.tmp_dir, 'protein.links.detailed.v10.txt.gz')
+        with compression.open_file(self.links_file, 'w') as outF:
+            outF.write(' '.join(COLUMNS) + '\n')
+            outF.writelines(' '.join(str(value) for value in link) + '\n' for link in LINKS)
+        self.output_dir = os.path.join(self.tmp_dir, 'channels')
+
+    def test_table_format(self):
+        # A one row buffer makes every row a separate append.
+        channel_rows = split_string_channels.split_string_channels(self.links_file, self.output_dir, buffer_lines=1)
+        self.assertEqual(channel_rows, {'neighborhood': 2, 'fusion': 1, 'combined_score': 4})
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ['combined_score.tsv', 'fusion.tsv', 'neighborhood.tsv'])
+        rows = read_rows(os.path.join(self.output_dir, 'neighborhood.tsv'))
+        self.assertEqual(rows, [['# protein1'] + COLUMNS[1:], list(map(str, LINKS[1])), list(map(str, LINKS[3]))])
+
+    def test_crossnet_format(self):
+        channel_rows = split_string_channels.split_string_channels(self.links_file, self.output_dir,
+                                                                   ['fusion', 'combined_score'], 'crossnet')
+        self.assertEqual(channel_rows, {'fusion': 1, 'combined_score': 4})
+        self.assertEqual(sorted(os.listdir(self.output_dir)),
+                         ['combined_score-10090.tsv', 'combined_score-9606.tsv', 'fusion-9606.tsv'])
+        self.assertEqual(read_rows(os.path.join(self.output_dir, 'combined_score-10090.tsv')),
+                         [['# protein1', 'protein2', 'combined_score'], ['10090.P3', '10090.P4', '700']])
+
+    def test_unknown_channel(self):
+        with self.assertRaises(ValueError):
+            split_string_channels.split_string_channels(self.links_file, self.output_dir, ['experimental'])
+        with self.assertRaises(ValueError):
+            split_string_channels.split_string_channels(self.links_file, self.output_dir, output_format='csv')
+
+    @unittest.skipIf(sys.version_info[0] >= 3, 'the crossnet builder requires Python 2')
+    def test_ingest_crossnet_format(self):
+        import ingest_crossnets
+        import utils
+        split_string_channels.split_string_channels(self.links_file, self.output_dir, output_format='crossnet')
+        mode_file = self.write_table('miner-protein-0-STRING-20160520.tsv', ['mambo_nid', 'dataset_nid'], PROTEINS)
+        types, dataset_name = ingest_crossnets.PRESETS['string']
+        out = os.path.join(self.tmp_dir, 'out')
+        type_files = ingest_crossnets.ingest_crossnets(self.output_dir, types, mode_file, mode_file, out, dataset_name,
+                                                       src_mode_filter='remove_species_id:all',
+                                                       dst_mode_filter='remove_species_id:all',
+                                                       skip_missing_ids=False, num_workers=1)
+        self.assertEqual([os.path.basename(path) for path, _, _ in type_files['combined_score']],
+                         ['combined_score-10090.tsv', 'combined_score-9606.tsv'])
+        full_file = os.path.join(out, 'combined_score_links', utils.get_full_cross_file_name('protein', 'protein'))
+        rows = [row for row in read_rows(full_file) if row[0][0] != '#']
+        self.assertEqual(rows, [['0', '0', '3', '4'], ['1', '1', '0', '1'], ['2', '1', '1', '2'], ['3', '1', '2', '0']])
+        db_file = os.path.join(out, 'neighborhood_links', utils.get_cross_file_name('protein', 'protein', 0, 'STRING'))
+        self.assertEqual([row for row in read_rows(db_file) if row[0][0] != '#'],
+                         [['0', '0', '0', '300'], ['1', '0', '0', '200']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+'''
+file: test_utils.py
+
+Tests for the shared helpers in utils.py.
+
+Usage:
+python -m unittest test_utils
+'''
+
+import os
+import unittest
+
+import utils
+from testing import TableTestCase
+
+HEADER = ['mambo_nid', 'dataset_id']
+
+
+class FilterTest(unittest.TestCase):
+
+    def test_get_filter(self):
+        self.assertIsNone(utils.get_filter(None))
+        remove = utils.get_filter('remove_species_id:10090')
+        self.assertIs(utils.get_filter('remove_species_id:10090'), remove)
+        self.assertEqual(remove('10090.ENSMUSP1'), 'ENSMUSP1')
+        self.assertEqual(remove('9606.ENSP1'), '9606.ENSP1')
+        self.assertEqual(utils.get_filter('add_species_id:7227')('FBpp1'), '7227.FBpp1')
+        # Other functions in utils.py can still be named, as before id_filters.py.
+        self.assertEqual(utils.get_filter('get_ledger_file_name')('miner-gene.tsv'),
+                         utils.get_ledger_file_name('miner-gene.tsv'))
+        with self.assertRaises(ValueError):
+            utils.get_filter('no_such_filter')
+        with self.assertRaises(ValueError):
+            utils.get_filter('add_species_id:7227,10090')
+
+
+class LedgerTest(TableTestCase):
+
+    def setUp(self):
+        super(LedgerTest, self).setUp()
+        self.table_file = self.write_table('miner-gene.tsv', HEADER, [(0, 0), (1, 0), (2, 1)])
+
+    def append(self, rows):
+        with open(self.table_file, 'a') as outF:
+            outF.writelines('%d\t%d\n' % row for row in rows)
+
+    def test_get_max_id(self):
+        self.assertEqual(utils.get_max_id(os.path.join(self.tmp_dir, 'missing.tsv')), 0)
+        self.assertEqual(utils.get_max_id(self.table_file), 3)
+        utils.update_ledger(self.table_file)
+        self.append([(3, 2), (4, 2)])
+        self.assertEqual(utils.get_max_id(self.table_file), 5)
+        # The ids in a pending delta log are already allocated.
+        self.write_table('miner-gene.delta.tsv', HEADER, [(7, 3)])
+        self.assertEqual(utils.get_max_id(self.table_file), 8)
+
+    def test_incremental_ledger_matches_scan(self):
+        ledger = utils.update_ledger(self.table_file)
+        self.assertEqual(ledger, utils.scan_table(self.table_file))
+        self.assertEqual((ledger['min_id'], ledger['next_id'], ledger['num_rows'], ledger['num_lines']), (0, 3, 3, 4))
+        self.append([(3, 2)])
+        self.append([(4, 5), (5, 5)])
+        self.assertEqual(utils.update_ledger(self.table_file), utils.scan_table(self.table_file))
+        self.assertEqual(utils.read_ledger(self.table_file)['dataset_ids'], [0, 1, 2, 5])
+
+    def test_extend_ledger_matches_scan(self):
+        new_file = os.path.join(self.tmp_dir, 'miner-protein.tsv')
+        ledger = utils.read_ledger_before_append(new_file)
+        with open(new_file, 'w') as outF:
+            outF.write('# header\n0\t4\n1\t4\n')
+        ledger = utils.extend_ledger(new_file, ledger, 3, 0, 2, 4)
+        self.assertEqual(ledger, utils.scan_table(new_file))
+        with open(new_file, 'a') as outF:
+            outF.write('2\t6\n')
+        ledger = utils.extend_ledger(new_file, utils.read_ledger_before_append(new_file), 1, 2, 3, 6)
+        self.assertEqual(ledger, utils.scan_table(new_file))
+        # Without a current ledger, the table is scanned.
+        self.append([(3, 2)])
+        self.assertIsNone(utils.read_ledger_before_append(self.table_file))
+        self.assertEqual(utils.extend_ledger(self.table_file, None, 1, 3, 4, 2), utils.scan_table(self.table_file))
+
+    def test_get_ledger(self):
+        ledger_file = utils.get_ledger_file_name(self.table_file)
+        ledger = utils.get_ledger(self.table_file)
+        self.assertEqual(ledger, utils.scan_table(self.table_file))
+        # A current ledger is not rewritten.
+        os.utime(ledger_file, (0, 0))
+        self.assertEqual(utils.get_ledger(self.table_file), ledger)
+        self.assertEqual(os.path.getmtime(ledger_file), 0)
+        # A stale one is.
+        self.append([(3, 2)])
+        self.assertEqual(utils.get_ledger(self.table_file), utils.scan_table(self.table_file))
+        self.assertEqual(utils.read_ledger(self.table_file), utils.scan_table(self.table_file))
+        # A ledger that cannot be written is not an error.
+        os.remove(ledger_file)
+        os.mkdir(ledger_file)
+        self.append([(4, 2)])
+        self.assertEqual(utils.get_ledger(self.table_file), utils.scan_table(self.table_file))
+
+    def test_tail_validation(self):
+        utils.update_ledger(self.table_file)
+        self.assertIsNotNone(utils.read_ledger(self.table_file))
+        # A rewrite of the same size changes the tail.
+        self.write_table('miner-gene.tsv', HEADER, [(0, 0), (1, 0), (5, 1)])
+        self.assertIsNone(utils.read_ledger(self.table_file))
+        self.assertEqual(utils.get_max_id(self.table_file), 6)
+        self.assertEqual(utils.update_ledger(self.table_file), utils.scan_table(self.table_file))
+        # So does a truncation.
+        self.write_table('miner-gene.tsv', HEADER, [(0, 0)])
+        self.assertIsNone(utils.read_ledger(self.table_file))
+        self.assertEqual(utils.get_max_id(self.table_file), 1)
+        # A corrupt or outdated ledger is ignored.
+        with open(utils.get_ledger_file_name(self.table_file), 'w') as outF:
+            outF.write('{"size": 0')
+        self.assertIsNone(utils.read_ledger(self.table_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+'''
+file: testing.py
+
+Shared fixtures for the tests of the table builders and loaders (the test_*.py files).
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TableTestCase(unittest.TestCase):
+    '''A test case with a temporary directory, self.tmp_dir, that is removed after each test.'''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def write_table(self, name, header, rows):
+        '''Writes a tsv table to self.tmp_dir/name, with a '# ' header line if header is not
+        None and a line per row (a tuple of values); returns its path.'''
+        path = os.path.join(self.tmp_dir, name)
+        if os.path.dirname(name) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as outF:
+            if header is not None:
+                outF.write('# ' + '\t'.join(header) + '\n')
+            outF.writelines('\t'.join(str(value) for value in row) + '\n' for row in rows)
+        return path
@@ -4,27 +4,37 @@ author: Sheila Ramaswamy (@sramas15)
 
 File containing util functions useful for other scripts.
 '''
+import binascii
+import compression
+import id_filters
+import json
+import mode_cache
 import os
 from datetime import datetime
 
 
 HUMAN_SPECIES_ID = '9606'
+LEDGER_SUFFIX = '.ledger'
+DELTA_LOG_SUFFIX = '.delta.tsv'
+LEDGER_TAIL_SIZE = 64
 
 
 def get_filter(method_name):
-	'''Given a function name(string), returns the corresponding function in this file.
+	'''Given a filter spec (e.g. remove_species_id or remove_species_id:10090), returns the
+	compiled filter; see id_filters.py for the available filters.
+
+	For backwards compatibility, the name of any other function in this file is also accepted
+	and returns that function, memoized. Unknown names raise a ValueError.
 
 	Input:
-		method_name: string, function name.
+		method_name: string, filter spec.
 	Output:
-		a function in this file or None, if the function doesn't exist.
+		a function that filters one id (see id_filters.compile_filter) or None, if
+		method_name is None.
 	'''
-	if method_name is None:
-		return None
-	possibles = globals().copy()
-	possibles.update(locals())
-	method = possibles.get(method_name)
-	return method
+	if method_name is not None and method_name not in id_filters.FILTERS and callable(globals().get(method_name)):
+		return id_filters.memoize(globals()[method_name])
+	return id_filters.compile_filter(method_name)
 
 
 def remove_species_id(name):
@@ -68,6 +78,7 @@ def split_then_strip(string, split_char):
 
 def get_file_len(input_file):
 	'''Returns the length of the input_file; Returns 0 if the file does not exist.
+	Uses the ledger of the file if it has one, see read_ledger.
 
 	Input:
 	    input_file: path to the input file.
@@ -75,30 +86,247 @@ def get_file_len(input_file):
 	    number of lines in the file.
 	'''
 	if os.path.isfile(input_file):
-		return sum(1 for line in open(input_file, 'r'))
+		return scan_table(input_file, read_ledger(input_file))['num_lines']
 	return 0
 
 
 def get_max_id(input_file):
 	'''Returns the max snap id of the input_file; Returns 0 if the file does not exist.
-	Assumes file in format of snap mode or crossnet full table tsv file.
+	Assumes file in format of snap mode or crossnet full table tsv file. Uses the ledger
+	of the file if it has one, so that only the rows appended since the ledger was last
+	updated are read. The ids in the delta log of a mapped full mode table (see
+	mode_delta_log.py) are included.
 
 	Input:
 	    input_file: path to the input file.
 	Output:
 	    max snap id in input file.
 	'''
-	max_id = -1
-	if os.path.isfile(input_file):
-		with open(input_file, 'r') as inF:
-			for line in inF:
-				if line[0]=='#':
-					continue
-				new_id = int(line.strip().split('\t')[0])
-				if new_id > max_id:
-					max_id = new_id
-	max_id += 1
-	return max_id
+	next_id = 0
+	for table_file in (input_file, get_delta_log_file_name(input_file)):
+		if os.path.isfile(table_file):
+			next_id = max(next_id, scan_table(table_file, read_ledger(table_file))['next_id'])
+	return next_id
+
+
+def open_full_table(table_file, write_full_table=True):
+	'''Opens a full mode or crossnet table for appending, or the null device if the table
+	should not be written.
+
+	Input:
+	    table_file: path to the full table; may be compressed (see compression.py).
+	    write_full_table: if False, the rows written are discarded.
+	Output:
+	    a file object.
+	'''
+	if write_full_table:
+		return compression.open_file(table_file, 'a')
+	return open(os.devnull, 'w')
+
+
+def get_ledger_file_name(table_file):
+	'''Returns the path of the ledger kept next to a full mode or crossnet table.
+
+	Input:
+	    table_file: path to the full table.
+	Output:
+	    path to the ledger file.
+	'''
+	return table_file + LEDGER_SUFFIX
+
+
+def get_delta_log_file_name(table_file):
+	'''Returns the path of the delta log of a mapped full mode table (see mode_delta_log.py),
+	compressed like the table.
+
+	Input:
+	    table_file: path to the full mode table.
+	Output:
+	    path to the delta log.
+	'''
+	stripped = compression.strip_compression_suffix(table_file)
+	return os.path.splitext(stripped)[0] + DELTA_LOG_SUFFIX + table_file[len(stripped):]
+
+
+def check_no_delta_log(table_file):
+	'''Raises a ValueError if a full mode table has a delta log (see mode_delta_log.py). The
+	rows of the log are not in the table yet, so readers of the table alone would miss them;
+	the log has to be compacted into the table first.
+
+	Input:
+	    table_file: path to the full mode table.
+	'''
+	delta_file = get_delta_log_file_name(table_file)
+	if os.path.isfile(delta_file):
+		raise ValueError('%s has pending rows in its delta log %s; compact it first with '
+						 'mode_delta_log.py' % (table_file, delta_file))
+
+
+def read_ledger(table_file):
+	'''Reads the ledger of a full mode or crossnet table. The ledger records the next free
+	mambo id, the smallest mambo id (None for an empty table), the number of rows and lines
+	and the contributing dataset ids of the table, as of the table size it stores. Returns
+	None if the ledger is missing, or if the table was modified other than by appending since
+	the ledger was written.
+
+	Input:
+	    table_file: path to the full table.
+	Output:
+	    dictionary with the ledger contents, or None.
+	'''
+	ledger_file = get_ledger_file_name(table_file)
+	if not os.path.isfile(ledger_file) or not os.path.isfile(table_file):
+		return None
+	try:
+		with open(ledger_file, 'r') as inF:
+			ledger = json.load(inF)
+	except ValueError:
+		return None
+	if 'min_id' not in ledger:
+		# Written before ledgers recorded the smallest id.
+		return None
+	if os.path.getsize(table_file) < ledger['size'] or _read_tail(table_file, ledger['size']) != ledger['tail']:
+		return None
+	return ledger
+
+
+def update_ledger(table_file):
+	'''Brings the ledger of a full mode or crossnet table up to date, reading only the rows
+	appended since the last update when possible. The ledger is replaced atomically.
+
+	Input:
+	    table_file: path to the full table.
+	Output:
+	    dictionary with the new ledger contents.
+	'''
+	ledger = scan_table(table_file, read_ledger(table_file))
+	write_ledger(table_file, ledger)
+	return ledger
+
+
+def get_ledger(table_file):
+	'''Returns the up to date ledger of a full mode or crossnet table, for readers of the table.
+	Unlike update_ledger, the ledger file is left alone when it is current, and a stale ledger
+	that cannot be saved (e.g. because the table is in a read-only directory) is returned
+	anyway, so reading a table never requires write access.
+
+	Input:
+	    table_file: path to the full table.
+	Output:
+	    dictionary with the ledger contents.
+	'''
+	ledger = read_ledger(table_file)
+	if ledger is not None and ledger['size'] == os.path.getsize(table_file):
+		return ledger
+	ledger = scan_table(table_file, ledger)
+	try:
+		write_ledger(table_file, ledger)
+	except (IOError, OSError):
+		pass
+	return ledger
+
+
+def write_ledger(table_file, ledger):
+	'''Replaces the ledger of a full mode or crossnet table atomically.'''
+	ledger_file = get_ledger_file_name(table_file)
+	tmp_file = '%s.tmp%d' % (ledger_file, os.getpid())
+	with open(tmp_file, 'w') as outF:
+		json.dump(ledger, outF, sort_keys=True)
+	os.rename(tmp_file, ledger_file)
+
+
+def read_ledger_before_append(table_file):
+	'''Returns the ledger of a full mode or crossnet table that is about to be appended to, for
+	extend_ledger: an empty ledger if the table does not exist yet, the stored ledger if it is
+	up to date, or None if it is missing or stale.
+
+	Input:
+	    table_file: path to the full table.
+	Output:
+	    dictionary with the ledger contents, or None.
+	'''
+	if not os.path.isfile(table_file):
+		return {'size': 0, 'tail': '', 'min_id': None, 'next_id': 0, 'num_rows': 0, 'num_lines': 0,
+				'dataset_ids': []}
+	ledger = read_ledger(table_file)
+	if ledger is None or ledger['size'] != os.path.getsize(table_file):
+		return None
+	return ledger
+
+
+def extend_ledger(table_file, ledger, num_lines, first_id, next_id, dataset_id):
+	'''Brings the ledger of a full mode or crossnet table up to date after a builder appended
+	rows with the consecutive mambo ids first_id, ..., next_id - 1, all from one dataset,
+	without reading the rows back. Falls back to update_ledger if ledger is None.
+
+	Input:
+	    table_file: path to the full table.
+	    ledger: the ledger before the append, as returned by read_ledger_before_append.
+	    num_lines: number of lines appended, including comments.
+	    first_id, next_id: the range of the appended mambo ids.
+	    dataset_id: dataset id of the appended rows.
+	Output:
+	    dictionary with the new ledger contents.
+	'''
+	if ledger is None:
+		return update_ledger(table_file)
+	ledger = dict(ledger)
+	if next_id > first_id:
+		ledger['min_id'] = first_id if ledger['min_id'] is None else min(ledger['min_id'], first_id)
+		ledger['next_id'] = max(ledger['next_id'], next_id)
+		ledger['num_rows'] += next_id - first_id
+		ledger['dataset_ids'] = sorted(set(ledger['dataset_ids']) | set([dataset_id]))
+	ledger['num_lines'] += num_lines
+	ledger['size'] = os.path.getsize(table_file)
+	ledger['tail'] = _read_tail(table_file, ledger['size'])
+	write_ledger(table_file, ledger)
+	return ledger
+
+
+def scan_table(table_file, ledger=None):
+	'''Reads the rows of a full mode or crossnet table that come after the part described
+	by the given ledger (the whole table if ledger is None), and returns the resulting ledger.
+
+	Input:
+	    table_file: path to the full table.
+	    ledger: a ledger of the table, as returned by read_ledger, or None.
+	Output:
+	    dictionary with the ledger contents for the whole table.
+	'''
+	if ledger is None:
+		ledger = {'size': 0, 'min_id': None, 'next_id': 0, 'num_rows': 0, 'num_lines': 0, 'dataset_ids': []}
+	min_id = ledger['min_id']
+	max_id = ledger['next_id'] - 1
+	num_rows = ledger['num_rows']
+	num_lines = ledger['num_lines']
+	dataset_ids = set(ledger['dataset_ids'])
+	# Compressed tables are appended to in whole gzip members or zstd frames, so they can be
+	# read from the size recorded in the ledger too.
+	with compression.open_file(table_file, 'rb', ledger['size']) as inF:
+		for line in inF:
+			num_lines += 1
+			if line[:1] == b'#':
+				continue
+			vals = line.strip().split(b'\t')
+			new_id = int(vals[0])
+			if new_id > max_id:
+				max_id = new_id
+			if min_id is None or new_id < min_id:
+				min_id = new_id
+			if len(vals) > 1:
+				dataset_ids.update(int(db_id) for db_id in vals[1].split(b','))
+			num_rows += 1
+	size = os.path.getsize(table_file)
+	return {'size': size, 'tail': _read_tail(table_file, size), 'min_id': min_id, 'next_id': max_id + 1,
+			'num_rows': num_rows, 'num_lines': num_lines, 'dataset_ids': sorted(dataset_ids)}
+
+
+def _read_tail(table_file, size):
+	'''Returns the last bytes of the first size bytes of the file, as a hex string.'''
+	with open(table_file, 'rb') as inF:
+		start = max(0, size - LEDGER_TAIL_SIZE)
+		inF.seek(start)
+		return binascii.hexlify(inF.read(size - start)).decode('ascii')
 
 
 def get_current_date():
@@ -210,15 +438,24 @@ def parse_mode_name_from_name(file_name):
 
 
 def read_mode_file(map_file):
-	'''Reads the mapping between dataset specific ids to snap ids into a dictionary.
+	'''Reads the mapping between dataset specific ids to snap ids into a dictionary. While a
+	mode_cache session is active, each file is parsed once and the dictionary is shared by
+	all callers, which must not modify it.
 
 	Input:
-	    map_file: file containing the mapping.
+	    map_file: file containing the mapping; may be compressed (see compression.py).
 	Output:
 	    dictionary from the dataset specific ids to snap ids.
 	'''
+	cache = mode_cache.get_session()
+	if cache is not None:
+		return cache.get(map_file, _read_mode_file)
+	return _read_mode_file(map_file)
+
+
+def _read_mode_file(map_file):
 	mapping = {}
-	with open(map_file, 'r') as inF:
+	with compression.open_file(map_file) as inF:
 		for line in inF:
 			if len(line) == 0 or line[0] == '#':
 				continue